@@ -1,12 +1,20 @@
 import os
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from typing import List, Callable, Set, Any, Dict
+from dataclasses import dataclass
+from typing import List, Callable, Set, Any, Dict, NamedTuple
 from azure.ai.agents.models import (
     MessageImageUrlParam,
     MessageInputTextBlock,
     MessageInputImageUrlBlock,
-    FunctionTool, ToolSet
+    FunctionTool, ToolSet,
+    AgentStreamEvent,
+    AsyncAgentEventHandler,
+    MessageDeltaChunk,
+    ThreadMessage,
+    ThreadRun,
+    SubmitToolOutputsAction,
+    RequiredFunctionToolCall
 )
 from azure.ai.projects.models import (
     EvaluatorIds,
@@ -18,16 +26,17 @@ from tools.inventoryCheck import inventory_check
 from tools.aiSearchTools import product_recommendations
 
 from opentelemetry import trace
-from azure.monitor.opentelemetry import configure_azure_monitor
+from utils.telemetry_utils import configure_telemetry
+from services.tool_service import tool_executor
+from services.thread_mirror_service import thread_mirror, message_text
+from services.context_service import thread_context
 from azure.ai.agents.telemetry import trace_function
 import asyncio
 from concurrent.futures import ThreadPoolExecutor
 import time
 # from opentelemetry.instrumentation.openai_v2 import OpenAIInstrumentor
 
-# # Enable Azure Monitor tracing
-application_insights_connection_string = os.environ["APPLICATIONINSIGHTS_CONNECTION_STRING"]
-configure_azure_monitor(connection_string=application_insights_connection_string)
+# # Azure Monitor tracing is enabled on first use, once per worker process (not at import)
 # OpenAIInstrumentor().instrument()
 
 # scenario = os.path.basename(__file__)
@@ -39,59 +48,115 @@ _executor = ThreadPoolExecutor(max_workers=8)
 # Cache for toolset configurations to avoid repeated initialization
 _toolset_cache: Dict[str, ToolSet] = {}
 
+class AgentRunEvent(NamedTuple):
+    """Event of a streaming agent run: "delta" (text), "tool_call" (function names), "tool_output" (function names) or "error"."""
+    kind: str
+    data: Any
+
+class RunContext(NamedTuple):
+    """Per-call state of an agent run; the agent handle itself is shared by every session."""
+    thread_id: str
+
+@dataclass(frozen=True)
+class AgentHandle:
+    """Immutable description of a deployed agent: its id and prebuilt toolset."""
+    agent_id: str
+    agent_type: str
+    toolset: ToolSet
+
+def get_agent_toolset(agent_type: str) -> ToolSet:
+    """Get cached toolset or create new one to avoid repeated initialization."""
+    if agent_type in _toolset_cache:
+        return _toolset_cache[agent_type]
+    
+    # Create new toolset based on agent type
+    if agent_type == "interior_designer":
+        interior_functions: Set[Callable[..., Any]] = {create_image, product_recommendations}
+        functions = FunctionTool(interior_functions)
+    elif agent_type == "customer_loyalty":
+        loyalty_functions: Set[Callable[..., Any]] = {calculate_discount}
+        functions = FunctionTool(loyalty_functions)
+    elif agent_type == "inventory_agent":
+        inventory_functions: Set[Callable[..., Any]] = {inventory_check}
+        functions = FunctionTool(inventory_functions)
+    else:
+        default_functions: Set[Callable[..., Any]] = set()
+        functions = FunctionTool(default_functions)
+    
+    # Adding attributes to the current span
+    span = trace.get_current_span()
+    span.set_attribute("selected_agent", agent_type)
+
+    toolset = ToolSet()
+    toolset.add(functions)
+    
+    # Cache the toolset
+    _toolset_cache[agent_type] = toolset
+    return toolset
+
 class AgentProcessor:
-    def __init__(self, project_client, assistant_id, agent_type: str, thread_id=None):
+    """
+    Runs conversations against one agent. It holds only the shared clients and an immutable
+    AgentHandle, so a single cached instance serves every session concurrently; the thread
+    of each call travels in its RunContext.
+    """
+
+    def __init__(self, project_client, assistant_id, agent_type: str, async_agents_client=None):
+        configure_telemetry()
         self.project_client = project_client
-        self.agent_id = assistant_id
-        self.agent_type = agent_type
-        self.thread_id = thread_id
-        
-        # Use cached toolset or create new one
-        self.toolset = self._get_or_create_toolset(agent_type)
-        
-        self.project_client.agents.enable_auto_function_calls(tools = self.toolset)
+        # azure.ai.agents.aio.AgentsClient used for streaming runs on the event loop
+        self.async_agents_client = async_agents_client
+        self.handle = AgentHandle(agent_id=assistant_id, agent_type=agent_type, toolset=get_agent_toolset(agent_type))
 
-    def _get_or_create_toolset(self, agent_type: str) -> ToolSet:
-        """Get cached toolset or create new one to avoid repeated initialization."""
-        if agent_type in _toolset_cache:
-            return _toolset_cache[agent_type]
-        
-        # Create new toolset based on agent type
-        if agent_type == "interior_designer":
-            interior_functions: Set[Callable[..., Any]] = {create_image, product_recommendations}
-            functions = FunctionTool(interior_functions)
-        elif agent_type == "customer_loyalty":
-            loyalty_functions: Set[Callable[..., Any]] = {calculate_discount}
-            functions = FunctionTool(loyalty_functions)
-        elif agent_type == "inventory_agent":
-            inventory_functions: Set[Callable[..., Any]] = {inventory_check}
-            functions = FunctionTool(inventory_functions)
-        else:
-            default_functions: Set[Callable[..., Any]] = set()
-            functions = FunctionTool(default_functions)
-        
-        # Adding attributes to the current span
-        span = trace.get_current_span()
-        span.set_attribute("selected_agent", agent_type)
+    @property
+    def agent_id(self) -> str:
+        return self.handle.agent_id
 
-        toolset = ToolSet()
-        toolset.add(functions)
-        self.project_client.agents.enable_auto_function_calls(toolset)
-        
-        # Cache the toolset
-        _toolset_cache[agent_type] = toolset
-        return toolset
+    @property
+    def agent_type(self) -> str:
+        return self.handle.agent_type
+
+    @property
+    def toolset(self) -> ToolSet:
+        return self.handle.toolset
 
     def get_toolset(self, agent_type: str):
-        """Deprecated: Use _get_or_create_toolset instead."""
-        return self._get_or_create_toolset(agent_type)
+        """Deprecated: Use get_agent_toolset instead."""
+        return get_agent_toolset(agent_type)
+
+    def _create_and_process(self, thread_id: str, polling_interval: float = 1.0):
+        """
+        Equivalent of runs.create_and_process, except that the tool calls of a step are
+        executed concurrently by the shared ToolExecutor instead of one after another.
+        The run only sees the thread's truncation window (and rolling summary).
+        """
+        start_time = time.perf_counter()
+        run = self.project_client.agents.runs.create(
+            thread_id=thread_id, agent_id=self.agent_id, tool_choice="auto", **thread_context.run_options(thread_id)
+        )
+        while run.status in ("queued", "in_progress", "requires_action"):
+            if run.status == "requires_action" and isinstance(run.required_action, SubmitToolOutputsAction):
+                tool_outputs = tool_executor.execute(
+                    self.toolset.get_tool(FunctionTool), run.required_action.submit_tool_outputs.tool_calls
+                )
+                if not tool_outputs:
+                    self.project_client.agents.runs.cancel(thread_id=thread_id, run_id=run.id)
+                    break
+                run = self.project_client.agents.runs.submit_tool_outputs(
+                    thread_id=thread_id, run_id=run.id, tool_outputs=tool_outputs
+                )
+                continue
+            time.sleep(polling_interval)
+            run = self.project_client.agents.runs.get(thread_id=thread_id, run_id=run.id)
+        thread_context.record_run(thread_id, run, time.perf_counter() - start_time)
+        return run
 
-    def run_conversation_with_image(self, input_message: str = "", image_path: str = ""):
+    def run_conversation_with_image(self, context: RunContext, input_message: str = "", image_path: str = ""):
         start_time = time.time()
         span = trace.get_current_span()
         span.set_attribute("message_from_user", input_message)
         span.set_attribute("image_from_user", image_path)
-        thread_id = self.thread_id
+        thread_id = context.thread_id
         url_param = MessageImageUrlParam(url=image_path, detail="high")
         content_blocks = [
             MessageInputTextBlock(text=input_message),
@@ -102,52 +167,51 @@ class AgentProcessor:
             role="user",
             content=content_blocks
         )
+        thread_mirror.record(thread_id, [message])
         print(f"[TIMELOG] Message creation took: {time.time() - start_time:.2f}s")
         run_start = time.time()
-        run = self.project_client.agents.runs.create_and_process(thread_id=thread_id, agent_id=self.agent_id, tool_choice = "auto")
+        run = self._create_and_process(thread_id)
         print(f"[TIMELOG] Thread run took: {time.time() - run_start:.2f}s")
-        messages = self.project_client.agents.messages.list(thread_id=thread_id)
-        for message in messages:
-            pass  # Only time logs are kept
+        thread_mirror.sync(self.project_client.agents.messages, thread_id, run.id)  # Only time logs are kept
         print(f"[TIMELOG] Total run_conversation_with_image time: {time.time() - start_time:.2f}s")
 
     
-    def run_conversation_with_text(self, input_message: str = ""):
+    def run_conversation_with_text(self, context: RunContext, input_message: str = ""):
         start_time = time.time()
-        thread_id = self.thread_id
+        thread_id = context.thread_id
         message = self.project_client.agents.messages.create(
             thread_id=thread_id,
             role="user",
             content=input_message,
         )
+        thread_mirror.record(thread_id, [message])
         print(f"[TIMELOG] Message creation took: {time.time() - start_time:.2f}s")
         run_start = time.time()
-        run = self.project_client.agents.runs.create_and_process(thread_id=thread_id, agent_id=self.agent_id, tool_choice = "auto")
+        run = self._create_and_process(thread_id)
         print(f"[TIMELOG] Thread run took: {time.time() - run_start:.2f}s")
-        messages = self.project_client.agents.messages.list(thread_id=thread_id)
-        for message in messages:
+        # Only the messages this run added, not the whole thread
+        for message in thread_mirror.sync(self.project_client.agents.messages, thread_id, run.id):
             yield message.content
         print(f"[TIMELOG] Total run_conversation_with_text time: {time.time() - start_time:.2f}s")
 
-    def _run_conversation_sync(self, input_message: str = ""):
+    def _run_conversation_sync(self, context: RunContext, input_message: str = ""):
         """Optimized synchronous conversation runner with better error handling."""
-        thread_id = self.thread_id
+        thread_id = context.thread_id
         start_time = time.time()
         
         try:
-            # Create message
-            self.project_client.agents.messages.create(
+            # Create message; its id is the cursor for fetching the reply
+            message = self.project_client.agents.messages.create(
                 thread_id=thread_id,
                 role="user",
                 content=input_message,
             )
+            thread_mirror.record(thread_id, [message])
             print(f"[TIMELOG] Message creation took: {time.time() - start_time:.2f}s")
             
             # Run agent with timeout handling
             run_start = time.time()
-            run = self.project_client.agents.runs.create_and_process(
-                thread_id=thread_id, agent_id=self.agent_id, tool_choice="auto"
-            )
+            run = self._create_and_process(thread_id)
 
             # Agent processor code -- causes "too many requests" if enabled
             evaluators = {
@@ -165,37 +229,16 @@ class AgentProcessor:
             # )
             print(f"[TIMELOG] Thread run took: {time.time() - run_start:.2f}s")
 
-            # Optimized message retrieval - only get the latest message instead of listing all
+            # Incremental retrieval: only this run's messages newer than the cursor
             messages_start = time.time()
-            messages = list(self.project_client.agents.messages.list(thread_id=thread_id, limit=1))
+            messages = thread_mirror.sync(self.project_client.agents.messages, thread_id, run.id)
             print(f"[TIMELOG] Message retrieval took: {time.time() - messages_start:.2f}s")
             
-            # Find the latest assistant message (messages are most recent first)
-            assistant_msg = next((m for m in messages if m.role == "assistant"), None)
+            # Latest assistant message of the run (messages are oldest first)
+            assistant_msg = next((m for m in reversed(messages) if m.role == "assistant"), None)
             
             if assistant_msg:
-                # Robustly extract all text values from all blocks
-                content = assistant_msg.content
-                if isinstance(content, list):
-                    text_blocks = []
-                    for j, block in enumerate(content):
-                        if isinstance(block, dict):
-                            text_val = block.get('text', {}).get('value')
-                            if text_val:
-                                text_blocks.append(text_val)
-                        elif hasattr(block, 'text'):
-                            if hasattr(block.text, 'value'):
-                                text_val = block.text.value
-                                if text_val:
-                                    text_blocks.append(text_val)
-                    if text_blocks:
-                        # Join all text blocks with newlines if multiple
-                        result = ['\n'.join(text_blocks)]
-                        return result
-                
-                # Fallback: return stringified content
-                result = [str(content)]
-                return result
+                return [message_text(assistant_msg)]
             else:
                 return [""]
                 
@@ -203,13 +246,107 @@ class AgentProcessor:
             print(f"[ERROR] Conversation failed: {str(e)}")
             return [f"Error processing message: {str(e)}"]
 
-    async def run_conversation_with_text_stream(self, input_message: str = ""):
+    async def stream_conversation_events(self, context: RunContext, input_message: str = ""):
+        """
+        Run the agent with the streaming API and yield AgentRunEvents as they arrive.
+        The run is driven by the async agents client, so no thread is held while the
+        model is thinking; function tools run in a worker thread and their outputs are
+        submitted back into the same stream. If the caller is cancelled (e.g. the message ran out of time)
+        the remote run is cancelled too, so the thread is free for the next message.
+        """
+        agents_client = self.async_agents_client
+        thread_id = context.thread_id
+        start_time = time.time()
+        message = await agents_client.messages.create(
+            thread_id=thread_id,
+            role="user",
+            content=input_message,
+        )
+        thread_mirror.record(thread_id, [message])
+        print(f"[TIMELOG] Message creation took: {time.time() - start_time:.2f}s")
+        run_start = time.time()
+        event_handler = AsyncAgentEventHandler()
+        run_id = None
+        try:
+            async with await agents_client.runs.stream(
+                thread_id=thread_id, agent_id=self.agent_id, tool_choice="auto", event_handler=event_handler,
+                **thread_context.run_options(thread_id)
+            ) as stream:
+                async for event_type, event_data, _ in stream:
+                    if isinstance(event_data, MessageDeltaChunk):
+                        if event_data.text:
+                            yield AgentRunEvent("delta", event_data.text)
+                    elif isinstance(event_data, ThreadMessage):
+                        # Completed messages arrive in the stream, so the mirror needs no list call
+                        if event_data.status == "completed":
+                            thread_mirror.record(thread_id, [event_data])
+                    elif isinstance(event_data, ThreadRun):
+                        run_id = event_data.id
+                        if event_data.status == "requires_action" and isinstance(event_data.required_action, SubmitToolOutputsAction):
+                            tool_calls = event_data.required_action.submit_tool_outputs.tool_calls
+                            names = [tool_call.function.name for tool_call in tool_calls if isinstance(tool_call, RequiredFunctionToolCall)]
+                            yield AgentRunEvent("tool_call", names)
+                            # Concurrently, off the event loop, with per-tool timeouts
+                            tool_outputs = await tool_executor.execute_async(self.toolset.get_tool(FunctionTool), tool_calls)
+                            yield AgentRunEvent("tool_output", names)
+                            if not tool_outputs:
+                                # Nothing to submit: cancel the run, or the thread stays stuck in
+                                # requires_action and every later run on it fails
+                                await agents_client.runs.cancel(thread_id=thread_id, run_id=event_data.id)
+                                yield AgentRunEvent("error", f"No tool outputs for {', '.join(names) or 'the required action'}")
+                                break
+                            # Continues the iteration above with the events of the resumed run
+                            await agents_client.runs.submit_tool_outputs_stream(
+                                thread_id=event_data.thread_id,
+                                run_id=event_data.id,
+                                tool_outputs=tool_outputs,
+                                event_handler=event_handler
+                            )
+                        elif event_data.status == "completed":
+                            # The completed run carries the token usage
+                            thread_context.record_run(thread_id, event_data, time.time() - run_start)
+                        elif event_data.status in ("failed", "cancelled", "expired"):
+                            yield AgentRunEvent("error", str(event_data.last_error or event_data.status))
+                    elif event_type == AgentStreamEvent.ERROR:
+                        yield AgentRunEvent("error", str(event_data))
+                    elif event_type == AgentStreamEvent.DONE:
+                        break
+        except asyncio.CancelledError:
+            if run_id is not None:
+                try:
+                    await agents_client.runs.cancel(thread_id=thread_id, run_id=run_id)
+                except Exception as e:
+                    print(f"[WARNING] Could not cancel run {run_id}: {e}")
+            raise
+        print(f"[TIMELOG] Streaming thread run took: {time.time() - run_start:.2f}s")
+
+    async def run_conversation_with_text_stream(self, context: RunContext, input_message: str = ""):
         """Async wrapper for conversation processing with better error handling."""
         print(f"[DEBUG] Async conversation pipeline initiated - commencing message processing protocol", flush=True)
+        if self.async_agents_client is not None:
+            # Streaming run on the event loop; yields the complete reply once the run is done
+            try:
+                parts = []
+                error = None
+                async for event in self.stream_conversation_events(context, input_message):
+                    if event.kind == "delta":
+                        parts.append(event.data)
+                    elif event.kind == "error":
+                        error = event.data
+                if error is not None:
+                    # A failed, expired or cancelled run must not pass its partial text off as the reply
+                    print(f"[ERROR] Agent run failed: {error}")
+                    yield f"Error processing message: {error}"
+                else:
+                    yield "".join(parts)
+            except Exception as e:
+                print(f"[ERROR] Async conversation failed: {str(e)}")
+                yield f"Error processing message: {str(e)}"
+            return
         loop = asyncio.get_event_loop()
         try:
             messages = await loop.run_in_executor(
-                _executor, self._run_conversation_sync, input_message
+                _executor, self._run_conversation_sync, context, input_message
             )
             for i, msg in enumerate(messages):
                 yield msg
@@ -1,8 +1,16 @@
 import os
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from typing import List, Optional, Sequence
 from azure.search.documents import SearchClient
+from azure.search.documents.aio import SearchClient as AsyncSearchClient
 from azure.core.credentials import AzureKeyCredential
+from utils.cache_utils import AsyncTTLCache
+from services.catalog_service import get_catalog_index
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
 
 # Initialize Azure OpenAI and Azure Cognitive Search credentials
 SEARCH_ENDPOINT = os.environ.get("SEARCH_ENDPOINT")
@@ -25,6 +33,66 @@ search_client = SearchClient(
     credential=credential
 )
 
+# remote: Azure AI Search only; fallback: remote, answered by the local catalog index
+# when it is slow or failing; local: the local catalog index only
+SEARCH_MODE = os.getenv("PRODUCT_SEARCH_MODE", "fallback").lower()
+REMOTE_SEARCH_TIMEOUT_SECONDS = float(os.getenv("REMOTE_SEARCH_TIMEOUT_SECONDS", "2.0"))
+
+# Accessory families recommended alongside painting projects, searched one sub-query each
+ACCESSORY_QUERIES = ("paint accessories", "paint sprayers", "drop cloths", "painters tape")
+
+# Only the fields the tool returns are fetched from the index
+PRODUCT_FIELDS = [
+    "ProductID", "ProductName", "ProductCategory", "ProductDescription",
+    "ImageURL", "ProductPunchLine", "Price"
+]
+
+# Results of popular queries, shared by every session
+product_search_cache = AsyncTTLCache(
+    max_size=int(os.getenv("PRODUCT_SEARCH_CACHE_SIZE", "512")),
+    ttl_seconds=float(os.getenv("PRODUCT_SEARCH_CACHE_TTL_SECONDS", "600")),
+    name="product_search"
+)
+
+# Async client with its own connection pool, created on first use in the serving event loop
+_async_search_client: Optional[AsyncSearchClient] = None
+
+
+def get_async_search_client() -> AsyncSearchClient:
+    global _async_search_client
+    if _async_search_client is None:
+        _async_search_client = AsyncSearchClient(
+            endpoint=SEARCH_ENDPOINT,
+            index_name=INDEX_NAME,
+            credential=credential
+        )
+    return _async_search_client
+
+
+async def close_search_clients():
+    global _async_search_client
+    if _async_search_client is not None:
+        await _async_search_client.close()
+        _async_search_client = None
+
+
+def normalize_query(question: str) -> str:
+    """Cache key of a query: case and whitespace do not change the results."""
+    return " ".join(str(question).lower().split())
+
+
+def _to_product(item) -> dict:
+    get = dict.get
+    return {
+        "id": get(item, "ProductID", None),
+        "name": get(item, "ProductName", None),
+        "type": get(item, "ProductCategory", None),
+        "description": get(item, "ProductDescription", None),
+        "imageURL": get(item, "ImageURL", None),
+        "punchLine": get(item, "ProductPunchLine", None),
+        "price": get(item, "Price", None)
+    }
+
 # Main function to provide product recommendations with inventory check
 
 
@@ -38,30 +106,105 @@ def product_recommendations(question):
 
     #add painters tape for narrative
     #question = question + " painters tape"
+    if SEARCH_MODE == "local":
+        return get_catalog_index().search(question, top=8)
     semantic_configuration_name = INDEX_NAME + "-semantic-configuration"
     
-    # Step 1: Search
-    search_results = search_client.search(
+    # In fallback mode a slow request is not retried, the local index answers instead
+    timeouts = {"read_timeout": REMOTE_SEARCH_TIMEOUT_SECONDS, "retry_total": 0} if SEARCH_MODE == "fallback" else {}
+    try:
+        # Step 1: Search
+        search_results = search_client.search(
+            search_text=question,
+            query_type="semantic",
+            semantic_configuration_name=semantic_configuration_name,
+            select=PRODUCT_FIELDS,
+            top=8,
+            **timeouts
+        )
+
+        # Step 2: Build response (optimized)
+        return [_to_product(item) for item in search_results]
+    except Exception as e:
+        if SEARCH_MODE != "fallback":
+            raise
+        catalog_index = get_catalog_index()
+        catalog_index.record_fallback(str(e) or type(e).__name__)
+        return catalog_index.search(question, top=8)
+
+
+async def _search_async(question: str) -> list:
+    search_results = await get_async_search_client().search(
         search_text=question,
         query_type="semantic",
-        semantic_configuration_name=semantic_configuration_name,
+        semantic_configuration_name=INDEX_NAME + "-semantic-configuration",
+        select=PRODUCT_FIELDS,
         top=8
     )
+    return [_to_product(item) async for item in search_results]
 
-    print(search_results)
 
-    # Step 2: Build response (optimized)
-    get = dict.get
-    response = [
-        {
-            "id": get(item, "ProductID", None),
-            "name": get(item, "ProductName", None),
-            "type": get(item, "ProductCategory", None),
-            "description": get(item, "ProductDescription", None),
-            "imageURL": get(item, "ImageURL", None),
-            "punchLine": get(item, "ProductPunchLine", None),
-            "price": get(item, "Price", None)
-        }
-        for item in search_results
-    ]
-    return response
+async def product_recommendations_async(question):
+    """
+    Non-blocking product_recommendations for the event loop. Results are cached by the
+    normalized query, and identical queries in flight from any session share one search.
+    Answers from the local catalog index are not cached, so the remote search is retried.
+    """
+    if SEARCH_MODE == "local":
+        return get_catalog_index().search(question, top=8)
+    if SEARCH_MODE != "fallback":
+        return await product_search_cache.get_or_load(normalize_query(question), lambda: _search_async(question))
+    try:
+        return await product_search_cache.get_or_load(
+            normalize_query(question),
+            lambda: asyncio.wait_for(_search_async(question), timeout=REMOTE_SEARCH_TIMEOUT_SECONDS)
+        )
+    except Exception as e:
+        catalog_index = get_catalog_index()
+        catalog_index.record_fallback(str(e) or type(e).__name__)
+        return catalog_index.search(question, top=8)
+
+
+async def product_recommendations_batch(queries: Sequence[str], quotas: Optional[Sequence[int]] = None, top: int = 8) -> List[dict]:
+    """
+    Run several focused sub-queries concurrently and merge the results by ProductID.
+    Each query first contributes up to its quota (in query order); remaining slots up to
+    top are filled with the rest of the results in the same order. A failed sub-query
+    only loses its own results.
+    """
+    if quotas is None:
+        quotas = [top] * len(queries)
+    results = await asyncio.gather(*(product_recommendations_async(query) for query in queries), return_exceptions=True)
+    seen = set()
+    merged = []
+    leftovers = []
+    for query, quota, products in zip(queries, quotas, results):
+        if isinstance(products, Exception):
+            logger.warning(f"Product sub-query {query!r} failed: {products}")
+            continue
+        taken = 0
+        for product in products:
+            if product["id"] in seen:
+                continue
+            if taken < quota:
+                seen.add(product["id"])
+                merged.append(product)
+                taken += 1
+            else:
+                leftovers.append(product)
+    for product in leftovers:
+        if len(merged) >= top:
+            break
+        if product["id"] not in seen:
+            seen.add(product["id"])
+            merged.append(product)
+    return merged[:top]
+
+
+async def product_recommendations_with_accessories(question, top: int = 8) -> List[dict]:
+    """The request itself plus one product per accessory family, instead of one query with the accessories appended."""
+    return await product_recommendations_batch(
+        [question, *ACCESSORY_QUERIES],
+        quotas=[top - len(ACCESSORY_QUERIES), *([1] * len(ACCESSORY_QUERIES))],
+        top=top
+    )
@@ -7,24 +7,31 @@ import struct
 from itertools import chain, repeat
 from azure.identity import ClientSecretCredential
 import base64
-from openai import AzureOpenAI
 from dotenv import load_dotenv
 load_dotenv()
 
 from opentelemetry import trace
-from azure.monitor.opentelemetry import configure_azure_monitor
+from utils.telemetry_utils import configure_telemetry
 from azure.ai.agents.telemetry import trace_function
+from services.llm_service import get_llm_client
+from services.discount_service import DiscountDecision, compute_discount, explain_discount
+import asyncio
+import json
+import logging
 import time
+from abc import ABC, abstractmethod
+from typing import Tuple
+from openai import APIError
 # from opentelemetry.instrumentation.openai_v2 import OpenAIInstrumentor
 
-# Enable Azure Monitor tracing
-application_insights_connection_string = os.environ["APPLICATIONINSIGHTS_CONNECTION_STRING"]
-configure_azure_monitor(connection_string=application_insights_connection_string)
+# Azure Monitor tracing is enabled on first use, once per worker process (not at import)
 # OpenAIInstrumentor().instrument()
 
 # scenario = os.path.basename(__file__)
 # tracer = trace.get_tracer(__name__)
 
+logger = logging.getLogger(__name__)
+
 #Azure OpenAI
 endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
 deployment = os.getenv("gpt_deployment")
@@ -32,28 +39,31 @@ api_key = os.getenv("AZURE_OPENAI_KEY")
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 project_root = os.path.dirname(os.path.dirname(current_dir))  # Go up 2 levels from src/tools/ to root
-PROMPT_PATH = os.path.join(project_root, 'prompts', 'DiscountLogicPrompt.txt')
+PROMPT_PATH = os.path.join(project_root, 'prompts', 'DiscountExplanationPrompt.txt')
 with open(PROMPT_PATH, 'r') as file:
-    PROMPT = file.read()
+    EXPLANATION_PROMPT = file.read()
 
-@trace_function()
-def calculate_discount(CustomerID):
-    print(f"calculate_discount function:{CustomerID}")
-    """
-    Calculate the discount based on customer data.
+# template: deterministic wording; model: the model words the (already decided) discount
+EXPLANATION_MODE = os.getenv("DISCOUNT_EXPLANATION_MODE", "template").lower()
+EXPLANATION_TIMEOUT_SECONDS = float(os.getenv("DISCOUNT_EXPLANATION_TIMEOUT_SECONDS", "5"))
+DISCOUNT_API_VERSION = "2025-01-01-preview"
 
-    Args:
-        CustomerID (str): The ID of the customer.
-    
-    Returns:
-        float: The calculated discount amount and percentage.
-    """
+class CustomerDataSource(ABC):
+    """Async access to the customer data the discount is based on."""
 
-    start_time = time.time()
+    @abstractmethod
+    async def get_transaction_data(self, CustomerID: str) -> str:
+        """Total spend of the customer this year."""
+
+    @abstractmethod
+    async def fetch_loyalty_profile_data(self, CustomerID: str) -> pd.DataFrame:
+        """One-row loyalty profile (LoyaltyTier, Tenure, Churn, TotalAmountSpentThisYear, ...)."""
+
+
+class SimulatedCustomerDataSource(CustomerDataSource):
     # @trace_function()
-    def get_transaction_data(CustomerID):
+    async def get_transaction_data(self, CustomerID: str) -> str:
         start_time = time.time()
-        time.sleep(2)  # Simulating a delay for demonstration purposes
         """
         Simulates connecting to Azure SQL database. Returns the total price for a given customer ID from the transaction data.
         
@@ -63,6 +73,7 @@ def calculate_discount(CustomerID):
         Returns:
             float: The total price of purchases for the given customer.
         """
+        await asyncio.sleep(2)  # Simulating a delay for demonstration purposes
         
         # Adding attributes to the current span
         span = trace.get_current_span()
@@ -75,14 +86,14 @@ def calculate_discount(CustomerID):
             else:
                 result = "121.53"
         except Exception as e:
-            print(f"Error: {e}")
+            logger.error(f"Error: {e}")
             result = "0.0"
         end_time = time.time()
-        print(f"get_transaction_data Execution Time: {end_time - start_time} seconds")
+        logger.debug(f"get_transaction_data Execution Time: {end_time - start_time} seconds")
         return result
-    # @trace_function()    
-    def fetch_loyalty_profile_data(CustomerID:str):
-        start_time = time.time()
+
+    # @trace_function()
+    async def fetch_loyalty_profile_data(self, CustomerID: str) -> pd.DataFrame:
         """
         Simulates connecting to Microsoft Fabric SQL endpoint.
         Fetches all data from the 'customer_loyalty_profile' table.
@@ -91,7 +102,7 @@ def calculate_discount(CustomerID):
             DataFrame containing the query results.
         """
         # This simulates connecting to a Fabric lakehouse to retrieve customer data.
-        time.sleep(2)  
+        await asyncio.sleep(2)
         # Adding attributes to the current span
         span = trace.get_current_span()
         span.set_attribute("data_fetch_id", CustomerID)
@@ -120,79 +131,113 @@ def calculate_discount(CustomerID):
                 'Tenure': [2],
                 'Churn': [0.3]
             })
-        return df  
-    # @trace_function()
-    def discount_logic_using_model(transaction_info,loyalty_info):
-        start_time = time.time()
-        """
-        Calculates the discount percentage for a customer based on transaction and loyalty data.
+        return df
 
-        Args:
-            transaction_info (float or int): Includes total price for a given customer ID from the transaction data.
-            loyalty_info (dict): Includes customer tenure, churn risk score,lifetime value and loyalty tier or program eligibility.
-            InvoiceValue (float or int): The amount the customer is spending in the current purchase.
 
-        Returns:
-            float: Discount amount to be applied based on the business logic.
-        """
-        # Initialize client
-        client = AzureOpenAI(
-            azure_endpoint=endpoint,
-            api_key=api_key,
-            api_version="2025-01-01-preview",
-        )
-        # print(f"loyalty_info is:{loyalty_info}, invoice value: {InvoiceValue} and transaction_info is:{transaction_info}")
-        prompt= "Bruno's total transaction price in this year"+ transaction_info + "and his data"+str(loyalty_info)
-        # print(f"prompt:{prompt}")
-        # print(f"Prompt for agent:{PROMPT}")
-        # Define chat prompt
-        chat_prompt = [
-            {
-                "role": "developer",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": PROMPT
-                    }
-                ]
-            },
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": prompt
-                    }
-                ]
-            }
-        ]
-
-        # Generate chat completion
-        completion = client.chat.completions.create(
-            model=deployment,
-            messages=chat_prompt,
-            max_completion_tokens=5000,
-            stop=None,
-            stream=False
+customer_data_source: CustomerDataSource = SimulatedCustomerDataSource()
+
+async def fetch_customer_data(CustomerID: str):
+    """Transaction total and loyalty profile, fetched concurrently."""
+    return await asyncio.gather(
+        customer_data_source.get_transaction_data(CustomerID),
+        customer_data_source.fetch_loyalty_profile_data(CustomerID),
+    )
+
+def discount_logic(transaction_info, loyalty_info):
+    """
+    Calculates the discount percentage for a customer based on transaction and loyalty data,
+    with the deterministic rule engine (no model call).
+
+    Args:
+        transaction_info (str): Total price of the customer's purchases this year.
+        loyalty_info (DataFrame): Customer tenure, churn risk score, lifetime value and loyalty tier.
+
+    Returns:
+        tuple: The DiscountDecision and the loyalty profile it was computed from.
+    """
+    start_time = time.time()
+    profile = loyalty_info.iloc[0].to_dict()
+    if transaction_info:
+        # The transaction data is the source of truth for this year's spend
+        profile["TotalAmountSpentThisYear"] = float(transaction_info)
+    decision = compute_discount(profile)
+    # Adding attributes to the current span
+    span = trace.get_current_span()
+    span.set_attribute("discount_percentage", decision.discount_percentage)
+    logger.debug(f"discount_logic Execution Time: {time.time() - start_time} seconds")
+    return decision, profile
+
+def _discount_response(decision, explanation: str) -> str:
+    return json.dumps({
+        "CustomerID": decision.customer_id,
+        "discount_percentage": decision.discount_percentage,
+        "discount_tier": decision.discount_tier,
+        "loyalty_tier": decision.loyalty_tier,
+        "explanation": explanation,
+    })
+
+async def explain_discount_with_model(decision, profile) -> str:
+    """Customer-facing wording from the model on the app's shared async client; the template if it fails."""
+    start_time = time.time()
+    try:
+        completion = await asyncio.wait_for(
+            get_llm_client(endpoint, api_key, DISCOUNT_API_VERSION).chat.completions.create(
+                model=deployment,
+                messages=[
+                    {"role": "developer", "content": EXPLANATION_PROMPT},
+                    {"role": "user", "content": f"Profile: {profile}\nDiscount: {decision.discount_percentage:g}% (Tier {decision.discount_tier})"},
+                ],
+                max_completion_tokens=200,
+                stream=False
+            ),
+            timeout=EXPLANATION_TIMEOUT_SECONDS
         )
-        response_dict = completion.model_dump()
-        response_message = response_dict["choices"][0]["message"]["content"]
-        # Adding attributes to the current span
-        span = trace.get_current_span()
-        span.set_attribute("discount_logic_response", response_message)
-        end_time = time.time()
-        print(f"discount_logic_using_model Execution Time: {end_time - start_time} seconds")
-        return response_message
-
-    transaction_info=get_transaction_data(CustomerID)
-    # print(f"transaction_info{transaction_info}")
-    loyalty_info=fetch_loyalty_profile_data(CustomerID)
-    # print(f"loyalty_info :{loyalty_info}")
-    discount_info=discount_logic_using_model(transaction_info,loyalty_info)
+        explanation = completion.choices[0].message.content or explain_discount(decision, profile)
+    except (asyncio.TimeoutError, APIError) as e:
+        logger.warning(f"Discount explanation fell back to the template: {e}")
+        explanation = explain_discount(decision, profile)
+    logger.debug(f"explain_discount_with_model Execution Time: {time.time() - start_time} seconds")
+    return explanation
+
+@trace_function()
+def calculate_discount(CustomerID):
+    logger.debug(f"calculate_discount function:{CustomerID}")
+    """
+    Calculate the discount based on customer data.
+
+    Args:
+        CustomerID (str): The ID of the customer.
+    
+    Returns:
+        float: The calculated discount amount and percentage.
+    """
+
+    configure_telemetry()
+    start_time = time.time()
+    # Tools run on worker threads without an event loop, so the concurrent fetch gets its own
+    transaction_info, loyalty_info = asyncio.run(fetch_customer_data(CustomerID))
+    decision, profile = discount_logic(transaction_info, loyalty_info)
+    # The agent words the final answer itself, so the tool never waits for a model
+    discount_info = _discount_response(decision, explain_discount(decision, profile))
     end_time = time.time()
     # print(f"calculate_discount Execution Time: {end_time - start_time} seconds")
     return discount_info
 
+async def calculate_discount_async(CustomerID) -> Tuple[DiscountDecision, str]:
+    """
+    (decision, explanation) for callers on the event loop, without an agent run: the
+    rule engine decides and, with DISCOUNT_EXPLANATION_MODE=model, the app's pooled
+    async client words the result.
+    """
+    configure_telemetry()
+    transaction_info, loyalty_info = await fetch_customer_data(CustomerID)
+    decision, profile = discount_logic(transaction_info, loyalty_info)
+    if EXPLANATION_MODE == "model":
+        explanation = await explain_discount_with_model(decision, profile)
+    else:
+        explanation = explain_discount(decision, profile)
+    return decision, explanation
+
 # # Example usage:
 # CustomerID = "CUST001"
 # discount_amount=calculate_discount(CustomerID)
@@ -1,18 +1,17 @@
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
-from fastapi.responses import HTMLResponse
+from contextlib import asynccontextmanager
+from fastapi.responses import HTMLResponse, JSONResponse
 import os
 from dotenv import load_dotenv
-from azure.ai.projects import AIProjectClient
-from azure.identity import DefaultAzureCredential
 from azure.ai.inference.models import SystemMessage, UserMessage
-from app.agents.agent_processor import AgentProcessor
-from azure.ai.inference import ChatCompletionsClient
+from app.agents.agent_processor import AgentProcessor, RunContext
+from azure.ai.inference.aio import ChatCompletionsClient
 from azure.core.credentials import AzureKeyCredential
 from collections import deque
-from typing import Deque, Tuple, Optional, Dict
+from typing import Awaitable, Callable, Deque, Tuple, Optional, Dict
 import orjson  # Faster JSON library
-from openai import AzureOpenAI
-from app.tools.aiSearchTools import product_recommendations
+from openai import AsyncAzureOpenAI
+from app.tools.aiSearchTools import product_recommendations_async, product_recommendations_with_accessories, product_search_cache
 from app.tools.understandImage import get_image_description
 #from app.tools.singleAgentExample import generate_response
 from azure.core.credentials import AzureKeyCredential
@@ -20,12 +19,13 @@ import asyncio
 import datetime
 import time
 from opentelemetry import trace
-from azure.monitor.opentelemetry import configure_azure_monitor
 from opentelemetry.trace import SpanKind
 from azure.ai.agents.telemetry import trace_function
-from utils.history_utils import format_chat_history, redact_bad_prompts_in_history, clean_conversation_history
+from utils.history_utils import format_chat_history, redact_bad_prompts_in_history, parse_conversation_history
 from utils.response_utils import extract_bot_reply, parse_agent_response, merge_cart_and_cora
+from utils.stream_utils import AnswerStreamExtractor
 from app.tools.imageCreationTool import create_image
+from app.tools.discountLogic import calculate_discount_async
 import logging
 import aiohttp
 from concurrent.futures import ThreadPoolExecutor
@@ -40,7 +40,20 @@ from utils.message_utils import (
 )
 from services.agent_service import get_or_create_agent_processor
 from services.router_service import call_router, select_agent
-from services.fallback_service import call_fallback, cora_fallback
+from services.fallback_service import call_fallback, cora_fallback, stream_fallback, stream_cora_fallback
+from services.session_service import SessionState, CHAT_HISTORY_MAXLEN, is_session_id, new_session_id
+from services.image_service import image_description_cache, get_image_description_cached, close_image_service
+from services.app_container import AppContainer
+from services.intent_service import create_intent_router
+from services.speculation_service import ProductSpeculator, DESIGN_AGENTS
+from services.admission_service import AdmissionRejected, create_admission_controller
+from services.turn_service import SessionTurnQueue, TurnQueueMetrics
+from services.tool_service import tool_executor
+from services.thread_mirror_service import thread_mirror
+from services.context_service import thread_context
+from services.deadline_service import DeadlineExceeded, DeadlineRunner
+from services.catalog_service import get_catalog_index
+from services.inventory_service import inventory_snapshots
 
 load_dotenv(override=True)
 
@@ -54,8 +67,7 @@ logger = logging.getLogger(__name__)
 # Global thread pool executor for CPU-bound operations
 thread_pool = ThreadPoolExecutor(max_workers=4)
 
-application_insights_connection_string = os.environ["APPLICATIONINSIGHTS_CONNECTION_STRING"]
-configure_azure_monitor(connection_string=application_insights_connection_string)
+# Azure Monitor is configured per worker by the AppContainer (see lifespan)
 # OpenAIInstrumentor().instrument()
 
 scenario = os.path.basename(__file__)
@@ -72,44 +84,35 @@ def log_timing(operation_name: str, start_time: float, additional_info: str = ""
     logger.info(log_message)
     return elapsed_time
 
-async def get_cached_image_description(image_url: str, image_cache: dict) -> str:
-    """Get image description with caching. If not in cache, fetch and store it."""
-    if image_url in image_cache:
-        logger.debug("Using cached image description", extra={"url": image_url[:50], "cache_size": len(image_cache)})
-        return image_cache[image_url]
-    
+async def describe_image(image_url: str) -> str:
+    """Fetch a new image description from the model."""
     logger.debug("Fetching new image description", extra={"url": image_url[:50]})
+    # Use thread pool executor for the blocking model call
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(thread_pool, get_image_description, image_url)
+
+async def get_cached_image_description(image_url: str) -> str:
+    """
+    Get image description from the process-wide cache. Concurrent requests for the
+    same image (from any session) share a single model call.
+    """
     try:
-        # Use thread pool executor for CPU-bound operations
-        loop = asyncio.get_event_loop()
-        description = await loop.run_in_executor(thread_pool, get_image_description, image_url)
-        image_cache[image_url] = description
-        logger.debug("Cached image description", extra={"url": image_url[:50]})
-        return description
+        return await get_image_description_cached(image_url, describe_image)
     except Exception as e:
         logger.error("Failed to get image description", extra={"url": image_url[:50], "error": str(e)})
         return ""
 
-async def pre_fetch_image_description(image_url: str, image_cache: dict):
+async def pre_fetch_image_description(image_url: str):
     """Pre-fetch image description asynchronously without blocking."""
-    if image_url and image_url not in image_cache:
+    if image_url:
         logger.debug("Pre-fetching image description", extra={"url": image_url[:50]})
-        try:
-            loop = asyncio.get_event_loop()
-            description = await loop.run_in_executor(thread_pool, get_image_description, image_url)
-            image_cache[image_url] = description
-            logger.debug("Pre-fetched and cached image description", extra={"url": image_url[:50]})
-        except Exception as e:
-            logger.error("Failed to pre-fetch image description", extra={"url": image_url[:50], "error": str(e)})
+        await get_cached_image_description(image_url)
 
-def log_cache_status(image_cache: dict, current_url: str = ""):
+def log_cache_status(current_url: str = ""):
     """Log the current status of the image cache using structured logging."""
-    cache_size = len(image_cache)
-    cache_keys = list(image_cache.keys())
     logger.debug("Image cache status", extra={
-        "cache_size": cache_size,
-        "cache_keys": [url[:30] + '...' for url in cache_keys],
-        "current_url_in_cache": current_url in image_cache if current_url else None
+        **image_description_cache.stats(),
+        "current_url": current_url[:30] + '...' if current_url else None
     })
 
 def extract_product_names_from_response(response_data) -> str:
@@ -176,6 +179,25 @@ def format_user_message_with_products(image_url: str, image_data: str, video_sum
     ]
     return "{" + ", ".join(parts) + "}"
 
+async def stream_reply(send: Callable[[str], Awaitable[None]], deltas, agent_name: str) -> str:
+    """
+    Forward a model reply to the client as incremental "delta" frames (through send) and return the full reply.
+    Only the answer text of JSON replies is forwarded; the caller still sends the
+    structured envelope (answer, products, cart, discount_percentage) once the reply is complete.
+    """
+    start_time = time.time()
+    extractor = AnswerStreamExtractor()
+    parts = []
+    async for delta in deltas:
+        if not parts:
+            log_timing("Time To First Token", start_time, f"Agent: {agent_name}")
+        parts.append(delta)
+        text = extractor.feed(delta)
+        if text:
+            await send(fast_json_dumps({"type": "delta", "agent": agent_name, "delta": text}))
+    log_timing("Streamed Reply", start_time, f"Agent: {agent_name} | Deltas: {len(parts)}")
+    return "".join(parts)
+
 # Safe operation wrapper for better error handling
 async def safe_operation(operation, fallback_value=None, operation_name="Unknown"):
     """Safely execute an operation with proper error handling."""
@@ -209,13 +231,13 @@ def select_agent(router_reply: str, env_vars: Dict[str, str]) -> Tuple[Optional[
     log_timing("Agent Selection", start_time, f"Selected: {result[1] if result[1] else 'None'}")
     return result
 
-def call_router(router_client: ChatCompletionsClient, router_prompt: str, formatted_history: str, phi_4_deployment: str) -> str:
+async def call_router(router_client: ChatCompletionsClient, router_prompt: str, formatted_history: str, phi_4_deployment: str) -> str:
     """Call the router model and return its reply. Handles content filter errors."""
     start_time = time.time()
     with tracer.start_as_current_span("custom_function") as span:
         span.set_attribute("custom_attribute", "value")    
         try:
-            router_response = router_client.complete(
+            router_response = await router_client.complete(
                 messages=[
                     SystemMessage(content=router_prompt),
                     UserMessage(content=formatted_history),
@@ -242,7 +264,7 @@ def call_router(router_client: ChatCompletionsClient, router_prompt: str, format
             log_timing("Router Call (Exception)", start_time, f"Exception: {str(e)[:50]}...")
             raise
 
-def call_fallback(llm_client, fallback_prompt: str, gpt_deployment = "gpt-4.1"):
+async def call_fallback(llm_client: AsyncAzureOpenAI, fallback_prompt: str, gpt_deployment = "gpt-4.1"):
     """Call the fallback model and return its reply."""
     start_time = time.time()
     
@@ -259,7 +281,7 @@ def call_fallback(llm_client, fallback_prompt: str, gpt_deployment = "gpt-4.1"):
         }]
 
     messages = chat_prompt
-    completion = llm_client.chat.completions.create(
+    completion = await llm_client.chat.completions.create(
         model=gpt_deployment,
         messages=messages,
         temperature=0.7,
@@ -268,7 +290,7 @@ def call_fallback(llm_client, fallback_prompt: str, gpt_deployment = "gpt-4.1"):
     log_timing("Fallback Call", start_time, f"Model: {gpt_deployment}")
     return result
 
-def cora_fallback(llm_client, fallback_prompt: str, gpt_deployment = "Phi-4"):
+async def cora_fallback(llm_client: AsyncAzureOpenAI, fallback_prompt: str, gpt_deployment = "Phi-4"):
     """Call the fallback model for cora and return its reply."""
     start_time = time.time()
     
@@ -285,7 +307,7 @@ def cora_fallback(llm_client, fallback_prompt: str, gpt_deployment = "Phi-4"):
         }]
 
     messages = chat_prompt
-    completion = llm_client.chat.completions.create(
+    completion = await llm_client.chat.completions.create(
         model=gpt_deployment,
         messages=messages,
         temperature=0.7,
@@ -298,7 +320,7 @@ def cora_fallback(llm_client, fallback_prompt: str, gpt_deployment = "Phi-4"):
     log_timing("Cora Fallback Call", start_time, f"Model: {gpt_deployment}")
     return result
 
-def cart_update(llm_client, cart_update_prompt: str):
+async def cart_update(llm_client: AsyncAzureOpenAI, cart_update_prompt: str):
     """Call the cart update model and return its reply."""
     start_time = time.time()
     
@@ -316,7 +338,7 @@ def cart_update(llm_client, cart_update_prompt: str):
 
     gpt_deployment = validated_env_vars['gpt_deployment']
     messages = chat_prompt
-    completion = llm_client.chat.completions.create(
+    completion = await llm_client.chat.completions.create(
         model=gpt_deployment,
         messages=messages,
         temperature=0.7,
@@ -329,48 +351,45 @@ def cart_update(llm_client, cart_update_prompt: str):
     log_timing("Cart Update Call", start_time, f"Model: {gpt_deployment}")
     return result
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Build this worker's clients, stores and telemetry after fork, so the app can be
+    preloaded and served by several gunicorn workers; release them on shutdown.
+    """
+    container = AppContainer(validated_env_vars)
+    await container.start()
+    app.state.container = container
+    yield
+    await container.close()
+    await close_image_service()
+
+app = FastAPI(lifespan=lifespan)
 
 load_dotenv()
 env_vars = load_env_vars()
 validated_env_vars = validate_env_vars(env_vars)
 
-project_endpoint = os.environ.get("AZURE_AI_AGENT_ENDPOINT")
-if not project_endpoint:
-    raise ValueError("AZURE_AI_AGENT_ENDPOINT environment variable is required")
-project_client = AIProjectClient(
-    endpoint=project_endpoint,
-    credential=DefaultAzureCredential(),
-)
-
-ROUTER_PROMPT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'prompts', 'routerPrompt.txt')
-FALLBACK_PROMPT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'prompts', 'fallBackPrompt.txt')
-CORA_FALLBACK_PROMPT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'prompts', 'CoraPrompt.txt')
-CART_UPDATE_PROMPT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'prompts', 'addToCartPrompt.txt')
-
-with open(ROUTER_PROMPT_PATH, 'r') as file:
-    ROUTER_PROMPT = file.read()
-
-with open(FALLBACK_PROMPT_PATH, 'r') as file:
-    FALLBACK_PROMPT = file.read()
+# Local intent classifier answering confident turns before the Phi-4 router
+intent_router = create_intent_router()
+# Starts the design agents' product search and image description alongside the router
+product_speculator = ProductSpeculator(product_recommendations_async, get_cached_image_description, product_recommendations_with_accessories)
+# Process-wide limits on concurrent model work, per workload class
+admission = create_admission_controller()
+AGENT_WORKLOADS = {"interior_designer": "llm", "interior_designer_create_image": "image", "cora": "llm"}
+BUSY_MESSAGE = "We're handling a lot of requests right now. Please try again in a moment."
+# Latency budget of one message; agent runs, streamed or not, get what is left of it
+TURN_LATENCY_BUDGET_SECONDS = float(os.getenv("TURN_LATENCY_BUDGET_SECONDS", "45"))
+TIMEOUT_MESSAGE = "Sorry, that took too long. Please try again."
+deadline_runner = DeadlineRunner()
 
-with open(CORA_FALLBACK_PROMPT_PATH, 'r') as file:
-    CORA_FALLBACK_PROMPT = file.read()
-
-with open(CART_UPDATE_PROMPT_PATH, 'r') as file:
-    CART_UPDATE_PROMPT = file.read()
-
-router_client = ChatCompletionsClient(
-    endpoint=validated_env_vars['phi_4_endpoint'],
-    credential=AzureKeyCredential(validated_env_vars['phi_4_api_key']),
-    api_version=validated_env_vars['phi_4_api_version']
-)
-
-llm_client = AzureOpenAI(
-    azure_endpoint=validated_env_vars['AZURE_OPENAI_ENDPOINT'],
-    api_key=validated_env_vars['AZURE_OPENAI_KEY'],
-    api_version=validated_env_vars['AZURE_OPENAI_API_VERSION'],
-)
+def is_valid_agent_reply(reply: str) -> bool:
+    """Agent processors report failures as text, which must not pass for a reply."""
+    return bool(reply) and not reply.startswith("Error processing message")
+# Per-session turn queue settings
+turn_queue_metrics = TurnQueueMetrics()
+SESSION_QUEUE_SIZE = int(os.getenv("SESSION_QUEUE_SIZE", "4"))
+CANCEL_SUPERSEDED_TURNS = os.getenv("CANCEL_SUPERSEDED_TURNS", "true").lower() == "true"
 
 @app.get("/")
 async def get():
@@ -380,10 +399,15 @@ async def get():
 
 @app.get("/health")
 async def health_check():
-    """Health check endpoint for Azure Web App."""
-    return {
-        "status": "healthy",
+    """
+    Health check endpoint for Azure Web App; 503 while the worker is warming up. A worker
+    whose warm-up failed serves anyway and reports itself degraded.
+    """
+    warmup = app.state.container.warmup
+    body = {
+        "status": "healthy" if warmup.ready else "degraded" if warmup.degraded else "warming_up",
         "timestamp": datetime.datetime.now().isoformat(),
+        "warmup": warmup.stats(),
         "environment_vars_configured": {
             "phi_4_endpoint": bool(validated_env_vars.get('phi_4_endpoint')),
             "phi_4_api_key": bool(validated_env_vars.get('phi_4_api_key')),
@@ -392,6 +416,30 @@ async def health_check():
             "azure_ai_agent_endpoint": bool(os.environ.get("AZURE_AI_AGENT_ENDPOINT"))
         }
     }
+    if not warmup.ready and not warmup.degraded:
+        return JSONResponse(content=body, status_code=503)
+    return body
+
+@app.get("/metrics")
+async def metrics():
+    """Cache and latency metrics for this worker."""
+    return {
+        "timestamp": datetime.datetime.now().isoformat(),
+        "image_description_cache": image_description_cache.stats(),
+        "product_search_cache": product_search_cache.stats(),
+        "catalog_index": get_catalog_index().stats(),
+        "inventory": inventory_snapshots.stats(),
+        "discount_lookup": app.state.container.discount_lookup.stats() if app.state.container.discount_lookup else None,
+        "agent_thread_pool": app.state.container.agent_thread_pool.stats(),
+        "intent_router": intent_router.stats(),
+        "speculation": product_speculator.stats(),
+        "turn_queue": turn_queue_metrics.stats(),
+        "admission": admission.stats(),
+        "tool_calls": tool_executor.stats(),
+        "thread_mirror": thread_mirror.stats(),
+        "agent_context": thread_context.stats(),
+        "agent_deadlines": deadline_runner.stats(),
+    }
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
@@ -399,497 +447,660 @@ async def websocket_endpoint(websocket: WebSocket):
     logger.info("WebSocket Session Started")
     
     await websocket.accept()
-    thread = project_client.agents.threads.create()
-    chat_history: Deque[Tuple[str, str]] = deque(maxlen=5)
-    customer_loyalty_thread = project_client.agents.threads.create()
-    
-    # Flag to track if customer loyalty task has been executed
-    customer_loyalty_executed = False
-    
-    # Session-level variable to track discount_percentage
-    session_discount_percentage = ""
-    # Store the full loyalty response for later
-    session_loyalty_response = None
-    
-    # Flag to track if loyalty response has been sent to user
-    loyalty_response_sent = False
-    
-    # Session-level variable to track persistent image URL
-    persistent_image_url = ""
-
-    # Session-level variable to track persistent cart state
-    persistent_cart = []
+    container: AppContainer = websocket.app.state.container
 
-    # Dictionary to cache image URLs and their descriptions
-    image_cache = {}
+    # Session state (cart, agent threads, discount, ...) lives in the session store so
+    # a reconnecting client can resume its session on any worker. Only a live session is
+    # resumed; any other id gets a fresh one, so clients cannot choose ids or create rows
+    requested_id = websocket.query_params.get("session_id")
+    state = await container.session_store.load(requested_id) if is_session_id(requested_id) else None
+    if state is None:
+        state = SessionState(new_session_id())
+    else:
+        logger.info(f"Resuming session {state.session_id}")
+    session_id = state.session_id
+    await container.session_store.save(state)
+    await websocket.send_text(fast_json_dumps({"type": "session", "session_id": session_id, "history_version": state.history_version}))
+    # Versions from here on are bumped by this connection's own turns, whose messages the
+    # client already has: a message typed while an earlier turn was still running carries
+    # an older version, but builds on the same history
+    synced_version = state.history_version
 
-    # Track bad prompts (those that triggered content filter)
-    bad_prompts = set()
+    # Agent threads are leased from the pool only when an agent path needs them,
+    # so sessions that only talk to cora never create one
+    async def ensure_thread() -> str:
+        if not state.thread_id:
+            state.thread_id = await container.agent_thread_pool.lease()
+        return state.thread_id
 
-    # Use deque with maxlen for raw_io_history to prevent unbounded growth
-    raw_io_history = deque(maxlen=100)
+    async def ensure_customer_loyalty_thread() -> str:
+        if not state.customer_loyalty_thread_id:
+            state.customer_loyalty_thread_id = await container.agent_thread_pool.lease()
+        return state.customer_loyalty_thread_id
 
     async def run_customer_loyalty_task(customer_id):
         start_time = time.time()
         with tracer.start_as_current_span("Run Customer Loyalty Thread"):
-            nonlocal session_discount_percentage, session_loyalty_response
+            # Precomputed discount: a primary-key lookup instead of an agent run
+            precomputed = container.discount_lookup.get(customer_id) if container.discount_lookup else None
+            source = "Precomputed"
+            if precomputed is None:
+                # Not in the table: the rule engine computes it live, still without an agent run
+                source = "Live"
+                try:
+                    precomputed = await deadline_runner.run(
+                        "customer_loyalty_live",
+                        lambda: calculate_discount_async(customer_id),
+                        budget=TURN_LATENCY_BUDGET_SECONDS - (time.time() - start_time)
+                    )
+                except Exception:
+                    logger.warning("Live discount calculation failed, asking the customer loyalty agent", exc_info=True)
+            if precomputed is not None:
+                decision, explanation = precomputed
+                state.session_discount_percentage = f"{decision.discount_percentage:g}"
+                state.session_loyalty_response = {
+                    "answer": explanation,
+                    "agent": "customer_loyalty",
+                    "products": "",
+                    "discount_percentage": state.session_discount_percentage,
+                    "image_url": "",
+                    "video_url": "",
+                    "additional_data": "",
+                }
+                log_timing("Customer Loyalty Task", start_time, f"{source} discount: {state.session_discount_percentage}")
+                return
             message = f"Calculate discount for the customer with id {customer_id}"
             customer_loyalty_id = validated_env_vars.get('customer_loyalty')
             if not customer_loyalty_id:
-                session_loyalty_response = {"answer": "Customer loyalty agent not configured.", "agent": "customer_loyalty"}
+                state.session_loyalty_response = {"answer": "Customer loyalty agent not configured.", "agent": "customer_loyalty"}
                 log_timing("Customer Loyalty Task", start_time, "Agent not configured")
                 return
                 
             processor = get_or_create_agent_processor(
                 agent_id=customer_loyalty_id,
                 agent_type="customer_loyalty",
-                thread_id=customer_loyalty_thread.id,
-                project_client=project_client
+                project_client=container.project_client,
+                async_agents_client=container.async_agents_client
             )
-            bot_reply = ""
-            async for msg in processor.run_conversation_with_text_stream(input_message=message):
-                bot_reply = extract_bot_reply(msg)
+            run_context = RunContext(thread_id=await ensure_customer_loyalty_thread())
+            async def run_agent():
+                reply = ""
+                async for msg in processor.run_conversation_with_text_stream(run_context, input_message=message):
+                    reply = extract_bot_reply(msg)
+                return reply
+            try:
+                bot_reply = await deadline_runner.run(
+                    "customer_loyalty",
+                    run_agent,
+                    budget=TURN_LATENCY_BUDGET_SECONDS - (time.time() - start_time),
+                    is_valid=is_valid_agent_reply
+                )
+            except Exception:
+                logger.warning("Customer loyalty agent gave no discount", exc_info=True)
+                log_timing("Customer Loyalty Task", start_time, "No discount")
+                return
             parsed_response = parse_agent_response(bot_reply)
             parsed_response["agent"] = "customer_loyalty"  # Override agent field
             
             # Store the discount_percentage for the session
             if parsed_response.get("discount_percentage"):
-                session_discount_percentage = parsed_response["discount_percentage"]
-            session_loyalty_response = parsed_response  # Store the full response for later
+                state.session_discount_percentage = parsed_response["discount_percentage"]
+            state.session_loyalty_response = parsed_response  # Store the full response for later
             # Do NOT send the response here!
-            log_timing("Customer Loyalty Task", start_time, f"Discount: {session_discount_percentage}")
+            log_timing("Customer Loyalty Task", start_time, f"Discount: {state.session_discount_percentage}")
 
     # # Run customer loyalty task only once when session starts
     # customer_id = "CUST001"
-    # if not customer_loyalty_executed:
+    # if not state.customer_loyalty_executed:
     #     asyncio.create_task(run_customer_loyalty_task(customer_id))
-    #     customer_loyalty_executed = True
+    #     state.customer_loyalty_executed = True
 
-    try:
-        while True:
-            message_start_time = time.time()
-            try:
-                data = await websocket.receive_text()
-                parsed = orjson.loads(data)  # Use orjson for faster parsing
-                user_message = parsed.get("message", "")
-                has_image = parsed.get("has_image", False)
-                image_url = parsed.get("image_url", "")
-                conversation_history = parsed.get("conversation_history", "")
-                has_video = parsed.get("has_video", False)
-                video_url = parsed.get("video_url", "")
-                cart = parsed.get("cart", [])
-                
-                # # Update persistent image URL if a new one is provided
-                if image_url:
-                    persistent_image_url = image_url
-                    logger.debug("Persistent image URL updated", extra={"url": persistent_image_url})
-                    log_cache_status(image_cache, image_url)
-                    # Pre-fetch the image description asynchronously
-                    asyncio.create_task(pre_fetch_image_description(image_url, image_cache))
-                
-                # Append user message to raw_io_history
-                raw_io_history.append({"input": user_message, "cart": persistent_cart})
-                log_timing("Message Parsing", message_start_time, f"Message length: {len(user_message)} chars")
-            except WebSocketDisconnect:
-                logger.info("WebSocket connection terminated - client disconnected from endpoint")
-                break
-            except Exception as e:
-                logger.error("Error parsing message", exc_info=True)
-                user_message = data if 'data' in locals() else ''
-                image_data = None
-                has_image = False
-                image_url = None
-                has_video = False
-                video_url = None
-                conversation_history = ""
-            
-            # Parse conversation history from string format
-            history_start_time = time.time()
-            try:
-                if conversation_history:
-                    # Clear existing chat history
-                    chat_history.clear()
-                    # Parse the string format: "user: message\nbot: message"
-                    lines = conversation_history.strip().split('\n')
-                    for i, line in enumerate(lines):
-                        if line.startswith('user: '):
-                            user_msg = line[6:]  # Remove "user: " prefix
-                            chat_history.append(("user", user_msg))
-                        elif line.startswith('bot: '):
-                            bot_msg = line[5:]   # Remove "bot: " prefix
-                            # Clean bot messages to remove large JSON data
-                            try:
-                                parsed_bot = orjson.loads(bot_msg)  # Use orjson
-                                # Handle list format (new agent response format)
-                                if isinstance(parsed_bot, list) and len(parsed_bot) > 0:
-                                    first_item = parsed_bot[0]
-                                    if isinstance(first_item, dict) and "answer" in first_item:
-                                        bot_msg = first_item["answer"]
-                                # Handle dict format (old format)
-                                elif isinstance(parsed_bot, dict) and "answer" in parsed_bot:
-                                    bot_msg = parsed_bot["answer"]
-                            except (orjson.JSONDecodeError, TypeError):
-                                pass
-                            chat_history.append(("bot", bot_msg))
-                    # Add the current user message to the history
-                    chat_history.append(("user", user_message))
-                else:
-                    chat_history.append(("user", user_message))
-                log_timing("History Parsing", history_start_time, f"History entries: {len(chat_history)}")
-            except Exception as e:
-                logger.error("Error parsing conversation history", exc_info=True)
-                chat_history.append(("user", user_message))
-            
-            await websocket.send_text(fast_json_dumps({"answer": "This application is not yet ready to serve results. Please check back later.", "agent": None, "cart": persistent_cart}))
-
-            # # Single-agent example
-            # try:
-            #     response = generate_response(user_message)
-            #     await websocket.send_text(fast_json_dumps({"answer": response, "agent": "single", "cart": persistent_cart}))
-            # except Exception as e:
-            #     logger.error("Error during single-agent response generation", exc_info=True)
-            #     await websocket.send_text(fast_json_dumps({"answer": "Error during single-agent response generation", "error": str(e), "cart": persistent_cart}))
-
-            # # Run router
-            # try:
-            #     router_start_time = time.time()
-            #     formatted_history = format_chat_history(redact_bad_prompts_in_history(chat_history, bad_prompts))
-            #     logger.debug("Router agent execution initiated - commencing agent selection protocol")
-            #     with tracer.start_as_current_span("Router Agent Call"):
-            #         router_reply = call_router(
-            #             router_client,
-            #             ROUTER_PROMPT,
-            #             formatted_history,
-            #             validated_env_vars['phi_4_deployment']
-            #         )
-            #     logger.debug("Router agent response received - agent selection criteria processed")
-            #     logger.debug(f"Router reply: {router_reply}")
-            #     log_timing("Router Processing", router_start_time, f"Reply length: {len(router_reply)} chars")
-            #     # Handle content filter error from router
-            #     if isinstance(router_reply, str) and router_reply.startswith("__CONTENT_FILTER_ERROR__"):
-            #         error_message = router_reply.replace("__CONTENT_FILTER_ERROR__", "").strip()
-            #         # Add the last user message to bad_prompts
-            #         if chat_history and chat_history[-1][0] == "user":
-            #             bad_prompts.add(chat_history[-1][1])
-            #         await websocket.send_text(fast_json_dumps({
-            #             "answer": "Your message triggered a content filter and cannot be processed. Please modify your prompt and try again.",
-            #             "agent": None,
-            #             "error": error_message,
-            #             "cart": persistent_cart
-            #         }))
-            #         continue
-            # except Exception as e:
-            #     logger.error("Error during router call", exc_info=True)
-            #     await websocket.send_text(fast_json_dumps({"answer": "Error during router call", "error": str(e), "cart": persistent_cart}))
-            #     continue
+    history_updated = False
+    # Client-assigned id of the current turn, echoed in its history frames
+    current_turn_id = None
+    speculation = None
+    # Admission slots held by the current turn; released when the turn ends
+    turn_permits = []
+
+    async def send_reply(text: str):
+        # Once a turn has started answering, a newer message waits for it instead of cancelling it
+        turn_queue.mark_replied()
+        await websocket.send_text(text)
+
+    async def after_turn(cancelled: bool):
+        nonlocal history_updated, speculation
+        if cancelled:
+            # Lets the client close any reply it was still streaming for the cancelled turn
+            await websocket.send_text(fast_json_dumps({"type": "turn_cancelled"}))
+        # Speculative work the turn did not use is cancelled and counted as wasted
+        if speculation is not None:
+            speculation.discard()
+            speculation = None
+        while turn_permits:
+            turn_permits.pop().release()
+        # Tell the client which history version its next message builds on
+        if history_updated:
+            state.history_version += 1
+            await websocket.send_text(fast_json_dumps({"type": "history", "history_version": state.history_version, "turn_id": current_turn_id}))
+            history_updated = False
+        # Persist the turn before the next one starts
+        await container.session_store.save(state)
+
+    async def process_turn(data: str, superseded: bool):
+        nonlocal history_updated, speculation, synced_version, current_turn_id
+        current_turn_id = None
+        message_start_time = time.time()
+        try:
+            parsed = orjson.loads(data)  # Use orjson for faster parsing
+            user_message = parsed.get("message", "")
+            has_image = parsed.get("has_image", False)
+            image_url = parsed.get("image_url", "")
+            conversation_history = parsed.get("conversation_history", "")
+            has_video = parsed.get("has_video", False)
+            video_url = parsed.get("video_url", "")
+            cart = parsed.get("cart", [])
+            # Streaming mode: forward reply deltas as they are generated
+            stream_mode = parsed.get("stream", False)
+            client_history_version = parsed.get("history_version")
+            current_turn_id = parsed.get("turn_id")
+
+            # The stored history is not the one the client built on (the session expired from
+            # the store, or resumed on a store that lost it and restarted at version 0): ask
+            # the client to resend this message with its full history
+            if (not conversation_history and client_history_version is not None
+                    and not synced_version <= client_history_version <= state.history_version):
+                await websocket.send_text(fast_json_dumps({"type": "history_resync", "history_version": state.history_version, "turn_id": current_turn_id}))
+                return
             
-            # # Check for 'cart' in the user query before agent selection
-            # try:
-            #     if 'cart' in user_message.lower():
-            #         cart_start_time = time.time()
-            #         # Use the full raw_io_history as JSON - optimize with orjson
-            #         cart_prompt = CART_UPDATE_PROMPT + "\nRAW_IO_HISTORY:\n" + fast_json_dumps(list(raw_io_history), option=orjson.OPT_INDENT_2)
-            #         logger.debug("Cora agent cart update operation initiated - commencing cart state modification")
-            #         cora_prompt = CORA_FALLBACK_PROMPT + "\n" + formatted_history
-
-            #         async def run_cart_update():
-            #             loop = asyncio.get_event_loop()
-            #             result = await loop.run_in_executor(thread_pool, cart_update, llm_client, cart_prompt)
-            #             return result
-            #         async def run_cora_fallback():
-            #             loop = asyncio.get_event_loop()
-            #             result = await loop.run_in_executor(thread_pool, cora_fallback, llm_client, cora_prompt)
-            #             return result
-
-            #         try:
-            #             cart_reply_raw, cora_reply_raw = await asyncio.gather(run_cart_update(), run_cora_fallback())
-            #         except Exception as e:
-            #             logger.error("Error processing cart/cora", exc_info=True)
-            #             await websocket.send_text(fast_json_dumps({"answer": "Error processing cart/cora", "error": str(e), "cart": persistent_cart}))
-            #             continue
-
-            #         cart_json = parse_agent_response(cart_reply_raw)
-            #         cora_json = parse_agent_response(cora_reply_raw)
-
-            #         logger.debug(f"Cart reply: {cart_reply_raw}")
-                    
-            #         logger.debug("Cart update operation completed - cart state successfully modified")
-            #         logger.debug("Cora agent thread execution terminated - response processing complete")
-
-            #         # Use new merge_cart_and_cora utility for robust merging
-            #         merged = merge_cart_and_cora(cart_reply_raw, cora_reply_raw)
-
-            #         logger.debug(f"Merged result: {merged}")
-            #         # Update persistent_cart with the latest cart state
-            #         if isinstance(merged.get("cart"), list):
-            #             persistent_cart = merged["cart"]
-            #         response_json = fast_json_dumps({**merged, "cart": persistent_cart})
-            #         raw_io_history.append({"output": response_json, "cart": persistent_cart})
-                    
-            #         # Add the merged response to chat history with products if available
-            #         bot_answer = merged.get("answer", "")
-            #         product_names = extract_product_names_from_response(merged)
-            #         chat_history.append(("bot", bot_answer + product_names))
-                    
-            #         await websocket.send_text(response_json)
-            #         log_timing("Cart/Cora Processing", cart_start_time, f"Cart items: {len(persistent_cart)}")
-            #         # After cart/cora response, send loyalty response if available (only once per session)
-            #         if session_loyalty_response and not loyalty_response_sent:
-            #             loyalty_response_with_cart = {**session_loyalty_response, "cart": persistent_cart}
-            #             await websocket.send_text(fast_json_dumps(loyalty_response_with_cart))
-            #             loyalty_response_sent = True
-            #         continue
-            # except Exception as e:
-            #     logger.error("Error in cart/cora handling", exc_info=True)
-            #     await websocket.send_text(fast_json_dumps({"answer": "Error in cart/cora handling", "error": str(e), "cart": persistent_cart}))
-            #     continue
-
-            # # Fallback message if no agent is selected
-            # try:
-            #     agent_selection_start_time = time.time()
-            #     agent_selected, agent_name = select_agent(router_reply, validated_env_vars)
-            #     if not agent_selected or not agent_name:
-            #         await websocket.send_text(fast_json_dumps({"answer": "Sorry, I could not determine the right agent.", "agent": None, "cart": persistent_cart}))
-            #         continue
-            #     logger.debug(f"Agent selection protocol completed - {agent_name} agent designated for task execution")
-            #     log_timing("Agent Selection", agent_selection_start_time, f"Selected: {agent_name}")
-            # except Exception as e:
-            #     logger.error("Error during agent selection", exc_info=True)
-            #     await websocket.send_text(fast_json_dumps({"answer": "Error during agent selection", "error": str(e), "cart": persistent_cart}))
-            #     continue
+            # # Update persistent image URL if a new one is provided
+            if image_url:
+                state.persistent_image_url = image_url
+                logger.debug("Persistent image URL updated", extra={"url": state.persistent_image_url})
+                log_cache_status(image_url)
+                # Pre-fetch the image description asynchronously
+                asyncio.create_task(pre_fetch_image_description(image_url))
             
-            # try:
-            #     agent_execution_start_time = time.time()
-            #     #check agent
-            #     if agent_name == "interior_designer":
-            #         logger.debug("Interior Designer agent execution initiated - commencing design consultation protocol")
-            #         with tracer.start_as_current_span("Zava Interior Designer Agent Call"):
-            #             image_data = None
-            #             video_summary = None
-            #             products = None
-
-            #             if not image_url and not video_url:
-            #                 product_start_time = time.time()
-            #                 products = product_recommendations(user_message)
-                            
-            #                 log_timing("Product Recommendations", product_start_time, f"Products found: {len(products) if products else 0}")
-            #                 logger.debug("Product recommendation engine execution completed - catalog query processed")
+            # Append user message to raw_io_history
+            state.raw_io_history.append({"input": user_message, "cart": state.persistent_cart})
+            log_timing("Message Parsing", message_start_time, f"Message length: {len(user_message)} chars")
+        except Exception as e:
+            logger.error("Error parsing message", exc_info=True)
+            user_message = data
+            image_data = None
+            has_image = False
+            image_url = None
+            has_video = False
+            video_url = None
+            conversation_history = ""
+            stream_mode = False
+        
+        # Apply the new turn to the server-side history. Clients normally send only the new
+        # message and the history version they last saw; the full history string is only
+        # sent to resync, so parsing cost and frame size stay flat as the conversation grows.
+        history_start_time = time.time()
+        try:
+            if conversation_history:
+                state.chat_history = redact_bad_prompts_in_history(
+                    parse_conversation_history(conversation_history, CHAT_HISTORY_MAXLEN),
+                    state.bad_prompts
+                )
+                synced_version = state.history_version
+                logger.debug("Conversation history resynced from client")
+            state.chat_history.append(("user", user_message))
+            log_timing("History Update", history_start_time, f"History entries: {len(state.chat_history)}")
+        except Exception as e:
+            logger.error("Error parsing conversation history", exc_info=True)
+            state.chat_history.append(("user", user_message))
+        history_updated = True
+        if superseded:
+            # A newer message is already queued behind this one: keep it in the history only
+            return
+        
+        await send_reply(fast_json_dumps({"answer": "This application is not yet ready to serve results. Please check back later.", "agent": None, "cart": state.persistent_cart}))
 
-            #                 user_message = f"{user_message}\n\nProducts: {fast_json_dumps(products)}"
-            #                 user_message = format_user_message_with_products(
-            #                     image_url or "", image_data or "", video_summary or "", 
-            #                     formatted_history, products
-            #                 )
+        # # Single-agent example
+        # try:
+        #     response = generate_response(user_message)
+        #     await send_reply(fast_json_dumps({"answer": response, "agent": "single", "cart": state.persistent_cart}))
+        # except Exception as e:
+        #     logger.error("Error during single-agent response generation", exc_info=True)
+        #     await send_reply(fast_json_dumps({"answer": "Error during single-agent response generation", "error": str(e), "cart": state.persistent_cart}))
 
-            #                 fallback_prompt = FALLBACK_PROMPT + f"\n\n {user_message}"
-                            
-            #                 fallback_start_time = time.time()
-            #                 fallback_reply = call_fallback(
-            #                     llm_client,
-            #                     fallback_prompt,
-            #                     validated_env_vars['gpt_deployment']
-            #                 )
-            #                 log_timing("Interior Designer Fallback", fallback_start_time, "No image/video")
-                            
-            #                 msg = fallback_reply
-            #                 bot_reply = extract_bot_reply(msg)
+        # # Run router
+        # try:
+        #     router_start_time = time.time()
+        #     # Bad prompts are redacted in the stored history as soon as they are detected
+        #     formatted_history = format_chat_history(state.chat_history)
+        #     # Start the design agents' product search while the router decides
+        #     speculation = product_speculator.begin(user_message, image_url, video_url)
+        #     logger.debug("Router agent execution initiated - commencing agent selection protocol")
+        #     with tracer.start_as_current_span("Router Agent Call"):
+        #         router_reply = await intent_router.route(
+        #             state.chat_history,
+        #             formatted_history,
+        #             lambda: admission.run("router", lambda: call_router(
+        #                 container.router_client,
+        #                 container.router_prompt,
+        #                 formatted_history,
+        #                 validated_env_vars['phi_4_deployment']
+        #             ))
+        #         )
+        #     logger.debug("Router agent response received - agent selection criteria processed")
+        #     logger.debug(f"Router reply: {router_reply}")
+        #     log_timing("Router Processing", router_start_time, f"Reply length: {len(router_reply)} chars")
+        #     # Handle content filter error from router
+        #     if isinstance(router_reply, str) and router_reply.startswith("__CONTENT_FILTER_ERROR__"):
+        #         error_message = router_reply.replace("__CONTENT_FILTER_ERROR__", "").strip()
+        #         # Add the last user message to bad_prompts and redact it from the history
+        #         if state.chat_history and state.chat_history[-1][0] == "user":
+        #             state.bad_prompts.add(state.chat_history[-1][1])
+        #             state.chat_history[-1] = ("user", "<redacted>")
+        #         await send_reply(fast_json_dumps({
+        #             "answer": "Your message triggered a content filter and cannot be processed. Please modify your prompt and try again.",
+        #             "agent": None,
+        #             "error": error_message,
+        #             "cart": state.persistent_cart
+        #         }))
+        #         return
+        # except AdmissionRejected:
+        #     await send_reply(fast_json_dumps({"answer": BUSY_MESSAGE, "agent": None, "busy": True, "cart": state.persistent_cart}))
+        #     return
+        # except Exception as e:
+        #     logger.error("Error during router call", exc_info=True)
+        #     await send_reply(fast_json_dumps({"answer": "Error during router call", "error": str(e), "cart": state.persistent_cart}))
+        #     return
+        
+        # # Check for 'cart' in the user query before agent selection
+        # try:
+        #     if 'cart' in user_message.lower():
+        #         cart_start_time = time.time()
+        #         turn_permits.append(await admission.acquire("llm"))
+        #         # Use the full raw_io_history as JSON - optimize with orjson
+        #         cart_prompt = container.cart_update_prompt + "\nRAW_IO_HISTORY:\n" + fast_json_dumps(list(state.raw_io_history), option=orjson.OPT_INDENT_2)
+        #         logger.debug("Cora agent cart update operation initiated - commencing cart state modification")
+        #         cora_prompt = container.cora_fallback_prompt + "\n" + formatted_history
 
-            #             else:
-            #                 multimodal_data = ''
-                            
-            #                 if image_url:
-            #                     image_start_time = time.time()
-            #                     log_cache_status(image_cache, image_url)
-            #                     image_data = await get_cached_image_description(image_url, image_cache)
-            #                     log_timing("Image Analysis", image_start_time, f"URL: {image_url[:50]}...")
-            #                     multimodal_data =  image_data
-            #                     analysis_msg = get_rotating_message(IMAGE_ANALYSIS_MESSAGES)
-            #                     await websocket.send_text(fast_json_dumps({"answer": analysis_msg, "agent": "interior_designer", "cart": persistent_cart}))
-            #                     logger.debug("Image analysis pipeline completed - visual content processing terminated")
-                                
-            #                     product_start_time = time.time()
-            #                     products = product_recommendations(user_message + multimodal_data + "paint accessories, paint sprayers, drop cloths, painters tape")
-            #                     log_timing("Product Recommendations", product_start_time, f"Products found: {len(products) if products else 0}")
-            #                     logger.debug("Product recommendation engine execution completed - catalog query processed")
-            #                     user_message = f"{user_message}\n\nProducts: {fast_json_dumps(products)}"
-            #                     user_message = format_user_message_with_products(
-            #                         image_url or "", image_data or "", video_summary or "", 
-            #                         formatted_history, products
-            #                     )
-            #                     fallback_prompt = FALLBACK_PROMPT + f"\n\n {user_message}"
-                                
-            #                     fallback_start_time = time.time()
-            #                     fallback_reply = call_fallback(
-            #                         llm_client,
-            #                         fallback_prompt,
-            #                         validated_env_vars['gpt_deployment']
-            #                     )
-            #                     log_timing("Interior Designer Fallback", fallback_start_time, "With image")
-            #                     msg = fallback_reply
-            #                     bot_reply = extract_bot_reply(msg)
-                            
-                            
-            #                 elif video_url:
-            #                     video_start_time = time.time()
-            #                     logger.debug("Video analysis initiated - commencing video content processing")
-            #                     video_summary = get_video_summary(video_url)
-            #                     thank_you_msg = get_rotating_message(VIDEO_UPLOAD_MESSAGES)
-            #                     await websocket.send_text(fast_json_dumps({"answer": thank_you_msg, "agent": "interior_designer", "cart": persistent_cart}))
-            #                     log_timing("Video Analysis", video_start_time, f"URL: {video_url[:50]}...")
-            #                     multimodal_data = video_summary
-            #                     analysis_msg = get_rotating_message(VIDEO_ANALYSIS_MESSAGES)
-            #                     await websocket.send_text(fast_json_dumps({"answer": analysis_msg, "agent": "interior_designer", "cart": persistent_cart}))
-            #                     logger.debug("Video analysis pipeline completed - temporal content processing terminated")
-            #                     # await websocket.send_text(fast_json_dumps({"answer": multimodal_data, "agent": "interior_designer", "cart": persistent_cart}))
-            #                     product_start_time = time.time()
-            #                     products = product_recommendations(user_message + multimodal_data + "paint accessories, paint sprayers, drop cloths, painters tape")
-            #                     log_timing("Product Recommendations", product_start_time, f"Products found: {len(products) if products else 0}")
-            #                     logger.debug("Product recommendation engine execution completed - catalog query processed")
-            #                     user_message = f"{user_message}\n\nProducts: {fast_json_dumps(products)}"
-            #                     user_message = format_user_message_with_products(
-            #                         image_url or "", image_data or "", video_summary or "", 
-            #                         formatted_history, products
-            #                     )
-            #                     fallback_prompt = "Received video from user:" + FALLBACK_PROMPT + f"\n\n {user_message}"
-                                
-            #                     fallback_start_time = time.time()
-            #                     fallback_reply = call_fallback(
-            #                         llm_client,
-            #                         fallback_prompt,
-            #                         validated_env_vars['gpt_deployment']
-            #                     )
-            #                     log_timing("Interior Designer Fallback", fallback_start_time, "With video")
-            #                     msg = fallback_reply
-            #                     bot_reply = extract_bot_reply(msg)
+        #         try:
+        #             if stream_mode:
+        #                 # Stream cora's reply while the cart update runs alongside it
+        #                 cart_task = asyncio.create_task(cart_update(container.llm_client, cart_prompt))
+        #                 try:
+        #                     cora_reply_raw = await stream_reply(send_reply, stream_cora_fallback(container.llm_client, cora_prompt), "cora")
+        #                 except Exception:
+        #                     cart_task.cancel()
+        #                     raise
+        #                 cart_reply_raw = await cart_task
+        #             else:
+        #                 cart_reply_raw, cora_reply_raw = await asyncio.gather(
+        #                     cart_update(container.llm_client, cart_prompt),
+        #                     cora_fallback(container.llm_client, cora_prompt)
+        #                 )
+        #         except Exception as e:
+        #             logger.error("Error processing cart/cora", exc_info=True)
+        #             await send_reply(fast_json_dumps({"answer": "Error processing cart/cora", "error": str(e), "cart": state.persistent_cart}))
+        #             return
+
+        #         cart_json = parse_agent_response(cart_reply_raw)
+        #         cora_json = parse_agent_response(cora_reply_raw)
+
+        #         logger.debug(f"Cart reply: {cart_reply_raw}")
                 
-            #     elif agent_name == "interior_designer_create_image":
-            #         logger.debug("Interior Designer agent execution initiated - commencing design consultation protocol")
-            #         with tracer.start_as_current_span("Zava Interior Designer Agent Call"):
-            #             image_data = None
-            #             video_summary = None
-            #             products = None
-            #             thank_you_msg = get_rotating_message(IMAGE_CREATE_MESSAGES)
-            #             await websocket.send_text(fast_json_dumps({"answer": thank_you_msg, "agent": "interior_designer", "cart": persistent_cart}))
-            #             multimodal_data = ''
-                        
-            #             image_start_time = time.time()
-            #             log_cache_status(image_cache, persistent_image_url)
-            #             image_data = await get_cached_image_description(persistent_image_url, image_cache)
-            #             log_timing("Image Analysis (Create)", image_start_time, f"URL: {persistent_image_url[:50]}...")
-            #             multimodal_data =  image_data
-            #             logger.debug("Image analysis pipeline completed - visual content processing terminated")
-            #             user_message = str(user_message) + str(multimodal_data)
+        #         logger.debug("Cart update operation completed - cart state successfully modified")
+        #         logger.debug("Cora agent thread execution terminated - response processing complete")
+
+        #         # Use new merge_cart_and_cora utility for robust merging
+        #         merged = merge_cart_and_cora(cart_reply_raw, cora_reply_raw)
+
+        #         logger.debug(f"Merged result: {merged}")
+        #         # Update persistent_cart with the latest cart state
+        #         if isinstance(merged.get("cart"), list):
+        #             state.persistent_cart = merged["cart"]
+        #         response_json = fast_json_dumps({**merged, "cart": state.persistent_cart})
+        #         state.raw_io_history.append({"output": response_json, "cart": state.persistent_cart})
+                
+        #         # Add the merged response to chat history with products if available
+        #         bot_answer = merged.get("answer", "")
+        #         product_names = extract_product_names_from_response(merged)
+        #         state.chat_history.append(("bot", bot_answer + product_names))
+                
+        #         await send_reply(response_json)
+        #         log_timing("Cart/Cora Processing", cart_start_time, f"Cart items: {len(state.persistent_cart)}")
+        #         # After cart/cora response, send loyalty response if available (only once per session)
+        #         if state.session_loyalty_response and not state.loyalty_response_sent:
+        #             loyalty_response_with_cart = {**state.session_loyalty_response, "cart": state.persistent_cart}
+        #             await send_reply(fast_json_dumps(loyalty_response_with_cart))
+        #             state.loyalty_response_sent = True
+        #         return
+        # except AdmissionRejected:
+        #     await send_reply(fast_json_dumps({"answer": BUSY_MESSAGE, "agent": None, "busy": True, "cart": state.persistent_cart}))
+        #     return
+        # except Exception as e:
+        #     logger.error("Error in cart/cora handling", exc_info=True)
+        #     await send_reply(fast_json_dumps({"answer": "Error in cart/cora handling", "error": str(e), "cart": state.persistent_cart}))
+        #     return
+
+        # # Fallback message if no agent is selected
+        # try:
+        #     agent_selection_start_time = time.time()
+        #     agent_selected, agent_name = select_agent(router_reply, validated_env_vars)
+        #     if not agent_selected or not agent_name:
+        #         await send_reply(fast_json_dumps({"answer": "Sorry, I could not determine the right agent.", "agent": None, "cart": state.persistent_cart}))
+        #         return
+        #     logger.debug(f"Agent selection protocol completed - {agent_name} agent designated for task execution")
+        #     if agent_name not in DESIGN_AGENTS:
+        #         speculation.discard()
+        #     log_timing("Agent Selection", agent_selection_start_time, f"Selected: {agent_name}")
+        # except Exception as e:
+        #     logger.error("Error during agent selection", exc_info=True)
+        #     await send_reply(fast_json_dumps({"answer": "Error during agent selection", "error": str(e), "cart": state.persistent_cart}))
+        #     return
+        
+        # try:
+        #     agent_execution_start_time = time.time()
+        #     turn_permits.append(await admission.acquire(AGENT_WORKLOADS.get(agent_name, "agent")))
+        #     #check agent
+        #     if agent_name == "interior_designer":
+        #         logger.debug("Interior Designer agent execution initiated - commencing design consultation protocol")
+        #         with tracer.start_as_current_span("Zava Interior Designer Agent Call"):
+        #             image_data = None
+        #             video_summary = None
+        #             products = None
+
+        #             if not image_url and not video_url:
+        #                 product_start_time = time.time()
+        #                 products = await speculation.products(user_message)
                         
-            #             product_start_time = time.time()
-            #             products = product_recommendations(user_message + "paint accessories, sprayers, drop cloths, painters tape")
-            #             log_timing("Product Recommendations", product_start_time, f"Products found: {len(products) if products else 0}")
-            #             logger.debug("Product recommendation engine execution completed - catalog query processed")
-            #             INSTRUCTIONS = "ADDITIONAL INFO: Along with the created image, say that it will be good to have paint accessories, sprayers, drop cloths, painters tape"
-            #             user_message = f"{user_message + INSTRUCTIONS}\n\nProducts: {fast_json_dumps(products)}"
-            #             user_message = format_user_message_with_products(
-            #                 persistent_image_url or "", image_data or "", video_summary or "", 
-            #                 formatted_history, products
-            #             )
+        #                 log_timing("Product Recommendations", product_start_time, f"Products found: {len(products) if products else 0}")
+        #                 logger.debug("Product recommendation engine execution completed - catalog query processed")
+
+        #                 user_message = f"{user_message}\n\nProducts: {fast_json_dumps(products)}"
+        #                 user_message = format_user_message_with_products(
+        #                     image_url or "", image_data or "", video_summary or "", 
+        #                     formatted_history, products
+        #                 )
+
+        #                 fallback_prompt = container.fallback_prompt + f"\n\n {user_message}"
                         
-            #             image = create_image(text=user_message, image_url=persistent_image_url)
-
-            #             # Create the response in the specified format and send directly to frontend
-            #             response_data = {
-            #                 "answer": "Here is the requested image",
-            #                 "products": "",
-            #                 "discount_percentage": session_discount_percentage or "",
-            #                 "image_url": image,
-            #                 "video_url": "",
-            #                 "additional_data": "",
-            #                 "cart": persistent_cart
-            #             }
+        #                 fallback_start_time = time.time()
+        #                 if stream_mode:
+        #                     fallback_reply = await stream_reply(
+        #                         send_reply,
+        #                         stream_fallback(container.llm_client, fallback_prompt, validated_env_vars['gpt_deployment']),
+        #                         "interior_designer"
+        #                     )
+        #                 else:
+        #                     fallback_reply = await call_fallback(
+        #                         container.llm_client,
+        #                         fallback_prompt,
+        #                         validated_env_vars['gpt_deployment']
+        #                     )
+        #                 log_timing("Interior Designer Fallback", fallback_start_time, "No image/video")
                         
-            #             # Send the response directly to frontend
-            #             response_json = fast_json_dumps(response_data)
-            #             raw_io_history.append({"output": response_json, "cart": persistent_cart})
+        #                 msg = fallback_reply
+        #                 bot_reply = extract_bot_reply(msg)
+
+        #             else:
+        #                 multimodal_data = ''
                         
-            #             # Add to chat history
-            #             bot_answer = response_data.get("answer", "")
-            #             product_names = extract_product_names_from_response(response_data)
-            #             chat_history.append(("bot", bot_answer + product_names))
+        #                 if image_url:
+        #                     image_start_time = time.time()
+        #                     log_cache_status(image_url)
+        #                     image_data = await speculation.image_description(image_url)
+        #                     log_timing("Image Analysis", image_start_time, f"URL: {image_url[:50]}...")
+        #                     multimodal_data =  image_data
+        #                     analysis_msg = get_rotating_message(IMAGE_ANALYSIS_MESSAGES)
+        #                     await send_reply(fast_json_dumps({"answer": analysis_msg, "agent": "interior_designer", "cart": state.persistent_cart}))
+        #                     logger.debug("Image analysis pipeline completed - visual content processing terminated")
+                            
+        #                     product_start_time = time.time()
+        #                     products = await speculation.products_for_image(user_message, image_url, multimodal_data)
+        #                     log_timing("Product Recommendations", product_start_time, f"Products found: {len(products) if products else 0}")
+        #                     logger.debug("Product recommendation engine execution completed - catalog query processed")
+        #                     user_message = f"{user_message}\n\nProducts: {fast_json_dumps(products)}"
+        #                     user_message = format_user_message_with_products(
+        #                         image_url or "", image_data or "", video_summary or "", 
+        #                         formatted_history, products
+        #                     )
+        #                     fallback_prompt = container.fallback_prompt + f"\n\n {user_message}"
+                            
+        #                     fallback_start_time = time.time()
+        #                     if stream_mode:
+        #                         fallback_reply = await stream_reply(
+        #                             send_reply,
+        #                             stream_fallback(container.llm_client, fallback_prompt, validated_env_vars['gpt_deployment']),
+        #                             "interior_designer"
+        #                         )
+        #                     else:
+        #                         fallback_reply = await call_fallback(
+        #                             container.llm_client,
+        #                             fallback_prompt,
+        #                             validated_env_vars['gpt_deployment']
+        #                         )
+        #                     log_timing("Interior Designer Fallback", fallback_start_time, "With image")
+        #                     msg = fallback_reply
+        #                     bot_reply = extract_bot_reply(msg)
                         
-            #             await websocket.send_text(response_json)
-            #             log_timing("Agent Execution", agent_execution_start_time, f"Agent: {agent_name}")
-            #             continue  # Skip the common response handling below
-                
-            #     elif agent_name == "cora":
-            #         logger.debug("Cora agent execution initiated - commencing conversational AI protocol")
-            #         with tracer.start_as_current_span("Agent Cora Call"):
-            #             prompt_for_cora = CORA_FALLBACK_PROMPT + formatted_history 
                         
-            #             cora_start_time = time.time()
-            #             cora_fallback_reply = cora_fallback(
-            #                 llm_client,
-            #                 prompt_for_cora,
-            #                 validated_env_vars['phi_4_deployment']
-            #             )
-            #             log_timing("Cora Agent Call", cora_start_time, "Fallback model")
-            #             msg = cora_fallback_reply
-            #             bot_reply = extract_bot_reply(msg)
-            #         logger.debug("Cora agent execution terminated - conversational AI protocol completed")
-                
-            #     else:
-            #         logger.debug(f"{agent_name} agent execution initiated - commencing specialized task protocol")
-            #         with tracer.start_as_current_span("Customer Loyalty Agent Call - Additional"):
-            #             processor = get_or_create_agent_processor(
-            #                 agent_id=agent_selected,
-            #                 agent_type=agent_name,
-            #                 thread_id=thread.id,
-            #                 project_client=project_client
-            #             )
-            #         logger.debug(f"{agent_name} agent execution terminated - specialized task protocol completed")
-            #         bot_reply = ""
-            #         async for msg in processor.run_conversation_with_text_stream(input_message=user_message):
-            #             bot_reply = extract_bot_reply(msg)
-                
-            #     log_timing("Agent Execution", agent_execution_start_time, f"Agent: {agent_name}")
-                
-            #     # Parse the response first to get products
-            #     parsed_response = parse_agent_response(bot_reply)
-            #     parsed_response["agent"] = agent_name  # Override agent field
-                
-            #     # Add the bot reply to chat history with products if available
-            #     bot_answer = parsed_response.get("answer", bot_reply or "")
-            #     product_names = extract_product_names_from_response(parsed_response)
-            #     chat_history.append(("bot", bot_answer + product_names))
-            #     print(f"Chat history after bot reply: {chat_history}")
-                
-            #     # Clean the conversation history to remove large product data
-            #     chat_history = clean_conversation_history(chat_history)
-            #     print(f"Chat history after bot reply: {chat_history}")
-                
-            #     # Update session discount_percentage if a new one is received
-            #     if parsed_response.get("discount_percentage"):
-            #         session_discount_percentage = parsed_response["discount_percentage"]
-                
-            #     # Include session discount_percentage in all responses if available
-            #     if session_discount_percentage and not parsed_response.get("discount_percentage"):
-            #         parsed_response["discount_percentage"] = session_discount_percentage
-                
-            #     # When sending any other response, also append to raw_io_history
-            #     response_json = fast_json_dumps({**parsed_response, "cart": persistent_cart})
-            #     raw_io_history.append({"output": response_json, "cart": persistent_cart})
-            #     await websocket.send_text(response_json)
-            # except Exception as e:
-            #     logger.error("Error in agent execution", exc_info=True)
-            #     try:
-            #         await websocket.send_text(fast_json_dumps({"answer": "Internal server error", "error": str(e), "cart": persistent_cart}))
-            #     except Exception:
-            #         pass
+        #                 elif video_url:
+        #                     video_start_time = time.time()
+        #                     logger.debug("Video analysis initiated - commencing video content processing")
+        #                     video_summary = get_video_summary(video_url)
+        #                     thank_you_msg = get_rotating_message(VIDEO_UPLOAD_MESSAGES)
+        #                     await send_reply(fast_json_dumps({"answer": thank_you_msg, "agent": "interior_designer", "cart": state.persistent_cart}))
+        #                     log_timing("Video Analysis", video_start_time, f"URL: {video_url[:50]}...")
+        #                     multimodal_data = video_summary
+        #                     analysis_msg = get_rotating_message(VIDEO_ANALYSIS_MESSAGES)
+        #                     await send_reply(fast_json_dumps({"answer": analysis_msg, "agent": "interior_designer", "cart": state.persistent_cart}))
+        #                     logger.debug("Video analysis pipeline completed - temporal content processing terminated")
+        #                     # await send_reply(fast_json_dumps({"answer": multimodal_data, "agent": "interior_designer", "cart": state.persistent_cart}))
+        #                     product_start_time = time.time()
+        #                     products = await product_recommendations_with_accessories(user_message + multimodal_data)
+        #                     log_timing("Product Recommendations", product_start_time, f"Products found: {len(products) if products else 0}")
+        #                     logger.debug("Product recommendation engine execution completed - catalog query processed")
+        #                     user_message = f"{user_message}\n\nProducts: {fast_json_dumps(products)}"
+        #                     user_message = format_user_message_with_products(
+        #                         image_url or "", image_data or "", video_summary or "", 
+        #                         formatted_history, products
+        #                     )
+        #                     fallback_prompt = "Received video from user:" + container.fallback_prompt + f"\n\n {user_message}"
+                            
+        #                     fallback_start_time = time.time()
+        #                     if stream_mode:
+        #                         fallback_reply = await stream_reply(
+        #                             send_reply,
+        #                             stream_fallback(container.llm_client, fallback_prompt, validated_env_vars['gpt_deployment']),
+        #                             "interior_designer"
+        #                         )
+        #                     else:
+        #                         fallback_reply = await call_fallback(
+        #                             container.llm_client,
+        #                             fallback_prompt,
+        #                             validated_env_vars['gpt_deployment']
+        #                         )
+        #                     log_timing("Interior Designer Fallback", fallback_start_time, "With video")
+        #                     msg = fallback_reply
+        #                     bot_reply = extract_bot_reply(msg)
+            
+        #     elif agent_name == "interior_designer_create_image":
+        #         logger.debug("Interior Designer agent execution initiated - commencing design consultation protocol")
+        #         with tracer.start_as_current_span("Zava Interior Designer Agent Call"):
+        #             image_data = None
+        #             video_summary = None
+        #             products = None
+        #             thank_you_msg = get_rotating_message(IMAGE_CREATE_MESSAGES)
+        #             await send_reply(fast_json_dumps({"answer": thank_you_msg, "agent": "interior_designer", "cart": state.persistent_cart}))
+        #             multimodal_data = ''
+                    
+        #             image_start_time = time.time()
+        #             log_cache_status(state.persistent_image_url)
+        #             image_data = await speculation.image_description(state.persistent_image_url)
+        #             log_timing("Image Analysis (Create)", image_start_time, f"URL: {state.persistent_image_url[:50]}...")
+        #             multimodal_data =  image_data
+        #             logger.debug("Image analysis pipeline completed - visual content processing terminated")
+        #             user_message = str(user_message) + str(multimodal_data)
+                    
+        #             product_start_time = time.time()
+        #             products = await product_recommendations_with_accessories(user_message)
+        #             log_timing("Product Recommendations", product_start_time, f"Products found: {len(products) if products else 0}")
+        #             logger.debug("Product recommendation engine execution completed - catalog query processed")
+        #             INSTRUCTIONS = "ADDITIONAL INFO: Along with the created image, say that it will be good to have paint accessories, sprayers, drop cloths, painters tape"
+        #             user_message = f"{user_message + INSTRUCTIONS}\n\nProducts: {fast_json_dumps(products)}"
+        #             user_message = format_user_message_with_products(
+        #                 state.persistent_image_url or "", image_data or "", video_summary or "", 
+        #                 formatted_history, products
+        #             )
+                    
+        #             image = create_image(text=user_message, image_url=state.persistent_image_url)
+
+        #             # Create the response in the specified format and send directly to frontend
+        #             response_data = {
+        #                 "answer": "Here is the requested image",
+        #                 "products": "",
+        #                 "discount_percentage": state.session_discount_percentage or "",
+        #                 "image_url": image,
+        #                 "video_url": "",
+        #                 "additional_data": "",
+        #                 "cart": state.persistent_cart
+        #             }
+                    
+        #             # Send the response directly to frontend
+        #             response_json = fast_json_dumps(response_data)
+        #             state.raw_io_history.append({"output": response_json, "cart": state.persistent_cart})
+                    
+        #             # Add to chat history
+        #             bot_answer = response_data.get("answer", "")
+        #             product_names = extract_product_names_from_response(response_data)
+        #             state.chat_history.append(("bot", bot_answer + product_names))
+                    
+        #             await send_reply(response_json)
+        #             log_timing("Agent Execution", agent_execution_start_time, f"Agent: {agent_name}")
+        #             return  # Skip the common response handling below
+            
+        #     elif agent_name == "cora":
+        #         logger.debug("Cora agent execution initiated - commencing conversational AI protocol")
+        #         with tracer.start_as_current_span("Agent Cora Call"):
+        #             prompt_for_cora = container.cora_fallback_prompt + formatted_history 
+                    
+        #             cora_start_time = time.time()
+        #             if stream_mode:
+        #                 cora_fallback_reply = await stream_reply(
+        #                     send_reply,
+        #                     stream_cora_fallback(container.llm_client, prompt_for_cora, validated_env_vars['phi_4_deployment']),
+        #                     "cora"
+        #                 )
+        #             else:
+        #                 cora_fallback_reply = await cora_fallback(
+        #                     container.llm_client,
+        #                     prompt_for_cora,
+        #                     validated_env_vars['phi_4_deployment']
+        #                 )
+        #             log_timing("Cora Agent Call", cora_start_time, "Fallback model")
+        #             msg = cora_fallback_reply
+        #             bot_reply = extract_bot_reply(msg)
+        #         logger.debug("Cora agent execution terminated - conversational AI protocol completed")
+            
+        #     else:
+        #         logger.debug(f"{agent_name} agent execution initiated - commencing specialized task protocol")
+        #         with tracer.start_as_current_span("Customer Loyalty Agent Call - Additional"):
+        #             processor = get_or_create_agent_processor(
+        #                 agent_id=agent_selected,
+        #                 agent_type=agent_name,
+        #                 project_client=container.project_client,
+        #                 async_agents_client=container.async_agents_client
+        #             )
+        #         logger.debug(f"{agent_name} agent execution terminated - specialized task protocol completed")
+        #         run_context = RunContext(thread_id=await ensure_thread())
+        #         bot_reply = ""
+        #         if stream_mode:
+        #             async def agent_deltas():
+        #                 async for event in processor.stream_conversation_events(run_context, input_message=user_message):
+        #                     if event.kind == "delta":
+        #                         yield event.data
+        #                     elif event.kind == "error":
+        #                         raise RuntimeError(f"Error processing message: {event.data}")
+        #             async def run_agent():
+        #                 return await stream_reply(send_reply, agent_deltas(), agent_name)
+        #         else:
+        #             async def run_agent():
+        #                 reply = ""
+        #                 async for msg in processor.run_conversation_with_text_stream(run_context, input_message=user_message):
+        #                     reply = extract_bot_reply(msg)
+        #                 return reply
+        #         # Past the message's budget the run is cancelled and the user gets TIMEOUT_MESSAGE
+        #         bot_reply = await deadline_runner.run(
+        #             agent_name,
+        #             run_agent,
+        #             budget=TURN_LATENCY_BUDGET_SECONDS - (time.time() - message_start_time),
+        #             is_valid=is_valid_agent_reply
+        #         )
+            
+        #     log_timing("Agent Execution", agent_execution_start_time, f"Agent: {agent_name}")
+            
+        #     # Parse the response first to get products
+        #     parsed_response = parse_agent_response(bot_reply)
+        #     parsed_response["agent"] = agent_name  # Override agent field
+            
+        #     # Add the bot reply to chat history with products if available
+        #     bot_answer = parsed_response.get("answer", bot_reply or "")
+        #     product_names = extract_product_names_from_response(parsed_response)
+        #     # Only the answer text is stored, so the history needs no further cleaning
+        #     state.chat_history.append(("bot", bot_answer + product_names))
+        #     print(f"Chat history after bot reply: {state.chat_history}")
+            
+        #     # Update session discount_percentage if a new one is received
+        #     if parsed_response.get("discount_percentage"):
+        #         state.session_discount_percentage = parsed_response["discount_percentage"]
+            
+        #     # Include session discount_percentage in all responses if available
+        #     if state.session_discount_percentage and not parsed_response.get("discount_percentage"):
+        #         parsed_response["discount_percentage"] = state.session_discount_percentage
+            
+        #     # When sending any other response, also append to raw_io_history
+        #     response_json = fast_json_dumps({**parsed_response, "cart": state.persistent_cart})
+        #     state.raw_io_history.append({"output": response_json, "cart": state.persistent_cart})
+        #     await send_reply(response_json)
+        # except AdmissionRejected:
+        #     await send_reply(fast_json_dumps({"answer": BUSY_MESSAGE, "agent": agent_name, "busy": True, "cart": state.persistent_cart}))
+        # except DeadlineExceeded:
+        #     await send_reply(fast_json_dumps({"answer": TIMEOUT_MESSAGE, "agent": agent_name, "cart": state.persistent_cart}))
+        # except Exception as e:
+        #     logger.error("Error in agent execution", exc_info=True)
+        #     try:
+        #         await send_reply(fast_json_dumps({"answer": "Internal server error", "error": str(e), "cart": state.persistent_cart}))
+        #     except Exception:
+        #         pass
+
+    # Messages are received independently of turn processing, so a newer message can
+    # supersede (cancel) a turn that has not started answering instead of waiting behind it
+    turn_queue = SessionTurnQueue(
+        process_turn,
+        after_turn,
+        turn_queue_metrics,
+        maxsize=SESSION_QUEUE_SIZE,
+        cancel_superseded=CANCEL_SUPERSEDED_TURNS
+    )
+    turn_queue.start()
+    try:
+        while True:
+            data = await websocket.receive_text()
+            if not turn_queue.submit(data):
+                await websocket.send_text(fast_json_dumps({"answer": BUSY_MESSAGE, "agent": None, "busy": True, "cart": state.persistent_cart}))
     except WebSocketDisconnect:
         pass
     except Exception as e:
         logger.error("WebSocket session error", exc_info=True)
         try:
-            await websocket.send_text(fast_json_dumps({"answer": "Internal server error", "error": str(e), "cart": persistent_cart}))
+            await websocket.send_text(fast_json_dumps({"answer": "Internal server error", "error": str(e), "cart": state.persistent_cart}))
         except Exception:
             pass
     finally:
+        logger.info("WebSocket connection terminated - client disconnected from endpoint")
+        await turn_queue.close()
+        if speculation is not None:
+            speculation.discard()
+        while turn_permits:
+            turn_permits.pop().release()
+        await container.session_store.save(state)
         session_duration = time.time() - session_start_time
         logger.info(f"WebSocket Session Ended - Duration: {session_duration:.3f}s")
 
@@ -0,0 +1,26 @@
+import multiprocessing
+import os
+
+# Gunicorn configuration for the Zava chat app (chat_app:app).
+# Clients and telemetry are created per worker in the FastAPI lifespan, so the app
+# can be preloaded in the master and forked into several workers.
+# Sessions only outlive their worker in a shared store (SESSION_STORE=sqlite or redis);
+# with the default in-memory store a reconnect landing on another worker, or on a
+# recycled one, would lose its cart, history and discount.
+shared_session_store = os.environ.get("SESSION_STORE", "memory").lower() in ("sqlite", "redis")
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() if shared_session_store else 1))
+if workers > 1 and not shared_session_store:
+    raise RuntimeError(
+        f"WEB_CONCURRENCY={workers} needs a shared session store: set SESSION_STORE=sqlite or redis"
+    )
+worker_class = "uvicorn.workers.UvicornWorker"
+timeout = 300
+keepalive = 2
+max_requests = 1000 if shared_session_store else 0
+max_requests_jitter = 50
+preload_app = True
+accesslog = "-"
+errorlog = "-"
+capture_output = True
+enable_stdio_inheritance = True
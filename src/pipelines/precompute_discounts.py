@@ -0,0 +1,148 @@
+"""
+Precompute the loyalty discount of every customer into a SQLite lookup table.
+
+Loyalty data changes at most daily, so the discount rule engine is run over the
+whole customer base in chunks (vectorized, optionally across a process pool) and
+the results are written to a table that the app looks up by CustomerID. The new
+table is written next to the old one and swapped in atomically.
+
+The input is a CSV of loyalty profiles with the columns CustomerID, LoyaltyTier,
+Tenure, Churn and TotalAmountSpentThisYear; --synthetic N scores N generated
+profiles instead (useful to measure throughput).
+
+Usage (from src/):
+    python pipelines/precompute_discounts.py --input data/customer_loyalty_profile.csv
+    python pipelines/precompute_discounts.py --synthetic 1000000 --workers 4
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SRC_DIR)
+
+from services.discount_service import (
+    DEFAULT_DISCOUNT_TABLE_PATH, LOYALTY_TIER_SCORES, DISCOUNT_TIERS, discount_explanation, score_customers
+)
+
+PROFILE_COLUMNS = ["CustomerID", "LoyaltyTier", "Tenure", "Churn", "TotalAmountSpentThisYear"]
+
+
+def read_profiles(path, chunk_size):
+    for chunk in pd.read_csv(path, usecols=PROFILE_COLUMNS, chunksize=chunk_size):
+        yield chunk
+
+
+def synthetic_profiles(count, chunk_size, seed=7):
+    rng = np.random.default_rng(seed)
+    tiers = np.array(list(LOYALTY_TIER_SCORES))
+    for start in range(0, count, chunk_size):
+        size = min(chunk_size, count - start)
+        churn = rng.random(size)
+        churn[rng.random(size) < 0.05] = np.nan
+        yield pd.DataFrame({
+            "CustomerID": [f"CUST{i:07d}" for i in range(start, start + size)],
+            "LoyaltyTier": tiers[rng.integers(0, len(tiers), size)],
+            "Tenure": rng.integers(0, 15, size),
+            "Churn": churn,
+            "TotalAmountSpentThisYear": rng.gamma(2.0, 200.0, size).round(2),
+        })
+
+
+def score_chunk(chunk):
+    """Rows (CustomerID, discount_percentage, discount_tier, loyalty_tier, explanation) of one chunk."""
+    percentages = score_customers(chunk["LoyaltyTier"], chunk["Tenure"], chunk["Churn"], chunk["TotalAmountSpentThisYear"])
+    tiers = np.searchsorted(DISCOUNT_TIERS[:, 1], percentages, side="left") + 1
+    explanations = [
+        discount_explanation(loyalty_tier, tenure, percentage, tier)
+        for loyalty_tier, tenure, percentage, tier in zip(chunk["LoyaltyTier"], chunk["Tenure"], percentages, tiers)
+    ]
+    return list(zip(
+        chunk["CustomerID"].astype(str),
+        percentages.tolist(),
+        tiers.tolist(),
+        chunk["LoyaltyTier"].astype(str),
+        explanations,
+    ))
+
+
+def score_in_pool(chunks, workers, max_in_flight):
+    """
+    Scored chunks, in input order, from a pool of workers. Only max_in_flight chunks are
+    submitted at a time, so memory stays bounded by the window rather than the customer count.
+    """
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(score_chunk, chunk))
+            if len(pending) >= max_in_flight:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def create_table(path):
+    if os.path.exists(path):
+        os.remove(path)
+    connection = sqlite3.connect(path)
+    connection.execute("PRAGMA journal_mode = OFF")
+    connection.execute("PRAGMA synchronous = OFF")
+    connection.execute(
+        "CREATE TABLE discounts (CustomerID TEXT PRIMARY KEY, discount_percentage REAL, "
+        "discount_tier INTEGER, loyalty_tier TEXT, explanation TEXT) WITHOUT ROWID"
+    )
+    # Build time and size of the table, reported by the app's /metrics
+    connection.execute("CREATE TABLE metadata (key TEXT PRIMARY KEY, value TEXT)")
+    return connection
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute the discount lookup table.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input", help="CSV of customer loyalty profiles")
+    source.add_argument("--synthetic", type=int, help="score this many generated profiles instead")
+    parser.add_argument("--output", default=DEFAULT_DISCOUNT_TABLE_PATH)
+    parser.add_argument("--chunk-size", type=int, default=100_000)
+    parser.add_argument("--workers", type=int, default=1, help="processes scoring chunks (1 scores inline)")
+    parser.add_argument("--max-in-flight", type=int, default=None,
+                        help="chunks submitted to the pool at once (default: twice the workers)")
+    args = parser.parse_args()
+
+    chunks = read_profiles(args.input, args.chunk_size) if args.input else synthetic_profiles(args.synthetic, args.chunk_size)
+    temp_path = args.output + ".tmp"
+    connection = create_table(temp_path)
+    insert = "INSERT OR REPLACE INTO discounts VALUES (?, ?, ?, ?, ?)"
+
+    start_time = time.perf_counter()
+    customers = 0
+    if args.workers > 1:
+        scored = score_in_pool(chunks, args.workers, args.max_in_flight or 2 * args.workers)
+    else:
+        scored = (score_chunk(chunk) for chunk in chunks)
+    for rows in scored:
+        connection.executemany(insert, rows)
+        customers += len(rows)
+        print(f"{customers} customers scored")
+    connection.executemany(
+        "INSERT INTO metadata VALUES (?, ?)", [("built_at", repr(time.time())), ("customers", str(customers))]
+    )
+    connection.commit()
+    connection.close()
+    # Readers keep the old table until the new one is complete, then reopen it on their next check
+    os.replace(temp_path, args.output)
+    elapsed = time.perf_counter() - start_time
+
+    size_mb = os.path.getsize(args.output) / 1e6
+    print(f"Wrote {customers} discounts to {args.output} ({size_mb:.1f} MB) in {elapsed:.2f}s: "
+          f"{customers / elapsed if elapsed else 0:,.0f} customers/sec")
+
+
+if __name__ == "__main__":
+    main()
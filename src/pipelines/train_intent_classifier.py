@@ -0,0 +1,94 @@
+"""
+Train the local intent classifier used in front of the Phi-4 router.
+
+Examples come from the Query/Reply pairs in prompts/routerPrompt.txt plus any
+labelled transcripts given as JSONL lines of {"message": ..., "context": ..., "label": ...}
+("context" is the preceding bot turn and is optional).
+
+Usage (from src/):
+    python pipelines/train_intent_classifier.py --transcripts data/router_labels.jsonl
+"""
+import argparse
+import os
+import random
+import re
+import sys
+
+import orjson
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SRC_DIR)
+
+from services.intent_service import ROUTER_LABELS, HashedNgramClassifier, label_from_router_reply
+
+ROUTER_PROMPT_PATH = os.path.join(SRC_DIR, "prompts", "routerPrompt.txt")
+DEFAULT_OUTPUT = os.path.join(SRC_DIR, "data", "intent_classifier.npz")
+
+
+def load_prompt_examples(path):
+    """Split each 'Query: a/b/c' example of the router prompt into one example per alternative."""
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    examples = []
+    for query, reply in re.findall(r"Query:\s*(.+?)\s*\nReply:\s*(\S+)", text):
+        label = label_from_router_reply(reply)
+        for alternative in query.split("/"):
+            if alternative.strip():
+                examples.append((alternative.strip(), "", label))
+    return examples
+
+
+def load_transcripts(paths):
+    examples = []
+    for path in paths:
+        with open(path, "rb") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = orjson.loads(line)
+                label = label_from_router_reply(record["label"])
+                if label is not None:
+                    examples.append((record["message"], record.get("context", ""), label))
+    return examples
+
+
+def accuracy(classifier, examples, threshold):
+    correct = confident = confident_correct = 0
+    for message, context, label in examples:
+        predicted, confidence = classifier.predict(message, context)
+        correct += predicted == label
+        if confidence >= threshold:
+            confident += 1
+            confident_correct += predicted == label
+    total = len(examples) or 1
+    return correct / total, confident / total, (confident_correct / confident) if confident else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--transcripts", nargs="*", default=[], help="Labelled JSONL transcript files")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    parser.add_argument("--epochs", type=int, default=30)
+    parser.add_argument("--holdout", type=float, default=0.2, help="Fraction of transcript examples held out for evaluation")
+    parser.add_argument("--threshold", type=float, default=0.9, help="Confidence threshold to report coverage at")
+    args = parser.parse_args()
+
+    prompt_examples = load_prompt_examples(ROUTER_PROMPT_PATH)
+    transcript_examples = load_transcripts(args.transcripts)
+    random.Random(0).shuffle(transcript_examples)
+    split = int(len(transcript_examples) * args.holdout)
+    heldout, train = transcript_examples[:split], transcript_examples[split:] + prompt_examples
+    print(f"Training on {len(train)} examples ({len(prompt_examples)} from the router prompt), {len(heldout)} held out")
+
+    classifier = HashedNgramClassifier(ROUTER_LABELS).fit(train, epochs=args.epochs)
+    for name, examples in (("train", train), ("heldout", heldout)):
+        if examples:
+            acc, coverage, confident_acc = accuracy(classifier, examples, args.threshold)
+            print(f"{name}: accuracy={acc:.3f} coverage@{args.threshold}={coverage:.3f} accuracy@{args.threshold}={confident_acc:.3f}")
+
+    classifier.save(args.output)
+    print(f"Saved intent classifier to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
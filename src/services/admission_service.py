@@ -0,0 +1,123 @@
+"""
+Process-wide admission control for heavy model work.
+
+Each workload class (router, llm, agent, image, ...) has its own concurrency limit.
+A caller waits at most a bounded time for a slot; past that it is rejected with
+AdmissionRejected so the turn can fail fast or degrade instead of piling up.
+"""
+import asyncio
+import os
+import statistics
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+from utils.performance_utils import percentile
+
+DEFAULT_LIMITS = {"router": 32, "llm": 32, "agent": 8, "image": 4}
+
+
+class AdmissionRejected(Exception):
+    """Raised when a workload class has no free slot within its wait budget."""
+
+    def __init__(self, workload: str, waited: float):
+        super().__init__(f"{workload} workload is at capacity (waited {waited:.2f}s)")
+        self.workload = workload
+        self.waited = waited
+
+
+class Permit:
+    """A held admission slot. release() is idempotent."""
+
+    def __init__(self, controller: "AdmissionController", workload: str):
+        self._controller = controller
+        self.workload = workload
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._controller._release(self.workload)
+
+
+class _WorkloadClass:
+    def __init__(self, limit: int, max_wait: float):
+        self.limit = limit
+        self.max_wait = max_wait
+        self.semaphore: Optional[asyncio.Semaphore] = None
+        self.in_use = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.wait_times = deque(maxlen=1000)
+
+
+class AdmissionController:
+    """Per-workload semaphores with a bounded wait."""
+
+    def __init__(self, limits: Dict[str, int], max_wait_seconds: float = 2.0):
+        self._classes = {name: _WorkloadClass(limit, max_wait_seconds) for name, limit in limits.items()}
+
+    def _get_class(self, workload: str) -> _WorkloadClass:
+        workload_class = self._classes[workload]
+        if workload_class.semaphore is None:
+            # Created lazily so the semaphore binds to the serving event loop
+            workload_class.semaphore = asyncio.Semaphore(workload_class.limit)
+        return workload_class
+
+    async def acquire(self, workload: str) -> Permit:
+        """Wait up to the class's max wait for a slot, or raise AdmissionRejected."""
+        workload_class = self._get_class(workload)
+        start_time = time.perf_counter()
+        workload_class.waiting += 1
+        try:
+            await asyncio.wait_for(workload_class.semaphore.acquire(), timeout=workload_class.max_wait)
+        except asyncio.TimeoutError:
+            workload_class.rejected += 1
+            raise AdmissionRejected(workload, time.perf_counter() - start_time)
+        finally:
+            workload_class.waiting -= 1
+        workload_class.wait_times.append(time.perf_counter() - start_time)
+        workload_class.in_use += 1
+        workload_class.admitted += 1
+        return Permit(self, workload)
+
+    def _release(self, workload: str):
+        workload_class = self._classes[workload]
+        workload_class.in_use -= 1
+        workload_class.semaphore.release()
+
+    async def run(self, workload: str, call):
+        """Await call() while holding a slot of the given workload class."""
+        permit = await self.acquire(workload)
+        try:
+            return await call()
+        finally:
+            permit.release()
+
+    def stats(self) -> Dict[str, Any]:
+        result = {}
+        for name, workload_class in self._classes.items():
+            wait_times = list(workload_class.wait_times)
+            result[name] = {
+                "limit": workload_class.limit,
+                "in_use": workload_class.in_use,
+                "waiting": workload_class.waiting,
+                "admitted": workload_class.admitted,
+                "rejected": workload_class.rejected,
+                "wait_ms": {
+                    "avg": statistics.mean(wait_times) * 1000 if wait_times else 0.0,
+                    "p95": percentile(wait_times, 0.95) * 1000,
+                    "max": max(wait_times) * 1000 if wait_times else 0.0,
+                },
+            }
+        return result
+
+
+def create_admission_controller() -> AdmissionController:
+    """Limits come from ADMISSION_<CLASS>_LIMIT, the wait budget from ADMISSION_MAX_WAIT_SECONDS."""
+    limits = {
+        name: int(os.getenv(f"ADMISSION_{name.upper()}_LIMIT", str(default)))
+        for name, default in DEFAULT_LIMITS.items()
+    }
+    return AdmissionController(limits, float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "2.0")))
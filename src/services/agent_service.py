@@ -1,21 +1,20 @@
 from app.agents.agent_processor import AgentProcessor
 from typing import Dict
 
+# One processor per agent, shared by every session: processors hold no per-session
+# state, the thread of each run is passed in a RunContext instead
 _agent_processor_cache: Dict[str, AgentProcessor] = {}
 
-def get_or_create_agent_processor(agent_id: str, agent_type: str, thread_id: str, project_client) -> AgentProcessor:
+def get_or_create_agent_processor(agent_id: str, agent_type: str, project_client, async_agents_client=None) -> AgentProcessor:
     """Get cached AgentProcessor or create new one to avoid repeated initialization."""
     cache_key = f"{agent_type}_{agent_id}"
-    if cache_key in _agent_processor_cache:
-        processor = _agent_processor_cache[cache_key]
-        processor.thread_id = thread_id
-        processor.project_client.agents.enable_auto_function_calls(tools=processor.toolset)
-        return processor
-    processor = AgentProcessor(
-        project_client=project_client,  # project_client is now passed as an argument
-        assistant_id=agent_id,
-        agent_type=agent_type,
-        thread_id=thread_id
-    )
-    _agent_processor_cache[cache_key] = processor
-    return processor 
\ No newline at end of file
+    processor = _agent_processor_cache.get(cache_key)
+    if processor is None:
+        processor = AgentProcessor(
+            project_client=project_client,  # project_client is now passed as an argument
+            assistant_id=agent_id,
+            agent_type=agent_type,
+            async_agents_client=async_agents_client
+        )
+        _agent_processor_cache[cache_key] = processor
+    return processor
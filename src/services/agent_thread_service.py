@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import statistics
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+from utils.performance_utils import percentile
+
+logger = logging.getLogger(__name__)
+
+class AgentThreadPool:
+    """
+    Pool of pre-created agent threads, refilled in the background, that sessions lease
+    lazily when an agent path first needs one. A lease is a queue pop instead of a
+    remote threads.create round trip; an empty pool falls back to creating on demand.
+    Threads still unleased when the pool stops are deleted, so restarts do not leak them.
+    """
+
+    def __init__(self, project_client, target_size: int = 4, refill_concurrency: int = 2):
+        self.project_client = project_client
+        self.target_size = target_size
+        self.refill_concurrency = refill_concurrency
+        self._ready: Optional[asyncio.Queue] = None
+        self._refill_needed: Optional[asyncio.Event] = None
+        self._refill_task: Optional[asyncio.Task] = None
+        self._lease_latencies = deque(maxlen=1000)
+        self.leases = 0
+        self.pool_hits = 0
+        self.pool_misses = 0
+        self.created = 0
+        self.create_errors = 0
+        self.deleted = 0
+        self.delete_errors = 0
+
+    def start(self):
+        """Start the background refill loop (must be called from the running event loop)."""
+        if self._refill_task is not None:
+            return
+        self._ready = asyncio.Queue()
+        self._refill_needed = asyncio.Event()
+        self._refill_needed.set()
+        self._refill_task = asyncio.create_task(self._refill_loop())
+
+    async def stop(self):
+        """Stop refilling and delete the pre-created threads no session leased."""
+        if self._refill_task is not None:
+            self._refill_task.cancel()
+            try:
+                await self._refill_task
+            except asyncio.CancelledError:
+                pass
+            self._refill_task = None
+        if self._ready is None:
+            return
+        thread_ids = []
+        while not self._ready.empty():
+            thread_ids.append(self._ready.get_nowait())
+        results = await asyncio.gather(
+            *(asyncio.to_thread(self.project_client.agents.threads.delete, thread_id) for thread_id in thread_ids),
+            return_exceptions=True
+        )
+        for thread_id, result in zip(thread_ids, results):
+            if isinstance(result, Exception):
+                self.delete_errors += 1
+                logger.warning(f"Could not delete unleased agent thread {thread_id}: {result}")
+            else:
+                self.deleted += 1
+
+    async def _create_thread(self) -> str:
+        thread = await asyncio.to_thread(self.project_client.agents.threads.create)
+        self.created += 1
+        return thread.id
+
+    async def _refill_loop(self):
+        backoff = 1.0
+        while True:
+            await self._refill_needed.wait()
+            self._refill_needed.clear()
+            missing = self.target_size - self._ready.qsize()
+            while missing > 0:
+                batch = min(missing, self.refill_concurrency)
+                results = await asyncio.gather(
+                    *(self._create_thread() for _ in range(batch)), return_exceptions=True
+                )
+                failed = False
+                for result in results:
+                    if isinstance(result, Exception):
+                        self.create_errors += 1
+                        failed = True
+                        logger.warning(f"Agent thread pre-creation failed: {result}")
+                    else:
+                        self._ready.put_nowait(result)
+                if failed:
+                    # Back off instead of hammering a failing endpoint, then retry
+                    await asyncio.sleep(backoff)
+                    backoff = min(backoff * 2, 60.0)
+                    self._refill_needed.set()
+                    break
+                backoff = 1.0
+                missing = self.target_size - self._ready.qsize()
+
+    async def lease(self) -> str:
+        """Take a ready thread id from the pool, creating one on demand if it is empty."""
+        start_time = time.perf_counter()
+        if self._ready is not None and not self._ready.empty():
+            thread_id = self._ready.get_nowait()
+            self.pool_hits += 1
+        else:
+            self.pool_misses += 1
+            thread_id = await self._create_thread()
+        self.leases += 1
+        self._lease_latencies.append(time.perf_counter() - start_time)
+        if self._refill_needed is not None:
+            self._refill_needed.set()
+        return thread_id
+
+    def stats(self) -> Dict[str, Any]:
+        latencies = list(self._lease_latencies)
+        return {
+            "pool_size": self._ready.qsize() if self._ready is not None else 0,
+            "target_size": self.target_size,
+            "leases": self.leases,
+            "pool_hits": self.pool_hits,
+            "pool_misses": self.pool_misses,
+            "threads_created": self.created,
+            "create_errors": self.create_errors,
+            "threads_deleted": self.deleted,
+            "delete_errors": self.delete_errors,
+            "lease_latency_ms": {
+                "avg": statistics.mean(latencies) * 1000 if latencies else 0.0,
+                "p50": percentile(latencies, 0.50) * 1000,
+                "p95": percentile(latencies, 0.95) * 1000,
+                "max": max(latencies) * 1000 if latencies else 0.0,
+            },
+        }
@@ -0,0 +1,110 @@
+"""
+Per-worker application container.
+
+Everything that holds sockets, background threads or event-loop bound resources
+(Azure clients, telemetry exporters, the session store, the agent thread pool) is
+built here from the FastAPI lifespan, i.e. once per worker after gunicorn forks,
+instead of at import time in the master process.
+"""
+import asyncio
+import logging
+import os
+from typing import Dict
+
+from azure.ai.agents.aio import AgentsClient as AsyncAgentsClient
+from azure.ai.projects import AIProjectClient
+from azure.identity import DefaultAzureCredential
+from azure.identity.aio import DefaultAzureCredential as AsyncDefaultAzureCredential
+
+from services.agent_thread_service import AgentThreadPool
+from services.context_service import thread_context
+from services.warmup_service import WarmupState
+from app.tools.aiSearchTools import close_search_clients
+from services.inventory_service import inventory_snapshots
+from services.discount_service import open_discount_lookup
+from services.llm_service import get_router_client, get_llm_client, close_llm_clients
+from services.session_service import create_session_store
+from utils.telemetry_utils import configure_telemetry
+
+logger = logging.getLogger(__name__)
+
+PROMPTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "prompts")
+
+def _read_prompt(file_name: str) -> str:
+    with open(os.path.join(PROMPTS_DIR, file_name), "r") as file:
+        return file.read()
+
+
+class AppContainer:
+    """Clients, stores and prompts owned by one worker process."""
+
+    def __init__(self, env_vars: Dict[str, str]):
+        self.env_vars = env_vars
+        configure_telemetry()
+
+        self.router_prompt = _read_prompt("routerPrompt.txt")
+        self.fallback_prompt = _read_prompt("fallBackPrompt.txt")
+        self.cora_fallback_prompt = _read_prompt("CoraPrompt.txt")
+        self.cart_update_prompt = _read_prompt("addToCartPrompt.txt")
+
+        project_endpoint = os.environ.get("AZURE_AI_AGENT_ENDPOINT")
+        if not project_endpoint:
+            raise ValueError("AZURE_AI_AGENT_ENDPOINT environment variable is required")
+        self.project_client = AIProjectClient(
+            endpoint=project_endpoint,
+            credential=DefaultAzureCredential(),
+        )
+        # Async agents client for streaming runs on the event loop
+        self._async_credential = AsyncDefaultAzureCredential()
+        self.async_agents_client = AsyncAgentsClient(endpoint=project_endpoint, credential=self._async_credential)
+
+        # Shared async clients: LLM calls run on the event loop instead of the thread pool
+        self.router_client = get_router_client(
+            env_vars['phi_4_endpoint'],
+            env_vars['phi_4_api_key'],
+            env_vars['phi_4_api_version']
+        )
+        self.llm_client = get_llm_client(
+            env_vars['AZURE_OPENAI_ENDPOINT'],
+            env_vars['AZURE_OPENAI_KEY'],
+            env_vars['AZURE_OPENAI_API_VERSION'],
+        )
+
+        # Session state backend selected by SESSION_STORE (memory, sqlite or redis)
+        self.session_store = create_session_store()
+
+        # Pre-created agent threads leased by sessions on first agent use
+        self.agent_thread_pool = AgentThreadPool(
+            self.project_client,
+            target_size=int(os.getenv("AGENT_THREAD_POOL_SIZE", "4"))
+        )
+
+        # Precomputed discounts (pipelines/precompute_discounts.py); None if there is no table
+        self.discount_lookup = open_discount_lookup()
+
+        # Connections, toolsets and agent processors are warmed before the worker reports ready
+        self.warmup = WarmupState()
+
+    async def start(self):
+        """Start background work; must run on the worker's event loop."""
+        self.agent_thread_pool.start()
+        # Idle-time rolling summaries of agent threads (when AGENT_CONTEXT_SUMMARY is on)
+        thread_context.start(self.llm_client, self.env_vars['gpt_deployment'])
+        self.warmup.start(self)
+        # Inventory checks read a snapshot reloaded by a background thread
+        inventory_snapshots.start()
+        logger.info(f"Application container started in worker {os.getpid()}")
+
+    async def close(self):
+        await self.warmup.stop()
+        await asyncio.to_thread(inventory_snapshots.stop)
+        await self.agent_thread_pool.stop()
+        await thread_context.stop()
+        await close_llm_clients()
+        await close_search_clients()
+        await self.session_store.close()
+        if self.discount_lookup is not None:
+            self.discount_lookup.close()
+        await self.async_agents_client.close()
+        await self._async_credential.close()
+        self.project_client.close()
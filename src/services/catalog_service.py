@@ -0,0 +1,150 @@
+"""
+In-process BM25 index over the product catalog.
+
+The catalog is a few dozen products, so the whole index is one dense float32 matrix
+of precomputed BM25 term weights (terms x products) plus one column per product
+field. A query is a handful of row sums and a partial sort, well under a
+millisecond, which lets product recommendations be served without the remote
+search service when it is slow or failing (or always, in local-first mode).
+"""
+import csv
+import logging
+import os
+import re
+import statistics
+import threading
+import time
+from collections import Counter, deque
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from utils.performance_utils import percentile
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CATALOG_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "updated_product_catalog(in).csv"
+)
+
+# Indexed fields and how many times a term in them counts
+FIELD_WEIGHTS = {"ProductName": 3, "ProductCategory": 2, "ProductPunchLine": 1, "ProductDescription": 1}
+# Product fields kept in columns, in the shape of the search tool's results
+RESULT_FIELDS = {
+    "id": "ProductID",
+    "name": "ProductName",
+    "type": "ProductCategory",
+    "description": "ProductDescription",
+    "imageURL": "ImageURL",
+    "punchLine": "ProductPunchLine",
+    "price": "Price",
+}
+
+STOPWORDS = frozenset(
+    "a an and are as at be by for from i in is it me my of on or our some that the this to with you your "
+    "want need looking like can could would please show get".split()
+)
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word tokens without stopwords, with a naive plural fold (brushes -> brush)."""
+    tokens = []
+    for token in _TOKEN_RE.findall(str(text).lower()):
+        if token in STOPWORDS:
+            continue
+        if len(token) > 4 and token.endswith("es") and token[-3] in "sxh":
+            token = token[:-2]
+        elif len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+class CatalogIndex:
+    """BM25 over the weighted product fields, stored as a dense term-weight matrix."""
+
+    def __init__(self, rows: List[Dict[str, str]], k1: float = 1.2, b: float = 0.75):
+        self.columns = {name: [row.get(field) for row in rows] for name, field in RESULT_FIELDS.items()}
+        self.columns["price"] = [float(price) if price else None for price in self.columns["price"]]
+        documents = [
+            Counter(token for field, weight in FIELD_WEIGHTS.items() for token in tokenize(row.get(field, "")) * weight)
+            for row in rows
+        ]
+        self.vocabulary = {term: index for index, term in enumerate(sorted({t for doc in documents for t in doc}))}
+        tf = np.zeros((len(self.vocabulary), len(rows)), dtype=np.float32)
+        for doc_index, doc in enumerate(documents):
+            for term, count in doc.items():
+                tf[self.vocabulary[term], doc_index] = count
+        lengths = tf.sum(axis=0)
+        avg_length = lengths.mean() if len(rows) else 1.0
+        doc_freq = (tf > 0).sum(axis=1)
+        idf = np.log(1.0 + (len(rows) - doc_freq + 0.5) / (doc_freq + 0.5)).astype(np.float32)
+        norm = k1 * (1.0 - b + b * lengths / avg_length)
+        self.weights = (idf[:, None] * tf * (k1 + 1.0) / (tf + norm[None, :])).astype(np.float32)
+        self._lock = threading.Lock()
+        self.searches = 0
+        self.fallbacks = 0
+        self.latencies = deque(maxlen=1000)
+
+    @classmethod
+    def from_csv(cls, path: str = DEFAULT_CATALOG_PATH) -> "CatalogIndex":
+        # The catalog export is Windows-1252 encoded
+        with open(path, newline="", encoding="cp1252") as file:
+            return cls(list(csv.DictReader(file)))
+
+    def __len__(self) -> int:
+        return self.weights.shape[1]
+
+    def product(self, index: int) -> Dict[str, Any]:
+        return {name: column[index] for name, column in self.columns.items()}
+
+    def search(self, query: str, top: int = 8) -> List[Dict[str, Any]]:
+        """Best matching products for query, most relevant first (empty if no term matches)."""
+        start_time = time.perf_counter()
+        rows = [self.vocabulary[term] for term in tokenize(query) if term in self.vocabulary]
+        results = []
+        if rows:
+            scores = self.weights[rows].sum(axis=0)
+            top = min(top, len(scores))
+            candidates = np.argpartition(-scores, top - 1)[:top]
+            for index in candidates[np.argsort(-scores[candidates], kind="stable")]:
+                if scores[index] > 0:
+                    results.append(self.product(int(index)))
+        with self._lock:
+            self.searches += 1
+            self.latencies.append(time.perf_counter() - start_time)
+        return results
+
+    def record_fallback(self, reason: str):
+        with self._lock:
+            self.fallbacks += 1
+        logger.warning(f"Product search served from the local catalog index: {reason}")
+
+    def stats(self) -> Dict[str, Any]:
+        latencies = list(self.latencies)
+        return {
+            "products": len(self),
+            "terms": len(self.vocabulary),
+            "index_bytes": self.weights.nbytes,
+            "searches": self.searches,
+            "fallbacks": self.fallbacks,
+            "latency_ms": {
+                "avg": statistics.mean(latencies) * 1000 if latencies else 0.0,
+                "p99": percentile(latencies, 0.99) * 1000,
+            },
+        }
+
+
+_catalog_index: Optional[CatalogIndex] = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog_index() -> CatalogIndex:
+    """Process-wide index, built from CATALOG_CSV_PATH on first use (the warm-up builds it at startup)."""
+    global _catalog_index
+    if _catalog_index is None:
+        with _catalog_lock:
+            if _catalog_index is None:
+                _catalog_index = CatalogIndex.from_csv(os.getenv("CATALOG_CSV_PATH", DEFAULT_CATALOG_PATH))
+    return _catalog_index
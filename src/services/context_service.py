@@ -0,0 +1,249 @@
+"""
+Bounded context for agent threads.
+
+Session threads grow for as long as the session lives. Every run is therefore
+started with a last-N-messages truncation strategy, and the window of a thread
+shrinks when its runs exceed the prompt-token budget. Optionally every message is
+also kept here until a background job has folded it into a rolling summary, once it
+fell out of the window: while the thread is idle, or as soon as a batch of them has
+piled up. The summary is passed to the next run as additional instructions.
+Prompt tokens and run latency are recorded per turn so /metrics shows whether they
+stay flat over a long session.
+"""
+import asyncio
+import logging
+import os
+import statistics
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from azure.ai.agents.models import TruncationObject, TruncationStrategy
+
+from services.thread_mirror_service import thread_mirror, message_text
+from utils.performance_utils import percentile
+
+logger = logging.getLogger(__name__)
+
+# Turns are grouped in buckets of this size for the per-turn metrics
+TURN_BUCKET_SIZE = 10
+
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a customer's conversation with a home improvement "
+    "store assistant. Update the summary with the new messages. Keep products, colors, "
+    "quantities, prices, discounts and decisions the customer made; drop small talk. "
+    "Answer with the summary only, at most 150 words."
+)
+
+
+class _ThreadContext:
+    __slots__ = ("window", "turns", "summary", "unsummarized", "last_run_at", "summarizing")
+
+    def __init__(self, window: int):
+        self.window = window
+        self.turns = 0
+        self.summary: Optional[str] = None
+        # (message id, role, text) of the messages not folded into the summary yet, oldest first
+        self.unsummarized: Deque[Tuple[str, str, str]] = deque()
+        self.last_run_at = 0.0
+        self.summarizing = False
+
+    def out_of_window(self) -> int:
+        """How many unsummarized messages already fell out of the truncation window."""
+        return max(0, len(self.unsummarized) - self.window)
+
+
+class _TurnBucket:
+    def __init__(self):
+        self.prompt_tokens = deque(maxlen=500)
+        self.latencies = deque(maxlen=500)
+
+
+class ThreadContextManager:
+    """Per-thread truncation window, rolling summary and prompt-size metrics."""
+
+    def __init__(self, last_messages: int = 10, prompt_token_budget: int = 8000, min_messages: int = 2,
+                 summarize: bool = False, idle_seconds: float = 60.0, max_threads: int = 1000,
+                 max_unsummarized: int = 200):
+        self.last_messages = last_messages
+        self.prompt_token_budget = prompt_token_budget
+        self.min_messages = min_messages
+        self.summarize = summarize
+        self.idle_seconds = idle_seconds
+        self.max_threads = max_threads
+        # A busy thread is summarized without waiting for idle once this many messages left its window
+        self.fold_batch = last_messages
+        # Hard cap per thread, only reached when summaries keep failing
+        self.max_unsummarized = max_unsummarized
+        self._threads: "OrderedDict[str, _ThreadContext]" = OrderedDict()
+        # Sync runs record from worker threads, streaming runs from the event loop
+        self._lock = threading.Lock()
+        self._buckets: Dict[int, _TurnBucket] = defaultdict(_TurnBucket)
+        self._summary_task: Optional[asyncio.Task] = None
+        self.runs = 0
+        self.over_budget = 0
+        self.summaries = 0
+        self.summary_errors = 0
+        self.messages_dropped = 0
+        if summarize:
+            thread_mirror.add_listener(self.record_messages)
+
+    def _thread(self, thread_id: str) -> _ThreadContext:
+        context = self._threads.get(thread_id)
+        if context is None:
+            context = self._threads[thread_id] = _ThreadContext(self.last_messages)
+            while len(self._threads) > self.max_threads:
+                self._threads.popitem(last=False)
+        self._threads.move_to_end(thread_id)
+        return context
+
+    def run_options(self, thread_id: str) -> Dict[str, Any]:
+        """Keyword arguments for runs.create / runs.stream that bound the run's prompt."""
+        with self._lock:
+            context = self._thread(thread_id)
+            window, summary = context.window, context.summary
+        options = {
+            "truncation_strategy": TruncationObject(type=TruncationStrategy.LAST_MESSAGES, last_messages=window)
+        }
+        if summary:
+            options["additional_instructions"] = f"Summary of the earlier conversation:\n{summary}"
+        return options
+
+    def record_messages(self, thread_id: str, messages):
+        """Keep new thread messages (oldest first) until they are folded into the summary."""
+        with self._lock:
+            context = self._thread(thread_id)
+            known = {entry[0] for entry in context.unsummarized}
+            for message in messages:
+                if message.id in known:
+                    continue
+                context.unsummarized.append((message.id, str(getattr(message.role, "value", message.role)), message_text(message)))
+            while len(context.unsummarized) > self.max_unsummarized:
+                context.unsummarized.popleft()
+                self.messages_dropped += 1
+
+    def record_run(self, thread_id: str, run, duration: float):
+        """Record a finished run's prompt tokens and latency, and adapt the thread's window to the budget."""
+        usage = getattr(run, "usage", None)
+        prompt_tokens = getattr(usage, "prompt_tokens", None) if usage is not None else None
+        with self._lock:
+            context = self._thread(thread_id)
+            context.turns += 1
+            context.last_run_at = time.monotonic()
+            self.runs += 1
+            bucket = self._buckets[(context.turns - 1) // TURN_BUCKET_SIZE]
+            bucket.latencies.append(duration)
+            if prompt_tokens is None:
+                return
+            bucket.prompt_tokens.append(prompt_tokens)
+            if prompt_tokens > self.prompt_token_budget:
+                self.over_budget += 1
+                context.window = max(self.min_messages, context.window // 2)
+            elif prompt_tokens < self.prompt_token_budget // 2 and context.window < self.last_messages:
+                context.window += 1
+
+    def start(self, llm_client, deployment: str):
+        """Start the idle-time summary job (must be called from the running event loop)."""
+        if self.summarize and self._summary_task is None:
+            self._summary_task = asyncio.create_task(self._summary_loop(llm_client, deployment))
+
+    async def stop(self):
+        if self._summary_task is not None:
+            self._summary_task.cancel()
+            try:
+                await self._summary_task
+            except asyncio.CancelledError:
+                pass
+            self._summary_task = None
+
+    def _threads_to_summarize(self):
+        now = time.monotonic()
+        with self._lock:
+            return [
+                (thread_id, context) for thread_id, context in self._threads.items()
+                if context.out_of_window() and not context.summarizing and (
+                    now - context.last_run_at >= self.idle_seconds or context.out_of_window() >= self.fold_batch
+                )
+            ]
+
+    async def _summarize(self, llm_client, deployment: str, thread_id: str, context: _ThreadContext):
+        # Only messages that already fell out of the window; they leave the queue once summarized
+        with self._lock:
+            messages = list(context.unsummarized)[:context.out_of_window()]
+            context.summarizing = True
+        try:
+            if not messages:
+                return
+            transcript = "\n".join(f"{role}: {text}" for _, role, text in messages)
+            previous = context.summary or "(none yet)"
+            completion = await llm_client.chat.completions.create(
+                model=deployment,
+                messages=[
+                    {"role": "system", "content": SUMMARY_PROMPT},
+                    {"role": "user", "content": f"Current summary:\n{previous}\n\nNew messages:\n{transcript}"},
+                ],
+                max_completion_tokens=300,
+            )
+            with self._lock:
+                context.summary = completion.choices[0].message.content
+                # Messages dropped by the hard cap meanwhile are already gone from the front
+                folded = {message_id for message_id, _, _ in messages}
+                while context.unsummarized and context.unsummarized[0][0] in folded:
+                    context.unsummarized.popleft()
+            self.summaries += 1
+        finally:
+            context.summarizing = False
+
+    async def _summary_loop(self, llm_client, deployment: str):
+        while True:
+            await asyncio.sleep(self.idle_seconds / 2)
+            for thread_id, context in self._threads_to_summarize():
+                try:
+                    await self._summarize(llm_client, deployment, thread_id, context)
+                except Exception as e:
+                    self.summary_errors += 1
+                    logger.warning(f"Rolling summary failed for thread {thread_id}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        by_turn = {}
+        for index in sorted(self._buckets):
+            bucket = self._buckets[index]
+            prompt_tokens, latencies = list(bucket.prompt_tokens), list(bucket.latencies)
+            by_turn[f"{index * TURN_BUCKET_SIZE + 1}-{(index + 1) * TURN_BUCKET_SIZE}"] = {
+                "runs": len(latencies),
+                "prompt_tokens": {
+                    "avg": statistics.mean(prompt_tokens) if prompt_tokens else 0.0,
+                    "p95": percentile(prompt_tokens, 0.95),
+                },
+                "latency_ms": {
+                    "avg": statistics.mean(latencies) * 1000 if latencies else 0.0,
+                    "p95": percentile(latencies, 0.95) * 1000,
+                },
+            }
+        return {
+            "last_messages": self.last_messages,
+            "prompt_token_budget": self.prompt_token_budget,
+            "summarize": self.summarize,
+            "threads": len(self._threads),
+            "runs": self.runs,
+            "over_budget": self.over_budget,
+            "summaries": self.summaries,
+            "summary_errors": self.summary_errors,
+            "messages_dropped": self.messages_dropped,
+            "by_turn": by_turn,
+        }
+
+
+def create_thread_context_manager() -> ThreadContextManager:
+    """Configured by AGENT_CONTEXT_LAST_MESSAGES, AGENT_PROMPT_TOKEN_BUDGET, AGENT_CONTEXT_SUMMARY and AGENT_CONTEXT_SUMMARY_IDLE_SECONDS."""
+    return ThreadContextManager(
+        last_messages=int(os.getenv("AGENT_CONTEXT_LAST_MESSAGES", "10")),
+        prompt_token_budget=int(os.getenv("AGENT_PROMPT_TOKEN_BUDGET", "8000")),
+        summarize=os.getenv("AGENT_CONTEXT_SUMMARY", "false").lower() == "true",
+        idle_seconds=float(os.getenv("AGENT_CONTEXT_SUMMARY_IDLE_SECONDS", "60")),
+    )
+
+
+# Process-wide context manager shared by every agent
+thread_context = create_thread_context_manager()
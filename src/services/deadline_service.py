@@ -0,0 +1,94 @@
+"""
+Deadline-bounded agent runs.
+
+Every message has a latency budget; an agent run, streamed or not, gets what is left
+of it. A run still going at its deadline is cancelled (which also cancels the remote
+run, freeing the thread) and the user gets a timeout answer instead of waiting on.
+A run that fails raises its own error, so a failure is never reported as slowness.
+
+These runs are not hedged: the agents behind them (inventory, customer loyalty)
+answer from their tools, and a direct model call has neither those tools nor the
+data, so it cannot stand in for them.
+"""
+import asyncio
+import statistics
+from collections import defaultdict, deque
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from utils.performance_utils import percentile
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a run produced no reply within its budget."""
+
+
+class InvalidReply(Exception):
+    """Raised when a run finished but its reply is a failure report rather than an answer."""
+
+
+class _AgentStats:
+    def __init__(self, window: int):
+        self.runs = 0
+        self.completed = 0
+        self.failed = 0
+        self.deadline_exceeded = 0
+        # Time until the run replied, failed or was cut off by its deadline
+        self.latencies = deque(maxlen=window)
+
+
+class DeadlineRunner:
+    """Runs agent calls within a latency budget and keeps per-agent outcome counts."""
+
+    def __init__(self, window: int = 200):
+        self._stats: Dict[str, _AgentStats] = defaultdict(lambda: _AgentStats(window))
+
+    async def run(self, agent_name: str, call: Callable[[], Awaitable[Any]], budget: float,
+                  is_valid: Optional[Callable[[Any], bool]] = None) -> Any:
+        """
+        Return the reply of call(). DeadlineExceeded is raised (and the call cancelled)
+        if it is still running after budget seconds; an error of the call is raised
+        unchanged, and a reply rejected by is_valid raises InvalidReply.
+        """
+        stats = self._stats[agent_name]
+        stats.runs += 1
+        loop = asyncio.get_running_loop()
+        started_at = loop.time()
+        if budget <= 0:
+            stats.deadline_exceeded += 1
+            raise DeadlineExceeded(f"{agent_name} had no time left in the message's budget")
+        task = asyncio.ensure_future(call())
+        try:
+            done, _ = await asyncio.wait({task}, timeout=budget)
+        finally:
+            if not task.done():
+                task.cancel()
+            stats.latencies.append(loop.time() - started_at)
+        if not done:
+            stats.deadline_exceeded += 1
+            raise DeadlineExceeded(f"{agent_name} produced no reply within {budget:.1f}s")
+        try:
+            reply = task.result()
+        except Exception:
+            stats.failed += 1
+            raise
+        if is_valid is not None and not is_valid(reply):
+            stats.failed += 1
+            raise InvalidReply(f"{agent_name} failed: {reply or 'empty reply'}")
+        stats.completed += 1
+        return reply
+
+    def stats(self) -> Dict[str, Any]:
+        result = {}
+        for name, stats in self._stats.items():
+            latencies = list(stats.latencies)
+            result[name] = {
+                "runs": stats.runs,
+                "completed": stats.completed,
+                "failed": stats.failed,
+                "deadline_exceeded": stats.deadline_exceeded,
+                "latency_ms": {
+                    "avg": statistics.mean(latencies) * 1000 if latencies else 0.0,
+                    "p95": percentile(latencies, 0.95) * 1000,
+                },
+            }
+        return result
@@ -0,0 +1,219 @@
+"""
+Deterministic loyalty discount engine.
+
+Encodes the discount scheme of prompts/DiscountLogicPrompt.txt as rules over the
+loyalty profile (tier, tenure, churn risk, spend this year). Customers are scored
+with vectorized NumPy, so one customer takes microseconds and a whole customer
+base one pass; a model is only needed, if at all, to word the result.
+pipelines/precompute_discounts.py scores the whole customer base into a SQLite
+lookup table that DiscountLookup serves at runtime.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DISCOUNT_TABLE_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "discounts.sqlite"
+)
+
+# (low, high) discount percentage of Tier 1 .. Tier 7
+DISCOUNT_TIERS = np.array(
+    [(0.0, 5.0), (5.0, 7.5), (7.5, 10.0), (10.0, 12.5), (12.5, 15.0), (15.0, 20.0), (20.0, 25.0)],
+    dtype=np.float64
+)
+LOYALTY_TIER_SCORES = {"Platinum": 1.0, "Gold": 0.7, "Silver": 0.4, "Bronze": 0.15}
+# Tenure and yearly spend at which their share of the loyalty score is full
+FULL_TENURE_YEARS = 10.0
+FULL_SPEND_THIS_YEAR = 1000.0
+LOYALTY_WEIGHTS = (0.4, 0.3, 0.3)  # tier, tenure, spend
+# Churn risk raises the discount to retain the customer
+CHURN_WEIGHT = 0.4
+
+
+class DiscountDecision(NamedTuple):
+    customer_id: str
+    discount_percentage: float
+    discount_tier: int
+    loyalty_tier: str
+
+
+def score_customers(loyalty_tier, tenure, churn, spend_this_year) -> np.ndarray:
+    """
+    Discount percentage of every customer; inputs are equally long array-likes.
+    A missing (NaN) churn falls back to tier and spend only, as the scheme prescribes;
+    an unknown loyalty tier scores like no tier. A percentage on a tier boundary
+    belongs to the lower tier (see discount_tier).
+    """
+    tier_score = np.array([LOYALTY_TIER_SCORES.get(str(tier), 0.0) for tier in loyalty_tier], dtype=np.float64)
+    tenure_score = np.nan_to_num(np.clip(np.asarray(tenure, dtype=np.float64) / FULL_TENURE_YEARS, 0.0, 1.0))
+    spend_score = np.nan_to_num(np.clip(np.asarray(spend_this_year, dtype=np.float64) / FULL_SPEND_THIS_YEAR, 0.0, 1.0))
+    tier_weight, tenure_weight, spend_weight = LOYALTY_WEIGHTS
+    loyalty = tier_weight * tier_score + tenure_weight * tenure_score + spend_weight * spend_score
+    fallback = (tier_weight * tier_score + spend_weight * spend_score) / (tier_weight + spend_weight)
+
+    churn = np.clip(np.asarray(churn, dtype=np.float64), 0.0, 1.0)
+    score = np.where(np.isnan(churn), fallback, (1.0 - CHURN_WEIGHT) * loyalty + CHURN_WEIGHT * np.nan_to_num(churn))
+
+    # The score picks a discount tier and the position inside its range
+    scaled = np.clip(score, 0.0, 1.0) * len(DISCOUNT_TIERS)
+    tier_index = np.minimum(scaled.astype(np.int64), len(DISCOUNT_TIERS) - 1)
+    fraction = scaled - tier_index
+    low, high = DISCOUNT_TIERS[tier_index, 0], DISCOUNT_TIERS[tier_index, 1]
+    # Half-percent steps
+    return np.round((low + fraction * (high - low)) * 2.0) / 2.0
+
+
+def discount_tier(discount_percentage: float) -> int:
+    """1-based tier of a discount percentage."""
+    return int(np.searchsorted(DISCOUNT_TIERS[:, 1], discount_percentage, side="left")) + 1
+
+
+def compute_discount(profile: Dict[str, Any]) -> DiscountDecision:
+    """Discount of one loyalty profile row (CustomerID, LoyaltyTier, Tenure, Churn, TotalAmountSpentThisYear)."""
+    churn = profile.get("Churn")
+    percentage = float(score_customers(
+        [profile.get("LoyaltyTier")],
+        [profile.get("Tenure", 0)],
+        [np.nan if churn is None else churn],
+        [profile.get("TotalAmountSpentThisYear", 0)],
+    )[0])
+    return DiscountDecision(
+        customer_id=str(profile.get("CustomerID", "")),
+        discount_percentage=percentage,
+        discount_tier=discount_tier(percentage),
+        loyalty_tier=str(profile.get("LoyaltyTier", "")),
+    )
+
+
+def discount_explanation(loyalty_tier: str, tenure, discount_percentage: float, tier: int) -> str:
+    return (
+        f"As a {loyalty_tier} member for {tenure} years, "
+        f"you qualify for a {discount_percentage:g}% loyalty discount (Tier {tier})."
+    )
+
+
+def explain_discount(decision: DiscountDecision, profile: Dict[str, Any]) -> str:
+    """Deterministic customer-facing wording, used when the model is not asked to phrase it."""
+    return discount_explanation(
+        decision.loyalty_tier, profile.get("Tenure", 0), decision.discount_percentage, decision.discount_tier
+    )
+
+
+class DiscountLookup:
+    """
+    Read-only primary-key lookups in the precomputed discount table.
+
+    The precompute job swaps a new file in with os.replace, which an open connection
+    would never see, so at most every check_interval seconds the file is stat'ed and
+    the connection reopened when its inode or mtime changed. Lookups stay on the
+    caller's thread (the event loop): a primary-key read is a few microseconds, the
+    check is one stat and the reopen happens once per rebuild, so handing them to a
+    worker thread would cost more than it saves.
+    """
+
+    def __init__(self, path: str, check_interval: float = 5.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+        self._file_id: Optional[Tuple[int, int]] = None
+        self._checked_at = 0.0
+        self.built_at: Optional[float] = None
+        self.reloads = 0
+        self.hits = 0
+        self.misses = 0
+        self._open(self._stat())
+
+    def _stat(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def _open(self, file_id: Optional[Tuple[int, int]]):
+        connection = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+        try:
+            row = connection.execute("SELECT value FROM metadata WHERE key = 'built_at'").fetchone()
+            built_at = float(row[0]) if row else None
+        except sqlite3.OperationalError:
+            # Tables written before the job recorded its build time
+            built_at = None
+        if built_at is None and file_id is not None:
+            built_at = file_id[1] / 1e9
+        previous, self._connection = self._connection, connection
+        self._file_id = file_id
+        self.built_at = built_at
+        self._checked_at = time.monotonic()
+        if previous is not None:
+            previous.close()
+
+    def _refresh(self):
+        """Reopen the table if the precompute job replaced it since the last check."""
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        file_id = self._stat()
+        # A missing file (mid-swap or removed) keeps serving the table already open
+        if file_id is None or file_id == self._file_id:
+            return
+        try:
+            self._open(file_id)
+        except sqlite3.Error as e:
+            logger.warning(f"Could not reopen the discount table {self.path}: {e}")
+            return
+        self.reloads += 1
+        logger.info(f"Reloaded the discount table {self.path} built at {self.built_at}")
+
+    def get(self, customer_id: str) -> Optional[Tuple[DiscountDecision, str]]:
+        """(decision, explanation) of a customer, or None if the table has no row for them."""
+        with self._lock:
+            self._refresh()
+            row = self._connection.execute(
+                "SELECT discount_percentage, discount_tier, loyalty_tier, explanation FROM discounts WHERE CustomerID = ?",
+                (customer_id,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        percentage, tier, loyalty_tier, explanation = row
+        return DiscountDecision(customer_id, percentage, tier, loyalty_tier), explanation
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "path": self.path,
+            "built_at": self.built_at,
+            "age_seconds": time.time() - self.built_at if self.built_at is not None else None,
+            "reloads": self.reloads,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+def open_discount_lookup() -> Optional[DiscountLookup]:
+    """
+    The table at DISCOUNT_TABLE_PATH, or None if the precompute job has not produced one;
+    DISCOUNT_TABLE_CHECK_SECONDS is how often a rebuilt table is looked for.
+    """
+    path = os.getenv("DISCOUNT_TABLE_PATH", DEFAULT_DISCOUNT_TABLE_PATH)
+    if not os.path.isfile(path):
+        logger.info(f"No precomputed discount table at {path}, discounts are calculated live")
+        return None
+    return DiscountLookup(path, check_interval=float(os.getenv("DISCOUNT_TABLE_CHECK_SECONDS", "5")))
@@ -1,4 +1,4 @@
-def call_fallback(llm_client, fallback_prompt: str, gpt_deployment = "gpt-4.1"):
+async def call_fallback(llm_client, fallback_prompt: str, gpt_deployment = "gpt-4.1"):
     """Call the fallback model and return its reply."""
     chat_prompt = [    
         {
@@ -12,7 +12,7 @@ def call_fallback(llm_client, fallback_prompt: str, gpt_deployment = "gpt-4.1"):
             ]   
         }]
     messages = chat_prompt
-    completion = llm_client.chat.completions.create(
+    completion = await llm_client.chat.completions.create(
         model=gpt_deployment,
         messages=messages,
         temperature=0.7,
@@ -23,7 +23,7 @@ def call_fallback(llm_client, fallback_prompt: str, gpt_deployment = "gpt-4.1"):
         stream=False)
     return completion.choices[0].message.content
 
-def cora_fallback(llm_client, fallback_prompt: str, gpt_deployment = "gpt-4.1"):
+async def cora_fallback(llm_client, fallback_prompt: str, gpt_deployment = "gpt-4.1"):
     """Call the fallback model for cora and return its reply."""
     chat_prompt = [    
         {
@@ -37,7 +37,7 @@ def cora_fallback(llm_client, fallback_prompt: str, gpt_deployment = "gpt-4.1"):
             ]   
         }]
     messages = chat_prompt
-    completion = llm_client.chat.completions.create(
+    completion = await llm_client.chat.completions.create(
         model=gpt_deployment,
         messages=messages,
         temperature=0.7,
@@ -46,4 +46,28 @@ def cora_fallback(llm_client, fallback_prompt: str, gpt_deployment = "gpt-4.1"):
         presence_penalty=0,
         stop=None,
         stream=False)
-    return completion.choices[0].message.content 
\ No newline at end of file
+    return completion.choices[0].message.content 
+
+async def _stream_completion(llm_client, prompt: str, gpt_deployment: str):
+    """Stream a system-prompt completion, yielding text deltas as they arrive."""
+    stream = await llm_client.chat.completions.create(
+        model=gpt_deployment,
+        messages=[{"role": "system", "content": [{"type": "text", "text": prompt}]}],
+        temperature=0.7,
+        top_p=0.95,
+        frequency_penalty=0,
+        presence_penalty=0,
+        stop=None,
+        stream=True)
+    async for chunk in stream:
+        # Azure may send chunks without choices (e.g. content filter results)
+        if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+def stream_fallback(llm_client, fallback_prompt: str, gpt_deployment = "gpt-4.1"):
+    """Stream the fallback model reply as text deltas."""
+    return _stream_completion(llm_client, fallback_prompt, gpt_deployment)
+
+def stream_cora_fallback(llm_client, fallback_prompt: str, gpt_deployment = "gpt-4.1"):
+    """Stream the cora fallback model reply as text deltas."""
+    return _stream_completion(llm_client, fallback_prompt, gpt_deployment)
@@ -0,0 +1,96 @@
+import base64
+import hashlib
+import logging
+import os
+from typing import Awaitable, Callable, FrozenSet, Optional
+from urllib.parse import urlparse
+
+import aiohttp
+
+from utils.cache_utils import AsyncTTLCache
+
+logger = logging.getLogger(__name__)
+
+# Process-wide image description cache shared by every session, keyed by image content
+image_description_cache = AsyncTTLCache(
+    max_size=int(os.getenv("IMAGE_CACHE_SIZE", "256")),
+    ttl_seconds=float(os.getenv("IMAGE_CACHE_TTL_SECONDS", "3600")),
+    name="image_description"
+)
+# Remembers the content hash of each image URL so a URL is downloaded at most once
+_url_key_cache = AsyncTTLCache(
+    max_size=int(os.getenv("IMAGE_CACHE_SIZE", "256")) * 4,
+    ttl_seconds=float(os.getenv("IMAGE_CACHE_TTL_SECONDS", "3600")),
+    name="image_url_key"
+)
+
+MAX_IMAGE_BYTES = 20 * 1024 * 1024
+
+def _content_hash_hosts() -> FrozenSet[str]:
+    """Hosts whose images are downloaded to hash their content: our own blob storage only."""
+    hosts = {host.strip().lower() for host in os.getenv("IMAGE_HASH_ALLOWED_HOSTS", "").split(",") if host.strip()}
+    storage_account_name = os.getenv("storage_account_name", "")
+    if storage_account_name:
+        hosts.add(f"{storage_account_name}.blob.core.windows.net".lower())
+    return frozenset(hosts)
+
+# Image URLs come from the user: fetching arbitrary ones would let them make the server
+# request internal endpoints, so any other host is keyed by its URL without a download
+CONTENT_HASH_HOSTS = _content_hash_hosts()
+CONTENT_HASH_TIMEOUT_SECONDS = float(os.getenv("IMAGE_HASH_TIMEOUT_SECONDS", "2"))
+
+_http_session: Optional[aiohttp.ClientSession] = None
+
+def _get_http_session() -> aiohttp.ClientSession:
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        _http_session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=CONTENT_HASH_TIMEOUT_SECONDS))
+    return _http_session
+
+def _url_fallback_key(image_url: str) -> str:
+    return "url:" + hashlib.sha256(image_url.encode("utf-8")).hexdigest()
+
+def is_content_hash_host(image_url: str) -> bool:
+    """Whether image_url is an https URL on one of the allowed storage hosts (and may be downloaded)."""
+    parsed = urlparse(image_url)
+    return parsed.scheme == "https" and (parsed.hostname or "").lower() in CONTENT_HASH_HOSTS and parsed.port in (None, 443)
+
+async def _hash_remote_image(image_url: str) -> str:
+    try:
+        # No redirects: they could lead off the allowed hosts
+        async with _get_http_session().get(image_url, allow_redirects=False) as response:
+            response.raise_for_status()
+            content = await response.content.read(MAX_IMAGE_BYTES + 1)
+        if not content or len(content) > MAX_IMAGE_BYTES:
+            return _url_fallback_key(image_url)
+        return "sha256:" + hashlib.sha256(content).hexdigest()
+    except Exception as e:
+        logger.warning("Could not download image for hashing", extra={"url": image_url[:50], "error": str(e)})
+        return _url_fallback_key(image_url)
+
+async def image_content_key(image_url: str) -> str:
+    """
+    Return a cache key derived from the image bytes, so a data URI and the blob URL
+    of the same image share one entry. Falls back to hashing the URL itself, which
+    is also the key of any URL outside the configured storage hosts.
+    """
+    if image_url.startswith("data:"):
+        try:
+            content = base64.b64decode(image_url.split(",", 1)[1])
+            return "sha256:" + hashlib.sha256(content).hexdigest()
+        except Exception:
+            return _url_fallback_key(image_url)
+    if is_content_hash_host(image_url):
+        return await _url_key_cache.get_or_load(image_url, lambda: _hash_remote_image(image_url))
+    return _url_fallback_key(image_url)
+
+async def get_image_description_cached(image_url: str, describe: Callable[[str], Awaitable[str]]) -> str:
+    """Describe an image once per content hash; concurrent requests share one describe call."""
+    key = await image_content_key(image_url)
+    return await image_description_cache.get_or_load(key, lambda: describe(image_url))
+
+async def close_image_service():
+    global _http_session
+    if _http_session is not None:
+        await _http_session.close()
+        _http_session = None
@@ -0,0 +1,216 @@
+"""
+Local fast-path intent classifier in front of the Phi-4 router.
+
+A hashed n-gram linear (softmax) model, trained offline by
+pipelines/train_intent_classifier.py, labels the latest user turn in-process.
+Confident predictions skip the remote router; ambiguous turns still go to it.
+"""
+import logging
+import os
+import re
+import time
+import zlib
+from collections import defaultdict
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from utils.cache_utils import AsyncTTLCache
+
+logger = logging.getLogger(__name__)
+
+# Labels in the order select_agent() checks them for in a router reply
+ROUTER_LABELS = ["cora", "interior_designer_create_image", "interior_designer", "inventory_agent", "customer_loyalty"]
+
+_TOKEN = re.compile(r"[a-z0-9']+")
+
+def normalize_text(text: str) -> str:
+    """Lowercase and collapse text to its word tokens."""
+    return " ".join(_TOKEN.findall(text.lower()))
+
+def label_from_router_reply(router_reply: str) -> Optional[str]:
+    """Map a free-text router reply to a label using the same precedence as select_agent."""
+    reply = router_reply.lower()
+    for label in ROUTER_LABELS:
+        if label in reply:
+            return label
+    return None
+
+
+class HashedNgramClassifier:
+    """Multinomial logistic regression over hashed word, bigram and character n-grams."""
+
+    def __init__(self, labels: List[str], n_buckets: int = 2 ** 16):
+        self.labels = list(labels)
+        self.n_buckets = n_buckets
+        self.weights = np.zeros((len(self.labels), n_buckets), dtype=np.float32)
+        self.bias = np.zeros(len(self.labels), dtype=np.float32)
+
+    def _hash(self, feature: str) -> int:
+        # crc32 is stable across processes, unlike hash()
+        return zlib.crc32(feature.encode("utf-8")) % self.n_buckets
+
+    def features(self, message: str, context: str = "") -> Tuple[np.ndarray, np.ndarray]:
+        """Return (bucket indices, L2-normalized values) for a message and its preceding bot turn."""
+        counts: Dict[int, float] = defaultdict(float)
+        tokens = normalize_text(message).split()
+        for token in tokens:
+            counts[self._hash("w:" + token)] += 1.0
+        for first, second in zip(tokens, tokens[1:]):
+            counts[self._hash("b:" + first + "_" + second)] += 1.0
+        padded = " " + " ".join(tokens) + " "
+        for i in range(len(padded) - 2):
+            counts[self._hash("c:" + padded[i:i + 3])] += 0.5
+        for token in normalize_text(context).split()[-20:]:
+            counts[self._hash("p:" + token)] += 0.5
+        if not counts:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        indices = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+        values = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+        return indices, values / np.linalg.norm(values)
+
+    def predict_proba(self, message: str, context: str = "") -> np.ndarray:
+        indices, values = self.features(message, context)
+        logits = self.weights[:, indices] @ values + self.bias
+        logits = logits - logits.max()
+        exp = np.exp(logits)
+        return exp / exp.sum()
+
+    def predict(self, message: str, context: str = "") -> Tuple[str, float]:
+        """Return the most likely label and its probability."""
+        probabilities = self.predict_proba(message, context)
+        best = int(np.argmax(probabilities))
+        return self.labels[best], float(probabilities[best])
+
+    def fit(self, examples: List[Tuple[str, str, str]], epochs: int = 30, learning_rate: float = 0.5,
+            l2: float = 1e-4, seed: int = 0):
+        """Train with SGD on (message, context, label) examples."""
+        label_index = {label: i for i, label in enumerate(self.labels)}
+        featurized = [(self.features(message, context), label_index[label]) for message, context, label in examples]
+        rng = np.random.default_rng(seed)
+        for _ in range(epochs):
+            for i in rng.permutation(len(featurized)):
+                (indices, values), target = featurized[i]
+                logits = self.weights[:, indices] @ values + self.bias
+                logits = logits - logits.max()
+                gradient = np.exp(logits)
+                gradient /= gradient.sum()
+                gradient[target] -= 1.0
+                self.weights[:, indices] -= learning_rate * (
+                    np.outer(gradient, values) + l2 * self.weights[:, indices]
+                )
+                self.bias -= learning_rate * gradient
+        return self
+
+    def save(self, path: str):
+        np.savez_compressed(path, labels=np.array(self.labels), weights=self.weights, bias=self.bias)
+
+    @classmethod
+    def load(cls, path: str) -> "HashedNgramClassifier":
+        with np.load(path, allow_pickle=False) as data:
+            classifier = cls([str(label) for label in data["labels"]], n_buckets=data["weights"].shape[1])
+            classifier.weights = data["weights"].astype(np.float32)
+            classifier.bias = data["bias"].astype(np.float32)
+        return classifier
+
+
+class IntentRouter:
+    """
+    Routes a turn with the local classifier when it is confident, otherwise via the remote router.
+    Modes: "off" (always remote), "shadow" (always remote, local predictions only scored for
+    agreement) and "active" (confident local predictions skip the remote call).
+    Decisions are cached by the normalized, redacted history.
+    """
+
+    def __init__(self, classifier: Optional[HashedNgramClassifier], mode: str = "shadow",
+                 threshold: float = 0.9, cache_size: int = 2048, cache_ttl_seconds: float = 3600.0):
+        self.classifier = classifier
+        self.mode = mode if classifier is not None else "off"
+        self.threshold = threshold
+        self.decision_cache = AsyncTTLCache(max_size=cache_size, ttl_seconds=cache_ttl_seconds, name="router_decision")
+        self.local_decisions = 0
+        self.remote_decisions = 0
+        self.shadow_compared = 0
+        self.shadow_agreed = 0
+        self.shadow_confident_compared = 0
+        self.shadow_confident_agreed = 0
+        self.disagreements: Dict[str, int] = defaultdict(int)
+        self._local_latency_total = 0.0
+        self._local_predictions = 0
+
+    def _predict(self, chat_history: Deque[Tuple[str, str]]) -> Tuple[Optional[str], float]:
+        if self.classifier is None or not chat_history:
+            return None, 0.0
+        entries = list(chat_history)
+        message = entries[-1][1] if entries[-1][0] == "user" else ""
+        context = next((msg for role, msg in reversed(entries[:-1]) if role == "bot"), "")
+        start_time = time.perf_counter()
+        label, confidence = self.classifier.predict(message, context)
+        self._local_latency_total += time.perf_counter() - start_time
+        self._local_predictions += 1
+        return label, confidence
+
+    async def route(self, chat_history: Deque[Tuple[str, str]], formatted_history: str,
+                    call_remote: Callable[[], Awaitable[str]]) -> str:
+        """Return a router reply (a label select_agent understands) for the current turn."""
+        cache_key = normalize_text(formatted_history)
+        cached = self.decision_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        label, confidence = (None, 0.0) if self.mode == "off" else self._predict(chat_history)
+        if self.mode == "active" and label is not None and confidence >= self.threshold:
+            self.local_decisions += 1
+            self.decision_cache.set(cache_key, label)
+            return label
+
+        router_reply = await call_remote()
+        self.remote_decisions += 1
+        if router_reply.startswith("__CONTENT_FILTER_ERROR__"):
+            return router_reply
+        if self.mode == "shadow" and label is not None:
+            remote_label = label_from_router_reply(router_reply)
+            agreed = remote_label == label
+            self.shadow_compared += 1
+            self.shadow_agreed += agreed
+            if confidence >= self.threshold:
+                self.shadow_confident_compared += 1
+                self.shadow_confident_agreed += agreed
+            if not agreed:
+                self.disagreements[f"{label}->{remote_label}"] += 1
+        self.decision_cache.set(cache_key, router_reply)
+        return router_reply
+
+    def stats(self) -> Dict:
+        return {
+            "mode": self.mode,
+            "threshold": self.threshold,
+            "local_decisions": self.local_decisions,
+            "remote_decisions": self.remote_decisions,
+            "local_avg_latency_us": (self._local_latency_total / self._local_predictions * 1e6) if self._local_predictions else 0.0,
+            "shadow_agreement": (self.shadow_agreed / self.shadow_compared) if self.shadow_compared else None,
+            # Agreement on the turns the fast path would have answered at the current threshold
+            "shadow_confident_agreement": (self.shadow_confident_agreed / self.shadow_confident_compared) if self.shadow_confident_compared else None,
+            "shadow_confident_coverage": (self.shadow_confident_compared / self.shadow_compared) if self.shadow_compared else None,
+            "disagreements": dict(self.disagreements),
+            "decision_cache": self.decision_cache.stats(),
+        }
+
+
+def create_intent_router() -> IntentRouter:
+    """Create the router fast path from INTENT_CLASSIFIER_* settings; disabled without a trained model."""
+    default_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "intent_classifier.npz")
+    model_path = os.getenv("INTENT_CLASSIFIER_PATH", default_path)
+    classifier = None
+    if os.path.isfile(model_path):
+        try:
+            classifier = HashedNgramClassifier.load(model_path)
+        except Exception as e:
+            logger.warning(f"Could not load intent classifier from {model_path}: {e}")
+    else:
+        logger.info("No intent classifier model found - all turns use the remote router")
+    return IntentRouter(
+        classifier,
+        mode=os.getenv("INTENT_CLASSIFIER_MODE", "shadow").lower(),
+        threshold=float(os.getenv("INTENT_CLASSIFIER_THRESHOLD", "0.9")),
+    )
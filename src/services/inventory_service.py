@@ -0,0 +1,419 @@
+"""
+Indexed inventory store behind a pluggable backend.
+
+The store keeps the inventory rows it has seen indexed by product ID and by
+normalized product name, and asks its backend for all the products of a request
+in one batched query, so checking a whole cart costs one round trip. Backends:
+the simulated catalog (default), a SQLite stand-in and Kusto (Microsoft Fabric).
+Tool calls read from an immutable snapshot of the whole inventory that is refreshed
+in the background, and only go to the backend when the snapshot is too stale.
+"""
+import logging
+import os
+import re
+import sqlite3
+import statistics
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Simulated inventory, as Microsoft Fabric would return it
+SIMULATED_INVENTORY: Dict[str, Dict[str, Any]] = {
+    'PROD0001': {'ProductName': 'Pale Meadow', 'Quantity': 312, 'Price': 29.99},
+    'PROD0002': {'ProductName': 'Tranquil Lavender', 'Quantity': 145, 'Price': 31.99},
+    'PROD0003': {'ProductName': 'Whispering Blue', 'Quantity': 487, 'Price': 47.99},
+    'PROD0004': {'ProductName': 'Whispering Blush', 'Quantity': 56, 'Price': 50.82},
+    'PROD0005': {'ProductName': 'Ocean Mist', 'Quantity': 221, 'Price': 84.83},
+    'PROD0006': {'ProductName': 'Sunset Coral', 'Quantity': 399, 'Price': 48.57},
+    'PROD0007': {'ProductName': 'Forest Whisper', 'Quantity': 78, 'Price': 43.09},
+    'PROD0008': {'ProductName': 'Morning Dew', 'Quantity': 305, 'Price': 81.94},
+    'PROD0009': {'ProductName': 'Dusty Rose', 'Quantity': 412, 'Price': 75.62},
+    'PROD0010': {'ProductName': 'Sage Harmony', 'Quantity': 67, 'Price': 33.26},
+    'PROD0011': {'ProductName': 'Vanilla Dream', 'Quantity': 254, 'Price': 54.66},
+    'PROD0012': {'ProductName': 'Charcoal Storm', 'Quantity': 188, 'Price': 43.45},
+    'PROD0013': {'ProductName': 'Golden Wheat', 'Quantity': 499, 'Price': 109.73},
+    'PROD0014': {'ProductName': 'Soft Pebble', 'Quantity': 321, 'Price': 110.92},
+    'PROD0015': {'ProductName': 'Misty Gray', 'Quantity': 92, 'Price': 96.04},
+    'PROD0016': {'ProductName': 'Rustic Clay', 'Quantity': 276, 'Price': 83.37},
+    'PROD0017': {'ProductName': 'Ivory Pearl', 'Quantity': 134, 'Price': 91.99},
+    'PROD0018': {'ProductName': 'Deep Forest', 'Quantity': 401, 'Price': 119.93},
+    'PROD0019': {'ProductName': 'Autumn Spice', 'Quantity': 58, 'Price': 30.34},
+    'PROD0020': {'ProductName': 'Coastal Whisper', 'Quantity': 215, 'Price': 39.99},
+    'PROD0021': {'ProductName': 'Effervescent Jade', 'Quantity': 362, 'Price': 42.99},
+    'PROD0022': {'ProductName': 'Frosted Blue', 'Quantity': 77, 'Price': 36.99},
+    'PROD0023': {'ProductName': 'Frosted Lemon', 'Quantity': 489, 'Price': 28.99},
+    'PROD0024': {'ProductName': 'Honeydew Sunrise', 'Quantity': 123, 'Price': 45.99},
+    'PROD0025': {'ProductName': 'Lavender Whisper', 'Quantity': 256, 'Price': 33.99},
+    'PROD0026': {'ProductName': 'Lilac Mist', 'Quantity': 411, 'Price': 55.99},
+    'PROD0027': {'ProductName': 'Soft Creamsicle', 'Quantity': 98, 'Price': 41.99},
+    'PROD0028': {'ProductName': 'Whispering Blush', 'Quantity': 312, 'Price': 26.99},
+    'PROD0029': {'ProductName': 'Lavender Whisper', 'Quantity': 75, 'Price': 33.99},
+    'PROD0030': {'ProductName': 'Lilac Mist', 'Quantity': 201, 'Price': 55.99},
+    'PROD0031': {'ProductName': 'Soft Creamsicle', 'Quantity': 487, 'Price': 41.99},
+    'PROD0032': {'ProductName': 'Whispering Blush', 'Quantity': 154, 'Price': 26.99},
+    'PROD0033': {'ProductName': 'Cordless Airless Pro', 'Quantity': 299, 'Price': 120.99},
+    'PROD0034': {'ProductName': 'Cordless Compact Painter', 'Quantity': 412, 'Price': 149.99},
+    'PROD0035': {'ProductName': 'Electric Sprayer 350', 'Quantity': 88, 'Price': 135.99},
+    'PROD0036': {'ProductName': 'HVLP SuperFinish', 'Quantity': 367, 'Price': 125.99},
+    'PROD0037': {'ProductName': 'Handheld Airless 360', 'Quantity': 210, 'Price': 130.99},
+    'PROD0038': {'ProductName': 'Handheld HVLP Pro', 'Quantity': 56, 'Price': 139.99},
+    'PROD0039': {'ProductName': 'Paint Safe Drop Cloth', 'Quantity': 478, 'Price': 55.99},
+    'PROD0040': {'ProductName': 'Paint Guard Reusable Drop Cloth', 'Quantity': 123, 'Price': 60.99},
+    'PROD0041': {'ProductName': 'Fine Finish Paint Brush', 'Quantity': 312, 'Price': 2.99},
+    'PROD0042': {'ProductName': 'All-Purpose Wall Paint Brush', 'Quantity': 145, 'Price': 3.99},
+    'PROD0043': {'ProductName': 'Large Area Applicator Brush', 'Quantity': 487, 'Price': 4.99},
+    'PROD0044': {'ProductName': 'Classic Flat Sash Brush', 'Quantity': 56, 'Price': 3.99},
+    'PROD0045': {'ProductName': 'Standard Paint Tray', 'Quantity': 221, 'Price': 10.99},
+    'PROD0046': {'ProductName': 'Deep Well Paint Tray', 'Quantity': 399, 'Price': 7.99},
+    'PROD0047': {'ProductName': 'Compact Paint Tray', 'Quantity': 78, 'Price': 8.99},
+    'PROD0048': {'ProductName': 'Heavy-Duty Paint Tray with Grid', 'Quantity': 305, 'Price': 135.99},
+    'PROD0049': {'ProductName': "Blue Painter's Tape", 'Quantity': 412, 'Price': 3.99},
+    'PROD0050': {'ProductName': "Green Painter's Tape", 'Quantity': 67, 'Price': 2.99},
+    'PROD0051': {'ProductName': 'Standard Paint Roller', 'Quantity': 254, 'Price': 15.99},
+    'PROD0052': {'ProductName': 'Ergonomic Grip Paint Roller', 'Quantity': 188, 'Price': 10.99},
+    'PROD0053': {'ProductName': 'Classic Wood Handle Paint Roller', 'Quantity': 499, 'Price': 9.99},
+    'PROD0054': {'ProductName': 'Wooden Handle Paint Roller', 'Quantity': 321, 'Price': 8.99},
+}
+
+_PRODUCT_ID_RE = re.compile(r"^[A-Za-z0-9_-]+$")
+
+
+def normalize_name(name: str) -> str:
+    """Name key: case, punctuation and spacing do not matter ("Blue Painter's Tape" == "blue painters tape")."""
+    return " ".join(re.sub(r"[^a-z0-9 ]+", "", str(name).lower()).split())
+
+
+class InventoryBackend:
+    """Source of inventory rows ({'ProductName', 'Quantity', 'Price'}) keyed by product ID."""
+
+    def fetch(self, product_ids: Sequence[str]) -> Dict[str, Dict[str, Any]]:
+        """Rows of the given IDs in one round trip; unknown IDs are absent."""
+        raise NotImplementedError
+
+    def fetch_all(self) -> Dict[str, Dict[str, Any]]:
+        raise NotImplementedError
+
+
+class SimulatedInventoryBackend(InventoryBackend):
+    def __init__(self, rows: Dict[str, Dict[str, Any]] = SIMULATED_INVENTORY):
+        self.rows = rows
+
+    def fetch(self, product_ids: Sequence[str]) -> Dict[str, Dict[str, Any]]:
+        return {product_id: self.rows[product_id] for product_id in product_ids if product_id in self.rows}
+
+    def fetch_all(self) -> Dict[str, Dict[str, Any]]:
+        return dict(self.rows)
+
+
+class SQLiteInventoryBackend(InventoryBackend):
+    """Local stand-in for the Fabric table; an empty database is seeded with the simulated rows."""
+
+    def __init__(self, path: str = ":memory:", seed: Dict[str, Dict[str, Any]] = SIMULATED_INVENTORY):
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS inventory "
+                "(ProductID TEXT PRIMARY KEY, ProductName TEXT, Quantity INTEGER, Price REAL)"
+            )
+            if self._connection.execute("SELECT COUNT(*) FROM inventory").fetchone()[0] == 0:
+                self._connection.executemany(
+                    "INSERT INTO inventory VALUES (?, ?, ?, ?)",
+                    [(product_id, row["ProductName"], row["Quantity"], row["Price"]) for product_id, row in seed.items()]
+                )
+
+    def _query(self, sql: str, params: Sequence[Any] = ()) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            rows = self._connection.execute(sql, params).fetchall()
+        return {
+            product_id: {"ProductName": name, "Quantity": quantity, "Price": price}
+            for product_id, name, quantity, price in rows
+        }
+
+    def fetch(self, product_ids: Sequence[str]) -> Dict[str, Dict[str, Any]]:
+        if not product_ids:
+            return {}
+        placeholders = ", ".join("?" * len(product_ids))
+        return self._query(
+            f"SELECT ProductID, ProductName, Quantity, Price FROM inventory WHERE ProductID IN ({placeholders})",
+            list(product_ids)
+        )
+
+    def fetch_all(self) -> Dict[str, Dict[str, Any]]:
+        return self._query("SELECT ProductID, ProductName, Quantity, Price FROM inventory")
+
+
+class KustoInventoryBackend(InventoryBackend):
+    """Inventory table in Microsoft Fabric / Azure Data Explorer, queried with KQL."""
+
+    def __init__(self, cluster: str, database: str, table: str = "Inventory"):
+        from azure.identity import DefaultAzureCredential
+        from azure.kusto.data import KustoClient, KustoConnectionStringBuilder
+
+        self.database = database
+        self.table = table
+        self._client = KustoClient(
+            KustoConnectionStringBuilder.with_azure_token_credential(cluster, DefaultAzureCredential())
+        )
+
+    def _query(self, query: str) -> Dict[str, Dict[str, Any]]:
+        response = self._client.execute(self.database, query)
+        return {
+            row["ProductID"]: {"ProductName": row["ProductName"], "Quantity": row["Quantity"], "Price": row["Price"]}
+            for row in response.primary_results[0]
+        }
+
+    def fetch(self, product_ids: Sequence[str]) -> Dict[str, Dict[str, Any]]:
+        # IDs are inlined into the KQL, so anything that is not a plain ID is dropped
+        ids = [product_id for product_id in product_ids if _PRODUCT_ID_RE.match(product_id)]
+        if not ids:
+            return {}
+        id_list = ", ".join(f"'{product_id}'" for product_id in ids)
+        return self._query(
+            f"{self.table} | where ProductID in ({id_list}) | project ProductID, ProductName, Quantity, Price"
+        )
+
+    def fetch_all(self) -> Dict[str, Dict[str, Any]]:
+        return self._query(f"{self.table} | project ProductID, ProductName, Quantity, Price")
+
+
+class InventoryStore:
+    """
+    Inventory rows indexed by ID and normalized name; one batched backend query per check.
+    Product IDs are the key: a name shared by several products (e.g. the same shade in
+    several sizes) is ambiguous and only resolves through the product's ID.
+    """
+
+    def __init__(self, backend: InventoryBackend):
+        self.backend = backend
+        self._lock = threading.Lock()
+        self.by_id: Dict[str, Dict[str, Any]] = {}
+        self.by_name: Dict[str, List[str]] = {}
+        self._names_loaded = False
+        self.checks = 0
+        self.backend_queries = 0
+        self.unknown = 0
+        self.ambiguous = 0
+
+    def _index(self, rows: Dict[str, Dict[str, Any]]):
+        with self._lock:
+            for product_id, row in rows.items():
+                self.by_id[product_id] = row
+                name = normalize_name(row["ProductName"])
+                ids = self.by_name.setdefault(name, [])
+                if product_id not in ids:
+                    ids.append(product_id)
+                    if len(ids) == 2:
+                        logger.warning(f"Inventory name {row['ProductName']!r} is shared by {ids}; it only resolves by ID")
+
+    def _resolve(self, name: str, value: str) -> Optional[str]:
+        """Product ID of one requested item: the value itself, or the ID of the item's unambiguous name."""
+        if value in self.by_id:
+            return value
+        ambiguous = False
+        for candidate in (value, name):
+            ids = self.by_name.get(normalize_name(candidate))
+            if ids and len(ids) == 1:
+                return ids[0]
+            ambiguous = ambiguous or bool(ids)
+        if ambiguous:
+            self.ambiguous += 1
+            return None
+        # Possibly an ID the store has not seen yet
+        return value if value and _PRODUCT_ID_RE.match(value) else None
+
+    def _load_names(self):
+        if not self._names_loaded:
+            self._index(self.backend.fetch_all())
+            self.backend_queries += 1
+            self._names_loaded = True
+
+    def check(self, product_dict: Dict[str, str]) -> List[Optional[Dict[str, Any]]]:
+        """Inventory rows of the requested products in request order; None for unknown products."""
+        self.checks += 1
+        items = [(str(name), str(value or "")) for name, value in product_dict.items()]
+        if any(value not in self.by_id and normalize_name(value) not in self.by_name for _, value in items):
+            # A name (not an ID) was requested: the name index needs the whole catalog once
+            self._load_names()
+        product_ids = [self._resolve(name, value) for name, value in items]
+        requested = list(dict.fromkeys(product_id for product_id in product_ids if product_id))
+        rows = self.backend.fetch(requested) if requested else {}
+        self.backend_queries += 1
+        self._index(rows)
+        results = [rows.get(product_id) if product_id else None for product_id in product_ids]
+        self.unknown += sum(result is None for result in results)
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": type(self.backend).__name__,
+            "indexed_products": len(self.by_id),
+            "checks": self.checks,
+            "backend_queries": self.backend_queries,
+            "unknown": self.unknown,
+            "ambiguous": self.ambiguous,
+        }
+
+
+@dataclass(frozen=True)
+class InventorySnapshot:
+    """Immutable copy of the whole inventory; replaced as a unit, never modified."""
+    version: int
+    loaded_at: float
+    by_id: Mapping[str, Dict[str, Any]]
+    by_name: Mapping[str, Tuple[str, ...]]
+
+    @classmethod
+    def build(cls, version: int, rows: Dict[str, Dict[str, Any]]) -> "InventorySnapshot":
+        by_name: Dict[str, Tuple[str, ...]] = {}
+        for product_id, row in rows.items():
+            key = normalize_name(row["ProductName"])
+            by_name[key] = by_name.get(key, ()) + (product_id,)
+        return cls(version, time.monotonic(), MappingProxyType(dict(rows)), MappingProxyType(by_name))
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self.loaded_at
+
+    def duplicate_names(self) -> Dict[str, Tuple[str, ...]]:
+        """Names shared by several products, which only resolve by ID."""
+        return {name: ids for name, ids in self.by_name.items() if len(ids) > 1}
+
+    def lookup(self, product_dict: Dict[str, str]) -> List[Optional[Dict[str, Any]]]:
+        results = []
+        for name, value in product_dict.items():
+            row = self.by_id.get(str(value or ""))
+            if row is None:
+                for candidate in (value, name):
+                    ids = self.by_name.get(normalize_name(candidate or ""))
+                    if ids and len(ids) == 1:
+                        row = self.by_id[ids[0]]
+                        break
+            results.append(row)
+        return results
+
+
+class InventorySnapshotCache:
+    """
+    Serves inventory checks from an in-memory snapshot that a background thread reloads
+    every refresh interval. Readers only dereference the current snapshot, which is swapped
+    atomically, so they never take a lock. A snapshot older than the staleness bound (e.g.
+    the refresh keeps failing) is bypassed for the live store.
+
+    Refresh is timer-only: stock changes in the backend's own systems and this app never
+    writes it, so there is no write path to invalidate from. How far a snapshot may lag
+    is set by INVENTORY_REFRESH_SECONDS.
+    """
+
+    def __init__(self, store: InventoryStore, refresh_interval: float = 30.0, max_staleness: float = 120.0):
+        self.store = store
+        self.refresh_interval = refresh_interval
+        self.max_staleness = max_staleness
+        self._snapshot: Optional[InventorySnapshot] = None
+        self._refresh_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self.snapshot_reads = 0
+        self.live_reads = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.refresh_durations = deque(maxlen=100)
+
+    def refresh(self) -> InventorySnapshot:
+        """Load the whole inventory into a new snapshot and swap it in."""
+        with self._refresh_lock:
+            start_time = time.perf_counter()
+            rows = self.store.backend.fetch_all()
+            previous = self._snapshot
+            version = previous.version + 1 if previous is not None else 1
+            snapshot = InventorySnapshot.build(version, rows)
+            duplicates = snapshot.duplicate_names()
+            if previous is None or duplicates.keys() != previous.duplicate_names().keys():
+                for name, ids in duplicates.items():
+                    logger.warning(f"Inventory name {name!r} is shared by {list(ids)}; it only resolves by ID")
+            self._snapshot = snapshot
+            self.refresh_durations.append(time.perf_counter() - start_time)
+            self.refreshes += 1
+            return self._snapshot
+
+    def _refresh_loop(self):
+        while not self._stopped.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                self.refresh_errors += 1
+                logger.warning(f"Inventory snapshot refresh failed: {e}")
+
+    def start(self):
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._refresh_loop, name="inventory-refresh", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stopped.set()
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def check(self, product_dict: Dict[str, str]) -> List[Optional[Dict[str, Any]]]:
+        """Inventory rows of the requested products in request order; None for unknown products."""
+        snapshot = self._snapshot
+        if snapshot is None:
+            try:
+                snapshot = self.refresh()
+            except Exception as e:
+                logger.warning(f"Initial inventory snapshot failed: {e}")
+        if snapshot is None or snapshot.age > self.max_staleness:
+            self.live_reads += 1
+            return self.store.check(product_dict)
+        self.snapshot_reads += 1
+        return snapshot.lookup(product_dict)
+
+    def stats(self) -> Dict[str, Any]:
+        snapshot = self._snapshot
+        durations = list(self.refresh_durations)
+        return {
+            "version": snapshot.version if snapshot is not None else None,
+            "age_seconds": snapshot.age if snapshot is not None else None,
+            "products": len(snapshot.by_id) if snapshot is not None else 0,
+            "duplicate_names": len(snapshot.duplicate_names()) if snapshot is not None else 0,
+            "refresh_interval_seconds": self.refresh_interval,
+            "max_staleness_seconds": self.max_staleness,
+            "snapshot_reads": self.snapshot_reads,
+            "live_reads": self.live_reads,
+            "refreshes": self.refreshes,
+            "refresh_errors": self.refresh_errors,
+            "refresh_ms": {
+                "avg": statistics.mean(durations) * 1000 if durations else 0.0,
+                "max": max(durations) * 1000 if durations else 0.0,
+            },
+            "store": self.store.stats(),
+        }
+
+def create_inventory_backend() -> InventoryBackend:
+    """INVENTORY_BACKEND selects simulated (default), sqlite (INVENTORY_SQLITE_PATH) or kusto (KUSTO_CLUSTER, KUSTO_DATABASE, KUSTO_INVENTORY_TABLE)."""
+    backend = os.getenv("INVENTORY_BACKEND", "simulated").lower()
+    if backend == "sqlite":
+        return SQLiteInventoryBackend(os.getenv("INVENTORY_SQLITE_PATH", ":memory:"))
+    if backend == "kusto":
+        return KustoInventoryBackend(
+            os.environ["KUSTO_CLUSTER"],
+            os.environ["KUSTO_DATABASE"],
+            os.getenv("KUSTO_INVENTORY_TABLE", "Inventory")
+        )
+    return SimulatedInventoryBackend()
+
+
+# Process-wide store and the snapshot layer the inventory_check tool reads from
+inventory_store = InventoryStore(create_inventory_backend())
+inventory_snapshots = InventorySnapshotCache(
+    inventory_store,
+    refresh_interval=float(os.getenv("INVENTORY_REFRESH_SECONDS", "30")),
+    max_staleness=float(os.getenv("INVENTORY_MAX_STALENESS_SECONDS", "120"))
+)
@@ -0,0 +1,40 @@
+from azure.ai.inference.aio import ChatCompletionsClient
+from azure.core.credentials import AzureKeyCredential
+from openai import AsyncAzureOpenAI
+from typing import Dict, Tuple
+
+# Async clients are shared per endpoint so every call site reuses the same
+# connection pool instead of opening its own (or hopping through a thread pool).
+_router_clients: Dict[Tuple[str, str], ChatCompletionsClient] = {}
+_llm_clients: Dict[Tuple[str, str], AsyncAzureOpenAI] = {}
+
+def get_router_client(endpoint: str, api_key: str, api_version: str) -> ChatCompletionsClient:
+    """Get the shared async Azure AI Inference client for the router model."""
+    cache_key = (endpoint, api_version)
+    if cache_key not in _router_clients:
+        _router_clients[cache_key] = ChatCompletionsClient(
+            endpoint=endpoint,
+            credential=AzureKeyCredential(api_key),
+            api_version=api_version
+        )
+    return _router_clients[cache_key]
+
+def get_llm_client(endpoint: str, api_key: str, api_version: str) -> AsyncAzureOpenAI:
+    """Get the shared async Azure OpenAI client for the GPT deployments."""
+    cache_key = (endpoint, api_version)
+    if cache_key not in _llm_clients:
+        _llm_clients[cache_key] = AsyncAzureOpenAI(
+            azure_endpoint=endpoint,
+            api_key=api_key,
+            api_version=api_version,
+        )
+    return _llm_clients[cache_key]
+
+async def close_llm_clients():
+    """Close every shared client and release its connection pool."""
+    for client in list(_router_clients.values()):
+        await client.close()
+    for client in list(_llm_clients.values()):
+        await client.close()
+    _router_clients.clear()
+    _llm_clients.clear()
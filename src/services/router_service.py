@@ -3,12 +3,12 @@ from azure.ai.inference.models import SystemMessage, UserMessage
 
 tracer = trace.get_tracer(__name__)
 
-def call_router(router_client, router_prompt, formatted_history, phi_4_deployment):
+async def call_router(router_client, router_prompt, formatted_history, phi_4_deployment):
     """Call the router model and return its reply. Handles content filter errors."""
     with tracer.start_as_current_span("custom_function") as span:
         span.set_attribute("custom_attribute", "value")    
         try:
-            router_response = router_client.complete(
+            router_response = await router_client.complete(
                 messages=[
                     SystemMessage(content=router_prompt),
                     UserMessage(content=formatted_history),
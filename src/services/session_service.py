@@ -0,0 +1,308 @@
+"""
+Per-session state for the /ws chat endpoint and the pluggable stores that hold it.
+Keeping the state out of the websocket handler lets any worker resume a session.
+"""
+import asyncio
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Optional
+from urllib.parse import urlparse
+from uuid import uuid4
+
+import orjson
+
+RAW_IO_HISTORY_MAXLEN = 100
+CHAT_HISTORY_MAXLEN = 5
+DEFAULT_SQLITE_PATH = os.path.join(tempfile.gettempdir(), "zava_sessions.db")
+SESSION_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
+
+
+def new_session_id() -> str:
+    return uuid4().hex
+
+
+def is_session_id(value: Optional[str]) -> bool:
+    """Whether value has the shape of an id from new_session_id (it may still be unknown)."""
+    return bool(value) and SESSION_ID_PATTERN.fullmatch(value) is not None
+
+
+class SessionState:
+    """Compact, serializable state of one chat session."""
+
+    __slots__ = (
+        "session_id",
+        "thread_id",
+        "customer_loyalty_thread_id",
+        "chat_history",
+        "history_version",
+        "persistent_cart",
+        "persistent_image_url",
+        "bad_prompts",
+        "raw_io_history",
+        "session_discount_percentage",
+        "session_loyalty_response",
+        "loyalty_response_sent",
+        "customer_loyalty_executed",
+    )
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.thread_id: Optional[str] = None
+        self.customer_loyalty_thread_id: Optional[str] = None
+        # Cleaned (role, message) history; history_version counts completed turns so the
+        # server can tell whether a client's message builds on the stored history
+        self.chat_history = deque(maxlen=CHAT_HISTORY_MAXLEN)
+        self.history_version = 0
+        self.persistent_cart = []
+        self.persistent_image_url = ""
+        self.bad_prompts = set()
+        self.raw_io_history = deque(maxlen=RAW_IO_HISTORY_MAXLEN)
+        self.session_discount_percentage = ""
+        self.session_loyalty_response = None
+        self.loyalty_response_sent = False
+        self.customer_loyalty_executed = False
+
+    def to_dict(self) -> dict:
+        data = {name: getattr(self, name) for name in self.__slots__}
+        data["chat_history"] = list(self.chat_history)
+        data["bad_prompts"] = list(self.bad_prompts)
+        data["raw_io_history"] = list(self.raw_io_history)
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "SessionState":
+        state = cls(data["session_id"])
+        for name in cls.__slots__:
+            if name in data:
+                setattr(state, name, data[name])
+        state.chat_history = deque((tuple(entry) for entry in state.chat_history), maxlen=CHAT_HISTORY_MAXLEN)
+        state.bad_prompts = set(state.bad_prompts)
+        state.raw_io_history = deque(state.raw_io_history, maxlen=RAW_IO_HISTORY_MAXLEN)
+        return state
+
+    def dumps(self) -> bytes:
+        return orjson.dumps(self.to_dict())
+
+    @classmethod
+    def loads(cls, payload: bytes) -> "SessionState":
+        return cls.from_dict(orjson.loads(payload))
+
+
+class SessionStore:
+    """Interface for session state backends."""
+
+    async def load(self, session_id: str) -> Optional[SessionState]:
+        raise NotImplementedError
+
+    async def save(self, state: SessionState):
+        raise NotImplementedError
+
+    async def delete(self, session_id: str):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class InMemorySessionStore(SessionStore):
+    """In-process LRU store. Sessions only survive on the worker that created them."""
+
+    def __init__(self, max_sessions: int = 1000):
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[str, SessionState]" = OrderedDict()
+
+    async def load(self, session_id: str) -> Optional[SessionState]:
+        state = self._sessions.get(session_id)
+        if state is not None:
+            self._sessions.move_to_end(session_id)
+        return state
+
+    async def save(self, state: SessionState):
+        self._sessions[state.session_id] = state
+        self._sessions.move_to_end(state.session_id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    async def delete(self, session_id: str):
+        self._sessions.pop(session_id, None)
+
+
+class SqliteSessionStore(SessionStore):
+    """
+    On-disk SQLite store, shared by every worker on the same host. Expired sessions are
+    purged on save, at most once every purge_interval seconds.
+    """
+
+    def __init__(self, path: str = DEFAULT_SQLITE_PATH, ttl_seconds: int = 86400, purge_interval: float = 300.0):
+        self.ttl_seconds = ttl_seconds
+        self.purge_interval = purge_interval
+        self.purged = 0
+        self._next_purge = 0.0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "session_id TEXT PRIMARY KEY, data BLOB NOT NULL, updated_at REAL NOT NULL)"
+        )
+
+    def _load(self, session_id: str) -> Optional[bytes]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM sessions WHERE session_id = ? AND updated_at > ?",
+                (session_id, time.time() - self.ttl_seconds)
+            ).fetchone()
+        return row[0] if row else None
+
+    def _save(self, session_id: str, payload: bytes):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, data, updated_at) VALUES (?, ?, ?)",
+                (session_id, payload, now)
+            )
+            if now >= self._next_purge:
+                self._next_purge = now + self.purge_interval
+                cursor = self._conn.execute("DELETE FROM sessions WHERE updated_at <= ?", (now - self.ttl_seconds,))
+                self.purged += cursor.rowcount
+
+    def _delete(self, session_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    async def load(self, session_id: str) -> Optional[SessionState]:
+        payload = await asyncio.to_thread(self._load, session_id)
+        return SessionState.loads(payload) if payload else None
+
+    async def save(self, state: SessionState):
+        await asyncio.to_thread(self._save, state.session_id, state.dumps())
+
+    async def delete(self, session_id: str):
+        await asyncio.to_thread(self._delete, session_id)
+
+    async def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Store speaking the Redis protocol (RESP) directly, so it runs against Redis or
+    any compatible local stand-in without an extra client dependency.
+    """
+
+    def __init__(self, url: str = "redis://localhost:6379/0", ttl_seconds: int = 86400,
+                 key_prefix: str = "zava:session:"):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.ttl_seconds = ttl_seconds
+        self.key_prefix = key_prefix
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        if self.password:
+            await self._send("AUTH", self.password)
+        if self.db:
+            await self._send("SELECT", str(self.db))
+
+    async def _send(self, *args):
+        payload = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            value = arg if isinstance(arg, bytes) else str(arg).encode()
+            payload.append(b"$%d\r\n%s\r\n" % (len(value), value))
+        self._writer.write(b"".join(payload))
+        await self._writer.drain()
+        return await self._read_reply()
+
+    async def _read_reply(self):
+        line = await self._reader.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed")
+        kind, body = line[:1], line[1:-2]
+        if kind == b"+":
+            return body.decode()
+        if kind == b"-":
+            raise RuntimeError(f"Redis error: {body.decode()}")
+        if kind == b":":
+            return int(body)
+        if kind == b"$":
+            length = int(body)
+            if length == -1:
+                return None
+            data = await self._reader.readexactly(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            return [await self._read_reply() for _ in range(int(body))]
+        raise RuntimeError(f"Unexpected Redis reply: {line!r}")
+
+    def _disconnect(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = None
+        self._writer = None
+
+    async def _command(self, *args):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            try:
+                try:
+                    if self._writer is None:
+                        await self._connect()
+                    return await self._send(*args)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    # Reconnect once on a dropped connection
+                    self._disconnect()
+                    await self._connect()
+                    return await self._send(*args)
+            except BaseException:
+                # A command interrupted between request and reply (cancelled turn, closed
+                # socket) leaves its reply in the stream, where the next command would read
+                # it as its own; never reuse that connection
+                self._disconnect()
+                raise
+
+    async def load(self, session_id: str) -> Optional[SessionState]:
+        payload = await self._command("GET", self.key_prefix + session_id)
+        return SessionState.loads(payload) if payload else None
+
+    async def save(self, state: SessionState):
+        await self._command("SET", self.key_prefix + state.session_id, state.dumps(), "EX", self.ttl_seconds)
+
+    async def delete(self, session_id: str):
+        await self._command("DEL", self.key_prefix + session_id)
+
+    async def close(self):
+        self._disconnect()
+
+
+def create_session_store() -> SessionStore:
+    """
+    Create the session store selected by SESSION_STORE (memory, sqlite or redis). The SQLite
+    file is SESSION_STORE_PATH (a file in the temp directory by default).
+    """
+    backend = os.getenv("SESSION_STORE", "memory").lower()
+    ttl_seconds = int(os.getenv("SESSION_TTL_SECONDS", "86400"))
+    if backend == "sqlite":
+        return SqliteSessionStore(
+            os.getenv("SESSION_STORE_PATH", DEFAULT_SQLITE_PATH),
+            ttl_seconds,
+            float(os.getenv("SESSION_PURGE_SECONDS", "300"))
+        )
+    if backend == "redis":
+        return RedisSessionStore(os.getenv("SESSION_STORE_URL", "redis://localhost:6379/0"), ttl_seconds)
+    return InMemorySessionStore(int(os.getenv("SESSION_CACHE_SIZE", "1000")))
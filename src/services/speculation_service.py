@@ -0,0 +1,126 @@
+"""
+Speculative execution of the design agents' product search and image description.
+
+Both only depend on the incoming message, so they are started alongside the router
+call. If the router picks a design agent the pipeline takes the results that are
+already in flight; otherwise they are cancelled and counted as wasted.
+"""
+import asyncio
+import logging
+import statistics
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from utils.performance_utils import percentile
+
+logger = logging.getLogger(__name__)
+
+DESIGN_AGENTS = ("interior_designer", "interior_designer_create_image")
+
+
+class TurnSpeculation:
+    """Speculative tasks started for one turn; each is keyed by (kind, input) and taken at most once."""
+
+    def __init__(self, speculator: "ProductSpeculator"):
+        self._speculator = speculator
+        self._tasks: Dict[Tuple[str, str], Tuple[asyncio.Task, float]] = {}
+
+    def _start(self, kind: str, key: str, coro: Awaitable[Any]) -> asyncio.Task:
+        task = asyncio.ensure_future(coro)
+        self._tasks[(kind, key)] = (task, time.perf_counter())
+        self._speculator.started += 1
+        return task
+
+    async def _take(self, kind: str, key: str, run_live: Callable[[], Awaitable[Any]]):
+        entry = self._tasks.pop((kind, key), None)
+        if entry is None:
+            self._speculator.misses += 1
+            return await run_live()
+        task, started_at = entry
+        # How far ahead of the pipeline the speculative work started
+        self._speculator.lead_times.append(time.perf_counter() - started_at)
+        try:
+            result = await task
+        except Exception as e:
+            self._speculator.failed += 1
+            logger.warning(f"Speculative {kind} failed, running it live: {e}")
+            return await run_live()
+        self._speculator.used += 1
+        return result
+
+    async def image_description(self, image_url: str) -> str:
+        return await self._take("image", image_url, lambda: self._speculator.describe_image(image_url))
+
+    async def products(self, query: str):
+        return await self._take("search", query, lambda: self._speculator.run_search(query))
+
+    async def products_for_image(self, user_message: str, image_url: str, image_data: str):
+        """Product search for a message sent with an image (keyed by URL, so it can start before the description exists)."""
+        return await self._take(
+            "search", user_message + "\0" + image_url,
+            lambda: self._speculator.search_with_accessories(user_message + image_data)
+        )
+
+    def discard(self):
+        """Cancel every speculative task that was not taken."""
+        for task, _ in self._tasks.values():
+            task.cancel()
+            self._speculator.wasted += 1
+        self._tasks.clear()
+
+
+class ProductSpeculator:
+    """Starts per-turn speculation and keeps process-wide counters for /metrics."""
+
+    def __init__(self, search: Callable[[str], Awaitable[Any]], describe_image: Callable[[str], Awaitable[str]],
+                 search_with_accessories: Callable[[str], Awaitable[Any]]):
+        self.search = search
+        self.describe_image = describe_image
+        # Image turns also recommend painting accessories (one sub-query per family)
+        self.search_with_accessories = search_with_accessories
+        self.started = 0
+        self.used = 0
+        self.misses = 0
+        self.wasted = 0
+        self.failed = 0
+        self.lead_times = deque(maxlen=1000)
+
+    async def run_search(self, query: str):
+        return await self.search(query)
+
+    async def _search_with_image(self, user_message: str, image_url: str):
+        image_data = await self.describe_image(image_url)
+        return await self.search_with_accessories(user_message + image_data)
+
+    def begin(self, user_message: str, image_url: Optional[str] = None, video_url: Optional[str] = None) -> TurnSpeculation:
+        """
+        Start the product search (and image description) the interior designer would run for
+        this message. Video turns are not speculated since the summary is too expensive to waste.
+        """
+        speculation = TurnSpeculation(self)
+        if video_url:
+            return speculation
+        if image_url:
+            speculation._start("image", image_url, self.describe_image(image_url))
+            speculation._start(
+                "search", user_message + "\0" + image_url, self._search_with_image(user_message, image_url)
+            )
+        else:
+            speculation._start("search", user_message, self.run_search(user_message))
+        return speculation
+
+    def stats(self) -> Dict[str, Any]:
+        lead_times = list(self.lead_times)
+        return {
+            "started": self.started,
+            "used": self.used,
+            "wasted": self.wasted,
+            "failed": self.failed,
+            "misses": self.misses,
+            "wasted_rate": self.wasted / self.started if self.started else 0.0,
+            "lead_time_ms": {
+                "avg": statistics.mean(lead_times) * 1000 if lead_times else 0.0,
+                "p95": percentile(lead_times, 0.95) * 1000,
+            },
+        }
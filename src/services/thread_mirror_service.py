@@ -0,0 +1,124 @@
+"""
+Local mirror of recent agent thread messages.
+
+For every thread the mirror remembers the id of the newest message it has seen and
+keeps a short local copy of recent messages. After a run only messages newer than
+that cursor (and produced by that run) are requested, so retrieving a reply is one
+small request however long the thread has grown.
+"""
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Callable, Dict, List, Optional
+
+from azure.ai.agents.models import ListSortOrder
+
+
+def message_text(message) -> str:
+    """Join the text values of all content blocks of a thread message."""
+    content = message.content
+    if isinstance(content, list):
+        text_blocks = []
+        for block in content:
+            if isinstance(block, dict):
+                text_val = block.get('text', {}).get('value')
+                if text_val:
+                    text_blocks.append(text_val)
+            elif hasattr(block, 'text'):
+                if hasattr(block.text, 'value'):
+                    text_val = block.text.value
+                    if text_val:
+                        text_blocks.append(text_val)
+        if text_blocks:
+            return '\n'.join(text_blocks)
+    return str(content)
+
+
+class _MirroredThread:
+    __slots__ = ("last_message_id", "messages")
+
+    def __init__(self, max_messages: int):
+        self.last_message_id: Optional[str] = None
+        self.messages = deque(maxlen=max_messages)
+
+
+class ThreadMirror:
+    """Cursor per thread plus a bounded copy of its recent messages."""
+
+    def __init__(self, max_threads: int = 1000, messages_per_thread: int = 20):
+        self.max_threads = max_threads
+        self.messages_per_thread = messages_per_thread
+        self._threads: "OrderedDict[str, _MirroredThread]" = OrderedDict()
+        # Runs execute both on the event loop and in worker threads
+        self._lock = threading.Lock()
+        # Called with (thread_id, messages) for every batch of new messages
+        self._listeners: List[Callable[[str, List[Any]], None]] = []
+        self.requests = 0
+        self.messages_fetched = 0
+
+    def add_listener(self, listener: Callable[[str, List[Any]], None]):
+        """Also hand every new message to listener, before the bounded copy can evict it."""
+        self._listeners.append(listener)
+
+    def _thread(self, thread_id: str) -> _MirroredThread:
+        thread = self._threads.get(thread_id)
+        if thread is None:
+            thread = self._threads[thread_id] = _MirroredThread(self.messages_per_thread)
+            while len(self._threads) > self.max_threads:
+                self._threads.popitem(last=False)
+        self._threads.move_to_end(thread_id)
+        return thread
+
+    def record(self, thread_id: str, messages: List[Any]):
+        """Add messages (oldest first) that are already known locally and advance the cursor."""
+        with self._lock:
+            thread = self._thread(thread_id)
+            for message in messages:
+                thread.messages.append(message)
+                thread.last_message_id = message.id
+        if messages:
+            for listener in self._listeners:
+                listener(thread_id, messages)
+
+    def _list_kwargs(self, thread_id: str, run_id: Optional[str]) -> Dict[str, Any]:
+        with self._lock:
+            last_message_id = self._thread(thread_id).last_message_id
+        kwargs = {"thread_id": thread_id, "order": ListSortOrder.ASCENDING}
+        if last_message_id:
+            kwargs["after"] = last_message_id
+        if run_id:
+            kwargs["run_id"] = run_id
+        return kwargs
+
+    def sync(self, messages_client, thread_id: str, run_id: Optional[str] = None) -> List[Any]:
+        """Fetch the messages newer than the cursor (optionally only those of run_id) with a sync client."""
+        new_messages = list(messages_client.list(**self._list_kwargs(thread_id, run_id)))
+        self.requests += 1
+        self.messages_fetched += len(new_messages)
+        self.record(thread_id, new_messages)
+        return new_messages
+
+    async def sync_async(self, messages_client, thread_id: str, run_id: Optional[str] = None) -> List[Any]:
+        """Same as sync() for the azure.ai.agents.aio client."""
+        new_messages = [message async for message in messages_client.list(**self._list_kwargs(thread_id, run_id))]
+        self.requests += 1
+        self.messages_fetched += len(new_messages)
+        self.record(thread_id, new_messages)
+        return new_messages
+
+    def recent(self, thread_id: str) -> List[Any]:
+        """Locally mirrored recent messages of a thread, oldest first."""
+        with self._lock:
+            thread = self._threads.get(thread_id)
+            return list(thread.messages) if thread else []
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "threads": len(self._threads),
+            "requests": self.requests,
+            "messages_fetched": self.messages_fetched,
+            "avg_messages_per_request": self.messages_fetched / self.requests if self.requests else 0.0,
+        }
+
+
+# Process-wide mirror shared by every agent
+thread_mirror = ThreadMirror()
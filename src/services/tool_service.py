@@ -0,0 +1,132 @@
+"""
+Concurrent execution of the function tool calls an agent run requests in one step.
+
+Calls run on a dedicated bounded thread pool (the tools are synchronous), each with
+its own timeout. A failed or timed-out call is reported back to the run as an error
+output while the other calls' results are still submitted, so one slow or broken
+tool does not sink the whole step.
+"""
+import asyncio
+import json
+import logging
+import os
+import statistics
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any, Dict, List
+
+from azure.ai.agents.models import FunctionTool, RequiredFunctionToolCall, ToolOutput
+
+from utils.performance_utils import percentile
+
+logger = logging.getLogger(__name__)
+
+# Image generation is much slower than the other tools
+DEFAULT_TOOL_TIMEOUTS = {"create_image": 120.0}
+
+
+class _ToolStats:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.latencies = deque(maxlen=500)
+
+
+class ToolExecutor:
+    """Runs a step's tool calls concurrently with per-tool timeouts and latency metrics."""
+
+    def __init__(self, max_workers: int = 8, default_timeout: float = 60.0, timeouts: Dict[str, float] = None):
+        # Separate from the pool that runs whole agent runs, so a run waiting on its
+        # tools can never starve them of threads
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="agent-tool")
+        self.default_timeout = default_timeout
+        self.timeouts = dict(timeouts or {})
+        self._stats: Dict[str, _ToolStats] = defaultdict(_ToolStats)
+
+    def timeout_for(self, name: str) -> float:
+        return self.timeouts.get(name, self.default_timeout)
+
+    def _run_tool(self, functions: FunctionTool, tool_call: RequiredFunctionToolCall):
+        start_time = time.perf_counter()
+        try:
+            return functions.execute(tool_call)
+        finally:
+            self._stats[tool_call.function.name].latencies.append(time.perf_counter() - start_time)
+
+    def _to_output(self, tool_call: RequiredFunctionToolCall, result: Any = None, error: str = None) -> ToolOutput:
+        stats = self._stats[tool_call.function.name]
+        stats.calls += 1
+        if error is not None:
+            stats.errors += 1
+            logger.warning(f"Tool {tool_call.function.name} failed: {error}")
+            # Reported to the model so it can answer with the results that did arrive
+            return ToolOutput(tool_call_id=tool_call.id, output=json.dumps({"error": error}))
+        return ToolOutput(tool_call_id=tool_call.id, output=result if isinstance(result, str) else json.dumps(result, default=str))
+
+    def execute(self, functions: FunctionTool, tool_calls: List[Any]) -> List[ToolOutput]:
+        """Run the calls concurrently from a synchronous caller and return one output per function call."""
+        calls = [tool_call for tool_call in tool_calls if isinstance(tool_call, RequiredFunctionToolCall)]
+        futures = [self._pool.submit(self._run_tool, functions, tool_call) for tool_call in calls]
+        started_at = time.monotonic()
+        outputs = []
+        for tool_call, future in zip(calls, futures):
+            name = tool_call.function.name
+            # Every call's timeout counts from the common start, not from when it is awaited
+            remaining = max(0.0, self.timeout_for(name) - (time.monotonic() - started_at))
+            try:
+                outputs.append(self._to_output(tool_call, future.result(timeout=remaining)))
+            except FutureTimeoutError:
+                self._stats[name].timeouts += 1
+                future.cancel()
+                outputs.append(self._to_output(tool_call, error=f"{name} timed out after {self.timeout_for(name):.0f}s"))
+            except Exception as e:
+                outputs.append(self._to_output(tool_call, error=f"{name} failed: {e}"))
+        return outputs
+
+    async def execute_async(self, functions: FunctionTool, tool_calls: List[Any]) -> List[ToolOutput]:
+        """Run the calls concurrently without blocking the event loop."""
+        calls = [tool_call for tool_call in tool_calls if isinstance(tool_call, RequiredFunctionToolCall)]
+        loop = asyncio.get_running_loop()
+
+        async def run(tool_call):
+            name = tool_call.function.name
+            try:
+                result = await asyncio.wait_for(
+                    loop.run_in_executor(self._pool, self._run_tool, functions, tool_call),
+                    timeout=self.timeout_for(name)
+                )
+                return self._to_output(tool_call, result)
+            except asyncio.TimeoutError:
+                self._stats[name].timeouts += 1
+                return self._to_output(tool_call, error=f"{name} timed out after {self.timeout_for(name):.0f}s")
+            except Exception as e:
+                return self._to_output(tool_call, error=f"{name} failed: {e}")
+
+        return list(await asyncio.gather(*(run(tool_call) for tool_call in calls)))
+
+    def stats(self) -> Dict[str, Any]:
+        result = {}
+        for name, stats in self._stats.items():
+            latencies = list(stats.latencies)
+            result[name] = {
+                "calls": stats.calls,
+                "errors": stats.errors,
+                "timeouts": stats.timeouts,
+                "timeout_seconds": self.timeout_for(name),
+                "latency_ms": {
+                    "avg": statistics.mean(latencies) * 1000 if latencies else 0.0,
+                    "p95": percentile(latencies, 0.95) * 1000,
+                    "max": max(latencies) * 1000 if latencies else 0.0,
+                },
+            }
+        return result
+
+
+# Process-wide executor shared by every agent run
+tool_executor = ToolExecutor(
+    max_workers=int(os.getenv("TOOL_POOL_SIZE", "8")),
+    default_timeout=float(os.getenv("TOOL_TIMEOUT_SECONDS", "60")),
+    timeouts=DEFAULT_TOOL_TIMEOUTS,
+)
@@ -0,0 +1,137 @@
+"""
+Per-session turn queue for the /ws endpoint.
+
+Messages are received independently of turn processing, so a correction sent while
+a long agent run is in flight is not stuck behind it: with cancellation enabled the
+newer message supersedes (cancels) the running turn, and messages that were queued
+behind it only have their history recorded. A turn that has started answering (see
+mark_replied) is no longer superseded; a second question waits for it instead.
+"""
+import asyncio
+import logging
+import statistics
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from utils.performance_utils import percentile
+
+logger = logging.getLogger(__name__)
+
+
+class TurnQueueMetrics:
+    """Process-wide counters shared by every session's queue."""
+
+    def __init__(self):
+        self.depth = 0
+        self.submitted = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.superseded = 0
+        self.rejected = 0
+        self.wait_times = deque(maxlen=1000)
+
+    def stats(self) -> Dict[str, Any]:
+        wait_times = list(self.wait_times)
+        return {
+            "depth": self.depth,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "cancelled": self.cancelled,
+            "superseded": self.superseded,
+            "rejected": self.rejected,
+            "wait_ms": {
+                "avg": statistics.mean(wait_times) * 1000 if wait_times else 0.0,
+                "p50": percentile(wait_times, 0.50) * 1000,
+                "p95": percentile(wait_times, 0.95) * 1000,
+                "max": max(wait_times) * 1000 if wait_times else 0.0,
+            },
+        }
+
+
+class SessionTurnQueue:
+    """
+    Bounded FIFO of raw messages processed one turn at a time by handler(message, superseded).
+    after_turn(cancelled) runs after every turn, whether it completed, failed or was cancelled.
+    The handler calls mark_replied() when it sends the first frame of its reply.
+    """
+
+    def __init__(self, handler: Callable[[str, bool], Awaitable[None]], after_turn: Callable[[bool], Awaitable[None]],
+                 metrics: TurnQueueMetrics, maxsize: int = 4, cancel_superseded: bool = True):
+        self.handler = handler
+        self.after_turn = after_turn
+        self.metrics = metrics
+        self.maxsize = maxsize
+        self.cancel_superseded = cancel_superseded
+        self._queue: deque = deque()
+        self._ready = asyncio.Event()
+        self._current: Optional[asyncio.Task] = None
+        self._replied = False
+        self._worker: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._worker = asyncio.create_task(self._run())
+
+    def mark_replied(self):
+        """The running turn has started answering, so newer messages no longer cancel it."""
+        self._replied = True
+
+    def submit(self, message: str) -> bool:
+        """Queue a message; returns False if the queue is full."""
+        if len(self._queue) >= self.maxsize:
+            self.metrics.rejected += 1
+            return False
+        self._queue.append((message, time.perf_counter()))
+        self.metrics.submitted += 1
+        self.metrics.depth += 1
+        if self.cancel_superseded and not self._replied and self._current is not None and not self._current.done():
+            self._current.cancel()
+        self._ready.set()
+        return True
+
+    async def _run(self):
+        while True:
+            if not self._queue:
+                self._ready.clear()
+                await self._ready.wait()
+                continue
+            message, queued_at = self._queue.popleft()
+            self.metrics.depth -= 1
+            self.metrics.wait_times.append(time.perf_counter() - queued_at)
+            # A newer message is already waiting: only record this one
+            superseded = self.cancel_superseded and bool(self._queue)
+            if superseded:
+                self.metrics.superseded += 1
+            self._replied = False
+            self._current = asyncio.create_task(self.handler(message, superseded))
+            cancelled = False
+            try:
+                await self._current
+                self.metrics.completed += 1
+            except asyncio.CancelledError:
+                if self._worker is not None and self._worker.cancelling():
+                    raise
+                self.metrics.cancelled += 1
+                cancelled = True
+                logger.info("Turn superseded by a newer message and cancelled")
+            except Exception:
+                logger.error("Unhandled error in session turn", exc_info=True)
+            finally:
+                self._current = None
+            try:
+                await self.after_turn(cancelled)
+            except Exception:
+                logger.warning("Post-turn hook failed", exc_info=True)
+
+    async def close(self):
+        """Cancel the running turn and the worker; queued messages are dropped."""
+        self.metrics.depth -= len(self._queue)
+        self._queue.clear()
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+        if self._current is not None:
+            self._current.cancel()
@@ -0,0 +1,139 @@
+"""
+Worker warm-up.
+
+A freshly forked worker would otherwise make its first user pay for TLS handshakes
+to every Azure endpoint, toolset construction, AgentProcessor creation and the
+search client's first-request setup. The warm-up runs in the background right after
+the container starts; /health reports ready only once every step has succeeded, and
+degraded if the warm-up ended with steps failed or unfinished.
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Dict, Optional
+
+from azure.ai.inference.models import UserMessage
+
+from services.agent_service import get_or_create_agent_processor
+from services.catalog_service import get_catalog_index
+
+logger = logging.getLogger(__name__)
+
+# Agents run through an AgentProcessor (the env var name is also the agent type); cora
+# is answered by a direct model call, which the llm step warms
+AGENT_TYPES = ("interior_designer", "customer_loyalty", "inventory_agent")
+
+
+class WarmupState:
+    """Progress of one worker's warm-up; every step is best effort and timed."""
+
+    def __init__(self):
+        self.ready = False
+        # Finished, but with steps that failed or did not finish in time
+        self.degraded = False
+        self.started_at: Optional[float] = None
+        self.duration: Optional[float] = None
+        self.steps: Dict[str, Dict[str, Any]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    async def _step(self, name: str, call):
+        start_time = time.perf_counter()
+        try:
+            await call()
+            self.steps[name] = {"ok": True, "ms": (time.perf_counter() - start_time) * 1000}
+        except Exception as e:
+            self.steps[name] = {"ok": False, "ms": (time.perf_counter() - start_time) * 1000, "error": str(e)}
+            logger.warning(f"Warm-up step {name} failed: {e}")
+
+    async def _warm_agents(self, container):
+        for agent_type in AGENT_TYPES:
+            agent_id = container.env_vars.get(agent_type)
+            if not agent_id:
+                continue
+            # Builds and caches the toolset and the shared AgentProcessor
+            get_or_create_agent_processor(
+                agent_id=agent_id,
+                agent_type=agent_type,
+                project_client=container.project_client,
+                async_agents_client=container.async_agents_client
+            )
+            # Opens the pooled connections of both agents clients
+            await asyncio.to_thread(container.project_client.agents.get_agent, agent_id)
+            await container.async_agents_client.get_agent(agent_id)
+
+    async def _warm_search(self):
+        from app.tools.aiSearchTools import get_async_search_client
+        await get_async_search_client().get_document_count()
+
+    async def _warm_router(self, container, prime: bool):
+        if prime:
+            await container.router_client.complete(
+                messages=[UserMessage(content="hi")],
+                model=container.env_vars['phi_4_deployment'],
+                max_tokens=1
+            )
+        else:
+            await container.router_client.get_model_info()
+
+    async def _warm_llm(self, container, prime: bool):
+        if prime:
+            await container.llm_client.chat.completions.create(
+                model=container.env_vars['gpt_deployment'],
+                messages=[{"role": "user", "content": "hi"}],
+                max_completion_tokens=1
+            )
+        else:
+            await container.llm_client.models.list()
+
+    async def run(self, container, prime: bool = False, timeout: float = 60.0):
+        """
+        Run every warm-up step concurrently, bounded by timeout. The worker is ready only if
+        every step succeeded; otherwise it is degraded and still serves, paying the cold paths.
+        """
+        self.started_at = time.time()
+        start_time = time.perf_counter()
+        steps = {
+            "agents": lambda: self._warm_agents(container),
+            "search": self._warm_search,
+            "catalog": lambda: asyncio.to_thread(get_catalog_index),
+            "router": lambda: self._warm_router(container, prime),
+            "llm": lambda: self._warm_llm(container, prime),
+        }
+        try:
+            await asyncio.wait_for(asyncio.gather(*(self._step(name, call) for name, call in steps.items())), timeout=timeout)
+        except asyncio.TimeoutError:
+            for name in steps:
+                self.steps.setdefault(name, {"ok": False, "ms": timeout * 1000, "error": "timed out"})
+        self.duration = time.perf_counter() - start_time
+        failed = [name for name, step in self.steps.items() if not step["ok"]]
+        if failed:
+            self.degraded = True
+            logger.warning(f"Worker {os.getpid()} serving degraded after {self.duration:.2f}s; warm-up failed for {', '.join(failed)}")
+        else:
+            self.ready = True
+            logger.info(f"Worker {os.getpid()} warmed up in {self.duration:.2f}s")
+
+    def start(self, container):
+        """Start the warm-up in the background (WARMUP_PRIME_MODELS sends tiny completions, WARMUP_TIMEOUT_SECONDS bounds it)."""
+        self._task = asyncio.create_task(self.run(
+            container,
+            prime=os.getenv("WARMUP_PRIME_MODELS", "false").lower() == "true",
+            timeout=float(os.getenv("WARMUP_TIMEOUT_SECONDS", "60"))
+        ))
+
+    async def stop(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "degraded": self.degraded,
+            "duration_ms": self.duration * 1000 if self.duration is not None else None,
+            "steps": self.steps,
+        }
@@ -0,0 +1,37 @@
+import asyncio
+
+import pytest
+
+from services.admission_service import AdmissionController, AdmissionRejected
+
+
+def test_admission_bounds_concurrency_and_rejects_after_the_wait():
+    async def scenario():
+        controller = AdmissionController({"llm": 2}, max_wait_seconds=0.05)
+        running, peak = 0, 0
+
+        async def call():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.02)
+            running -= 1
+            return "done"
+
+        results = await asyncio.gather(*(controller.run("llm", call) for _ in range(4)))
+        first = await controller.acquire("llm")
+        second = await controller.acquire("llm")
+        with pytest.raises(AdmissionRejected):
+            await controller.acquire("llm")
+        first.release()
+        first.release()  # idempotent
+        third = await controller.acquire("llm")
+        second.release()
+        third.release()
+        return results, peak, controller.stats()["llm"]
+
+    results, peak, stats = asyncio.run(scenario())
+    assert results == ["done"] * 4
+    assert peak == 2
+    assert stats["rejected"] == 1
+    assert stats["in_use"] == 0
@@ -0,0 +1,61 @@
+import asyncio
+import itertools
+from types import SimpleNamespace
+
+from services.agent_thread_service import AgentThreadPool
+
+
+class FakeThreads:
+    def __init__(self):
+        self._ids = itertools.count(1)
+        self.deleted = []
+
+    def create(self):
+        return SimpleNamespace(id=f"thread_{next(self._ids)}")
+
+    def delete(self, thread_id):
+        self.deleted.append(thread_id)
+
+
+def fake_project_client():
+    return SimpleNamespace(agents=SimpleNamespace(threads=FakeThreads()))
+
+
+async def wait_for_pool(pool, size):
+    for _ in range(200):
+        if pool.stats()["pool_size"] >= size:
+            return
+        await asyncio.sleep(0.01)
+
+
+def test_leases_come_from_the_pool():
+    async def scenario():
+        pool = AgentThreadPool(fake_project_client(), target_size=2)
+        pool.start()
+        await wait_for_pool(pool, 2)
+        thread_id = await pool.lease()
+        await pool.stop()
+        return pool, thread_id
+
+    pool, thread_id = asyncio.run(scenario())
+    assert thread_id.startswith("thread_")
+    assert pool.stats()["pool_hits"] == 1
+
+
+def test_stop_deletes_the_threads_no_session_leased():
+    async def scenario():
+        client = fake_project_client()
+        pool = AgentThreadPool(client, target_size=3)
+        pool.start()
+        await wait_for_pool(pool, 3)
+        leased = await pool.lease()
+        # Let the refill top the pool up again before stopping
+        await wait_for_pool(pool, 3)
+        await pool.stop()
+        return pool, client.agents.threads.deleted, leased
+
+    pool, deleted, leased = asyncio.run(scenario())
+    assert len(deleted) == 3
+    assert leased not in deleted
+    assert pool.stats()["pool_size"] == 0
+    assert pool.stats()["threads_deleted"] == 3
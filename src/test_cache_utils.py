@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+
+from utils.cache_utils import AsyncTTLCache
+
+
+def test_concurrent_misses_share_one_load():
+    async def scenario():
+        cache = AsyncTTLCache(name="test")
+        calls = []
+
+        async def load():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "value"
+
+        results = await asyncio.gather(*(cache.get_or_load("key", load) for _ in range(10)))
+        return cache, calls, results
+
+    cache, calls, results = asyncio.run(scenario())
+    assert results == ["value"] * 10
+    assert len(calls) == 1
+    stats = cache.stats()
+    assert stats["misses"] == 1 and stats["coalesced"] == 9 and stats["in_flight"] == 0
+
+
+def test_cancelled_waiter_does_not_cancel_the_shared_load():
+    async def scenario():
+        cache = AsyncTTLCache()
+
+        async def load():
+            await asyncio.sleep(0.05)
+            return "value"
+
+        first = asyncio.create_task(cache.get_or_load("key", load))
+        second = asyncio.create_task(cache.get_or_load("key", load))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second, cache.get("key")
+
+    assert asyncio.run(scenario()) == ("value", "value")
+
+
+def test_failed_load_is_not_cached():
+    async def scenario():
+        cache = AsyncTTLCache()
+        attempts = []
+
+        async def load():
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise RuntimeError("backend down")
+            return "value"
+
+        with pytest.raises(RuntimeError):
+            await cache.get_or_load("key", load)
+        return await cache.get_or_load("key", load), len(attempts)
+
+    assert asyncio.run(scenario()) == ("value", 2)
+
+
+def test_entries_expire_and_evict_least_recently_used():
+    cache = AsyncTTLCache(max_size=2, ttl_seconds=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+
+    expired = AsyncTTLCache(ttl_seconds=-1)
+    expired.set("a", 1)
+    assert expired.get("a") is None
+    assert expired.stats()["evictions"] == 1
@@ -0,0 +1,52 @@
+from services.catalog_service import CatalogIndex, get_catalog_index, tokenize
+
+ROWS = [
+    {"ProductID": "P1", "ProductName": "Frosted Blue", "ProductCategory": "Paint Shades",
+     "ProductPunchLine": "Chill out in classic blue", "ProductDescription": "A crisp, subtle blue.", "Price": "48.99"},
+    {"ProductID": "P2", "ProductName": "Standard Paint Roller", "ProductCategory": "Paint Accessories",
+     "ProductPunchLine": "Roll it on", "ProductDescription": "A roller for walls.", "Price": "15.99"},
+    {"ProductID": "P3", "ProductName": "Fine Finish Paint Brush", "ProductCategory": "Paint Accessories",
+     "ProductPunchLine": "Detail work", "ProductDescription": "A brush for trim and edges.", "Price": ""},
+]
+
+
+def test_tokenize_drops_stopwords_and_folds_plurals():
+    assert tokenize("I want some Brushes and rollers for the glass") == ["brush", "roller", "glass"]
+
+
+def test_search_ranks_by_bm25_and_returns_product_fields():
+    index = CatalogIndex(ROWS)
+    results = index.search("blue paint")
+    assert [product["id"] for product in results][0] == "P1"
+    assert results[0] == {
+        "id": "P1", "name": "Frosted Blue", "type": "Paint Shades", "description": "A crisp, subtle blue.",
+        "imageURL": None, "punchLine": "Chill out in classic blue", "price": 48.99,
+    }
+    assert index.search("brushes")[0]["id"] == "P3"
+
+
+def test_name_matches_weigh_more_than_description_matches():
+    rows = [
+        {"ProductID": "D", "ProductName": "Wall Helper", "ProductDescription": "Works with any roller."},
+        {"ProductID": "N", "ProductName": "Roller", "ProductDescription": "Helps on any wall."},
+    ]
+    assert [product["id"] for product in CatalogIndex(rows).search("roller")] == ["N", "D"]
+
+
+def test_search_without_matching_terms_is_empty():
+    index = CatalogIndex(ROWS)
+    assert index.search("sofa") == []
+    assert index.search("") == []
+
+
+def test_top_limits_the_results():
+    index = CatalogIndex(ROWS)
+    assert len(index.search("paint", top=2)) == 2
+    assert len(index.search("paint", top=10)) == 3
+    assert index.stats()["searches"] == 2
+
+
+def test_catalog_csv_builds_and_answers():
+    index = get_catalog_index()
+    assert len(index) > 0
+    assert index.search("paint sprayer")
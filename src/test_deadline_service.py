@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+
+from services.deadline_service import DeadlineExceeded, DeadlineRunner, InvalidReply
+
+
+def reply_after(seconds, reply):
+    async def call():
+        await asyncio.sleep(seconds)
+        return reply
+    return call
+
+
+def run(runner, call, budget=1.0, agent="agent", **kwargs):
+    return asyncio.run(runner.run(agent, call, budget=budget, **kwargs))
+
+
+def test_reply_within_the_budget():
+    runner = DeadlineRunner()
+    assert run(runner, reply_after(0.01, "reply")) == "reply"
+    stats = runner.stats()["agent"]
+    assert stats["completed"] == 1
+    assert stats["latency_ms"]["avg"] >= 10
+
+
+def test_slow_run_is_cancelled_at_the_deadline():
+    runner = DeadlineRunner()
+    cancelled = []
+
+    async def slow_run():
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def scenario():
+        with pytest.raises(DeadlineExceeded):
+            await runner.run("agent", slow_run, budget=0.05)
+        # Let the cancellation reach the run
+        await asyncio.sleep(0)
+
+    asyncio.run(scenario())
+    assert cancelled == [True]
+    assert runner.stats()["agent"]["deadline_exceeded"] == 1
+
+
+def test_spent_budget_does_not_start_the_run():
+    runner = DeadlineRunner()
+    started = []
+
+    async def call():
+        started.append(True)
+        return "reply"
+
+    with pytest.raises(DeadlineExceeded):
+        run(runner, call, budget=0.0)
+    assert started == []
+
+
+def test_a_failed_run_raises_its_own_error():
+    runner = DeadlineRunner()
+
+    async def failing_call():
+        raise RuntimeError("agent failed")
+
+    with pytest.raises(RuntimeError, match="agent failed"):
+        run(runner, failing_call)
+    stats = runner.stats()["agent"]
+    assert stats["failed"] == 1
+    assert stats["deadline_exceeded"] == 0
+
+
+def test_failure_reports_are_not_replies():
+    runner = DeadlineRunner()
+    is_valid = lambda text: bool(text) and not text.startswith("Error")
+    with pytest.raises(InvalidReply, match="Error processing message"):
+        run(runner, reply_after(0.0, "Error processing message: run expired"), is_valid=is_valid)
+    with pytest.raises(InvalidReply, match="empty reply"):
+        run(runner, reply_after(0.0, ""), is_valid=is_valid)
+    assert runner.stats()["agent"]["failed"] == 2
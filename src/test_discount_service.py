@@ -0,0 +1,139 @@
+import os
+import sqlite3
+
+import numpy as np
+import pytest
+
+from services.discount_service import (
+    DiscountDecision, DiscountLookup, compute_discount, discount_tier, explain_discount, score_customers
+)
+
+NAN = float("nan")
+
+
+def write_table(path, rows, built_at):
+    """Build a discount table the way the precompute job does: a temp file swapped in."""
+    temp_path = path + ".tmp"
+    connection = sqlite3.connect(temp_path)
+    connection.execute(
+        "CREATE TABLE discounts (CustomerID TEXT PRIMARY KEY, discount_percentage REAL, "
+        "discount_tier INTEGER, loyalty_tier TEXT, explanation TEXT) WITHOUT ROWID"
+    )
+    connection.execute("CREATE TABLE metadata (key TEXT PRIMARY KEY, value TEXT)")
+    connection.executemany("INSERT INTO discounts VALUES (?, ?, ?, ?, ?)", rows)
+    connection.execute("INSERT INTO metadata VALUES ('built_at', ?)", (repr(built_at),))
+    connection.commit()
+    connection.close()
+    os.replace(temp_path, path)
+
+
+def test_discount_lookup_hits_and_misses(tmp_path):
+    path = str(tmp_path / "discounts.sqlite")
+    write_table(path, [("C1", 12.5, 5, "Gold", "Gold discount")], built_at=1000.0)
+    lookup = DiscountLookup(path)
+
+    decision, explanation = lookup.get("C1")
+    assert decision.discount_percentage == 12.5
+    assert decision.discount_tier == 5
+    assert explanation == "Gold discount"
+    assert lookup.get("unknown") is None
+
+    stats = lookup.stats()
+    assert stats["hits"] == 1 and stats["misses"] == 1
+    assert stats["built_at"] == 1000.0
+    lookup.close()
+
+
+def test_discount_lookup_reopens_a_rebuilt_table(tmp_path):
+    path = str(tmp_path / "discounts.sqlite")
+    write_table(path, [("C1", 5.0, 1, "Bronze", "old")], built_at=1000.0)
+    lookup = DiscountLookup(path, check_interval=0.0)
+    assert lookup.get("C1")[1] == "old"
+
+    write_table(path, [("C1", 7.0, 2, "Silver", "new"), ("C2", 20.0, 6, "Platinum", "added")], built_at=2000.0)
+
+    assert lookup.get("C1")[1] == "new"
+    assert lookup.get("C2")[0].discount_percentage == 20.0
+    stats = lookup.stats()
+    assert stats["reloads"] == 1
+    assert stats["built_at"] == 2000.0
+    lookup.close()
+
+
+def test_discount_lookup_waits_for_the_check_interval(tmp_path):
+    path = str(tmp_path / "discounts.sqlite")
+    write_table(path, [("C1", 5.0, 1, "Bronze", "old")], built_at=1000.0)
+    lookup = DiscountLookup(path, check_interval=3600.0)
+    write_table(path, [("C1", 7.0, 2, "Silver", "new")], built_at=2000.0)
+
+    # Until the next check the table already open keeps serving
+    assert lookup.get("C1")[1] == "old"
+    lookup.close()
+
+
+@pytest.mark.parametrize("tier, tenure, churn, spend, percentage, tier_number", [
+    # Full loyalty, with and without churn risk
+    ("Platinum", 10, NAN, 1000.0, 25.0, 7),
+    ("Platinum", 10, 1.0, 1000.0, 25.0, 7),
+    ("Platinum", 10, 0.0, 1000.0, 13.0, 5),
+    # Out-of-range inputs are clipped
+    ("Platinum", 30, 5.0, 5000.0, 25.0, 7),
+    ("Bronze", -1, -1.0, -10.0, 1.5, 1),
+    # Unknown or missing tiers score like no tier
+    ("Diamond", 0, NAN, 0.0, 0.0, 1),
+    (None, 0, NAN, 0.0, 0.0, 1),
+    ("Bronze", 0, 0.0, 0.0, 1.5, 1),
+    # The two simulated customers; both land on a tier's upper boundary
+    ("Platinum", 5, 0.0, 524.21, 10.0, 3),
+    ("Silver", 2, 0.3, 121.53, 7.5, 2),
+])
+def test_score_customers(tier, tenure, churn, spend, percentage, tier_number):
+    result = score_customers([tier], [tenure], [churn], [spend])
+    assert result.tolist() == [percentage]
+    decision = compute_discount({
+        "CustomerID": "C1", "LoyaltyTier": tier, "Tenure": tenure, "Churn": churn, "TotalAmountSpentThisYear": spend
+    })
+    assert decision == DiscountDecision("C1", percentage, tier_number, str(tier))
+
+
+def test_missing_churn_ignores_tenure():
+    # Without churn data only tier and spend count, as the discount scheme prescribes
+    short, long = score_customers(["Gold", "Gold"], [0, 10], [NAN, NAN], [300.0, 300.0])
+    assert short == long
+    assert compute_discount({"LoyaltyTier": "Gold", "Tenure": 0, "TotalAmountSpentThisYear": 300.0}).discount_percentage == short
+
+
+@pytest.mark.parametrize("percentage, tier", [
+    (0.0, 1), (5.0, 1), (5.5, 2), (7.5, 2), (10.0, 3), (12.5, 4), (13.0, 5), (15.0, 5), (20.0, 6), (25.0, 7),
+])
+def test_discount_tier_boundaries_belong_to_the_lower_tier(percentage, tier):
+    assert discount_tier(percentage) == tier
+
+
+def test_scoring_is_deterministic_and_matches_single_profiles():
+    rng = np.random.default_rng(3)
+    size = 1000
+    tiers = rng.choice(["Platinum", "Gold", "Silver", "Bronze", "Unknown"], size)
+    tenure = rng.integers(0, 15, size)
+    churn = rng.random(size)
+    churn[::7] = NAN
+    spend = rng.gamma(2.0, 200.0, size)
+
+    first = score_customers(tiers, tenure, churn, spend)
+    assert np.array_equal(first, score_customers(tiers, tenure, churn, spend))
+    # Half-percent steps inside the overall range
+    assert np.all((first >= 0.0) & (first <= 25.0))
+    assert np.array_equal(first * 2, np.round(first * 2))
+    for index in range(0, size, 97):
+        decision = compute_discount({
+            "LoyaltyTier": tiers[index], "Tenure": tenure[index], "Churn": churn[index],
+            "TotalAmountSpentThisYear": spend[index],
+        })
+        assert decision.discount_percentage == first[index]
+
+
+def test_explanation_states_the_decided_discount():
+    decision = DiscountDecision("C1", 12.5, 4, "Gold")
+    assert explain_discount(decision, {"Tenure": 3}) == (
+        "As a Gold member for 3 years, you qualify for a 12.5% loyalty discount (Tier 4)."
+    )
@@ -0,0 +1,36 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("aiohttp")
+
+from services import image_service
+
+
+@pytest.fixture
+def storage_host(monkeypatch):
+    monkeypatch.setattr(image_service, "CONTENT_HASH_HOSTS", frozenset({"zava.blob.core.windows.net"}))
+
+
+@pytest.mark.parametrize("url, fetchable", [
+    ("https://zava.blob.core.windows.net/images/room.png", True),
+    ("https://ZAVA.blob.core.windows.net/images/room.png", True),
+    ("http://zava.blob.core.windows.net/images/room.png", False),
+    ("https://zava.blob.core.windows.net:8443/images/room.png", False),
+    ("https://other.blob.core.windows.net/images/room.png", False),
+    ("https://zava.blob.core.windows.net.evil.com/room.png", False),
+    ("http://169.254.169.254/metadata/instance", False),
+    ("http://localhost:8000/metrics", False),
+])
+def test_only_storage_hosts_are_downloaded(storage_host, url, fetchable):
+    assert image_service.is_content_hash_host(url) is fetchable
+
+
+def test_other_urls_are_keyed_without_a_download(storage_host, monkeypatch):
+    async def fail(image_url):
+        raise AssertionError(f"downloaded {image_url}")
+
+    monkeypatch.setattr(image_service, "_hash_remote_image", fail)
+    url = "http://169.254.169.254/metadata/instance"
+    key = asyncio.run(image_service.image_content_key(url))
+    assert key == image_service._url_fallback_key(url)
@@ -0,0 +1,109 @@
+import logging
+import time
+
+from services.inventory_service import (
+    SIMULATED_INVENTORY, InventorySnapshotCache, InventoryStore, SimulatedInventoryBackend, SQLiteInventoryBackend,
+    normalize_name
+)
+
+
+class CountingBackend(SimulatedInventoryBackend):
+    def __init__(self, rows=SIMULATED_INVENTORY):
+        super().__init__(dict(rows))
+        self.fetches = []
+        self.fetch_alls = 0
+
+    def fetch(self, product_ids):
+        self.fetches.append(list(product_ids))
+        return super().fetch(product_ids)
+
+    def fetch_all(self):
+        self.fetch_alls += 1
+        return super().fetch_all()
+
+
+def test_normalize_name():
+    assert normalize_name("Blue Painter's Tape") == normalize_name("  blue  painters TAPE ")
+
+
+def test_store_checks_a_cart_in_one_backend_query():
+    backend = CountingBackend()
+    store = InventoryStore(backend)
+    results = store.check({"paint": "PROD0001", "tape": "PROD0049", "missing": "PROD9999"})
+    assert [row["ProductName"] if row else None for row in results] == ["Pale Meadow", "Blue Painter's Tape", None]
+    assert backend.fetches == [["PROD0001", "PROD0049", "PROD9999"]]
+    assert store.stats()["unknown"] == 1
+
+
+def test_store_resolves_unique_names():
+    store = InventoryStore(CountingBackend())
+    assert store.check({"Ocean Mist": ""})[0]["Quantity"] == 221
+    assert store.check({"tape": "blue painters tape"})[0]["ProductName"] == "Blue Painter's Tape"
+
+
+def test_store_does_not_collapse_products_sharing_a_name(caplog):
+    store = InventoryStore(CountingBackend())
+    with caplog.at_level(logging.WARNING):
+        # Three products are named Whispering Blush; only their IDs tell them apart
+        by_name = store.check({"Whispering Blush": ""})
+    assert by_name == [None]
+    assert store.stats()["ambiguous"] == 1
+    assert "Whispering Blush" in caplog.text
+    by_id = store.check({"a": "PROD0004", "b": "PROD0028", "c": "PROD0032"})
+    assert [row["Quantity"] for row in by_id] == [56, 312, 154]
+
+
+def test_sqlite_backend_matches_the_simulated_rows():
+    backend = SQLiteInventoryBackend()
+    assert backend.fetch(["PROD0001", "PROD9999"]) == {"PROD0001": SIMULATED_INVENTORY["PROD0001"]}
+    assert len(backend.fetch_all()) == len(SIMULATED_INVENTORY)
+
+
+def test_snapshot_serves_reads_and_swaps_on_refresh():
+    backend = CountingBackend()
+    cache = InventorySnapshotCache(InventoryStore(backend), refresh_interval=3600, max_staleness=3600)
+    assert cache.check({"paint": "PROD0001"})[0]["Quantity"] == 312
+    first = cache._snapshot
+
+    backend.rows["PROD0001"] = {"ProductName": "Pale Meadow", "Quantity": 0, "Price": 29.99}
+    assert cache.check({"paint": "PROD0001"})[0]["Quantity"] == 312
+    cache.refresh()
+    assert cache.check({"paint": "PROD0001"})[0]["Quantity"] == 0
+    # The old snapshot is untouched by the swap
+    assert first.by_id["PROD0001"]["Quantity"] == 312
+    assert cache.stats()["version"] == 2
+    assert backend.fetches == []
+
+
+def test_snapshot_keeps_products_sharing_a_name_apart():
+    cache = InventorySnapshotCache(InventoryStore(CountingBackend()))
+    results = cache.check({"Whispering Blush": "", "a": "PROD0028", "Lilac Mist": "", "Dusty Rose": ""})
+    assert results[0] is None
+    assert results[1]["Quantity"] == 312
+    assert results[2] is None
+    assert results[3]["Quantity"] == 412
+    assert cache.stats()["duplicate_names"] == 4
+
+
+def test_stale_snapshot_is_bypassed_for_the_live_store():
+    backend = CountingBackend()
+    cache = InventorySnapshotCache(InventoryStore(backend), refresh_interval=3600, max_staleness=0.01)
+    cache.refresh()
+    time.sleep(0.02)
+    assert cache.check({"paint": "PROD0001"})[0]["Quantity"] == 312
+    assert backend.fetches == [["PROD0001"]]
+    assert cache.stats()["live_reads"] == 1
+
+
+def test_background_refresh_runs_on_the_timer():
+    backend = CountingBackend()
+    cache = InventorySnapshotCache(InventoryStore(backend), refresh_interval=0.02, max_staleness=3600)
+    cache.refresh()
+    cache.start()
+    try:
+        deadline = time.monotonic() + 2
+        while cache.stats()["version"] < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        cache.stop()
+    assert cache.stats()["version"] == 2
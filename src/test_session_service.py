@@ -0,0 +1,170 @@
+import asyncio
+
+from services.session_service import (
+    InMemorySessionStore, RedisSessionStore, SessionState, SqliteSessionStore, is_session_id, new_session_id
+)
+
+
+class FakeRedis:
+    """Minimal RESP server (GET/SET/DEL) whose SET replies arrive after a delay."""
+
+    def __init__(self, set_delay=0.0):
+        self.set_delay = set_delay
+        self.data = {}
+        self.connections = 0
+
+    async def _read_command(self, reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int((await reader.readline())[1:-2])
+            args.append((await reader.readexactly(length + 2))[:-2])
+        return args
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                args = await self._read_command(reader)
+                if args is None:
+                    break
+                command = args[0].upper()
+                if command == b"SET":
+                    self.data[args[1]] = args[2]
+                    await asyncio.sleep(self.set_delay)
+                    writer.write(b"+OK\r\n")
+                elif command == b"GET":
+                    value = self.data.get(args[1])
+                    writer.write(b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value))
+                elif command == b"DEL":
+                    writer.write(b":%d\r\n" % (self.data.pop(args[1], None) is not None))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        return self.server.sockets[0].getsockname()[1]
+
+
+def make_state(session_id, cart):
+    state = SessionState(session_id)
+    state.persistent_cart = cart
+    state.chat_history.append(("user", f"hello from {session_id}"))
+    state.history_version = 1
+    return state
+
+
+def test_session_state_round_trip():
+    state = make_state("A", [{"id": "PROD0001"}])
+    state.bad_prompts.add("bad")
+    loaded = SessionState.loads(state.dumps())
+    assert loaded.persistent_cart == [{"id": "PROD0001"}]
+    assert list(loaded.chat_history) == [("user", "hello from A")]
+    assert loaded.bad_prompts == {"bad"}
+    assert loaded.history_version == 1
+
+
+def test_in_memory_store_evicts_least_recently_used():
+    async def scenario():
+        store = InMemorySessionStore(max_sessions=2)
+        await store.save(SessionState("A"))
+        await store.save(SessionState("B"))
+        await store.load("A")
+        await store.save(SessionState("C"))
+        return await store.load("A"), await store.load("B"), await store.load("C")
+
+    a, b, c = asyncio.run(scenario())
+    assert a is not None and b is None and c is not None
+
+
+def test_sqlite_store_round_trip(tmp_path):
+    async def scenario():
+        store = SqliteSessionStore(str(tmp_path / "sessions.db"))
+        await store.save(make_state("A", ["paint"]))
+        loaded = await store.load("A")
+        await store.delete("A")
+        missing = await store.load("A")
+        await store.close()
+        return loaded, missing
+
+    loaded, missing = asyncio.run(scenario())
+    assert loaded.persistent_cart == ["paint"]
+    assert missing is None
+
+
+def test_redis_store_round_trip():
+    async def scenario():
+        server = FakeRedis()
+        port = await server.start()
+        store = RedisSessionStore(f"redis://127.0.0.1:{port}/0")
+        await store.save(make_state("A", ["paint"]))
+        loaded = await store.load("A")
+        missing = await store.load("B")
+        await store.close()
+        server.server.close()
+        return loaded, missing
+
+    loaded, missing = asyncio.run(scenario())
+    assert loaded.persistent_cart == ["paint"]
+    assert missing is None
+
+
+def test_redis_store_cancelled_command_does_not_leak_replies():
+    async def scenario():
+        server = FakeRedis(set_delay=0.2)
+        port = await server.start()
+        store = RedisSessionStore(f"redis://127.0.0.1:{port}/0")
+        await store.save(make_state("A", ["cart of A"]))
+
+        # Cancel a save after its request is sent and before its reply is read
+        save = asyncio.create_task(store.save(make_state("B", ["cart of B"])))
+        await asyncio.sleep(0.05)
+        save.cancel()
+        try:
+            await save
+        except asyncio.CancelledError:
+            pass
+
+        server.set_delay = 0.0
+        loaded_a = await store.load("A")
+        loaded_c = await store.load("C")
+        await store.close()
+        server.server.close()
+        return loaded_a, loaded_c, server.connections
+
+    loaded_a, loaded_c, connections = asyncio.run(scenario())
+    assert loaded_a.session_id == "A"
+    assert loaded_a.persistent_cart == ["cart of A"]
+    assert loaded_c is None
+    # The interrupted connection was dropped rather than reused
+    assert connections == 2
+
+
+def test_session_ids_must_have_the_minted_shape():
+    assert is_session_id(new_session_id())
+    assert not is_session_id(None)
+    assert not is_session_id("attacker-chosen")
+    assert not is_session_id("A" * 32)
+    assert not is_session_id(new_session_id() + "0")
+
+
+def test_sqlite_store_purges_expired_sessions(tmp_path):
+    async def scenario():
+        store = SqliteSessionStore(str(tmp_path / "nested" / "sessions.db"), ttl_seconds=0.05, purge_interval=0.0)
+        await store.save(make_state("old", []))
+        await asyncio.sleep(0.1)
+        await store.save(make_state("new", []))
+        rows = store._conn.execute("SELECT session_id FROM sessions").fetchall()
+        expired = await store.load("old")
+        await store.close()
+        return rows, expired, store.purged
+
+    rows, expired, purged = asyncio.run(scenario())
+    assert rows == [("new",)]
+    assert expired is None
+    assert purged == 1
@@ -0,0 +1,69 @@
+import asyncio
+
+from services.turn_service import SessionTurnQueue, TurnQueueMetrics
+
+
+def run_queue(messages, handler_delay=0.05, cancel_superseded=True, maxsize=4, gap=0.0, reply_first=False):
+    """Submit messages to a queue and return (handled, after_turn calls, metrics, accepted)."""
+    async def scenario():
+        handled, after = [], []
+
+        async def handler(message, superseded):
+            if reply_first:
+                queue.mark_replied()
+            if not superseded:
+                await asyncio.sleep(handler_delay)
+            handled.append((message, superseded))
+
+        async def after_turn(cancelled):
+            after.append(cancelled)
+
+        metrics = TurnQueueMetrics()
+        queue = SessionTurnQueue(handler, after_turn, metrics, maxsize=maxsize, cancel_superseded=cancel_superseded)
+        queue.start()
+        accepted = []
+        for message in messages:
+            accepted.append(queue.submit(message))
+            if gap is not None:
+                await asyncio.sleep(gap)
+        await asyncio.sleep(handler_delay * (len(messages) + 2))
+        await queue.close()
+        return handled, after, metrics, accepted
+
+    return asyncio.run(scenario())
+
+
+def test_turns_run_in_order_one_at_a_time():
+    handled, after, metrics, _ = run_queue(["a", "b", "c"], cancel_superseded=False, gap=0.0)
+    assert handled == [("a", False), ("b", False), ("c", False)]
+    assert after == [False, False, False]
+    assert metrics.completed == 3 and metrics.depth == 0
+
+
+def test_newer_message_cancels_the_running_turn():
+    handled, after, metrics, _ = run_queue(["a", "b"], handler_delay=0.1, gap=0.02)
+    # "a" was cancelled mid-run; "b" completed
+    assert handled == [("b", False)]
+    assert after == [True, False]
+    assert metrics.cancelled == 1
+
+
+def test_queued_messages_behind_a_newer_one_are_only_recorded():
+    handled, _, metrics, _ = run_queue(["a", "b", "c"], handler_delay=0.05, gap=0.0)
+    assert handled == [("b", True), ("c", False)]
+    assert metrics.superseded == 1
+
+
+def test_full_queue_rejects():
+    # Submitted before the worker takes any of them
+    _, _, metrics, accepted = run_queue(["a", "b", "c"], cancel_superseded=False, maxsize=1, gap=None)
+    assert accepted == [True, False, False]
+    assert metrics.rejected == 2
+
+
+def test_a_turn_that_started_answering_is_not_cancelled():
+    handled, after, metrics, _ = run_queue(["a", "b"], handler_delay=0.05, gap=0.02, reply_first=True)
+    # "b" is a separate question, not a correction: it waits for the answer to "a"
+    assert handled == [("a", False), ("b", False)]
+    assert after == [False, False]
+    assert metrics.cancelled == 0
@@ -0,0 +1,91 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+class AsyncTTLCache:
+    """
+    Process-wide LRU cache with TTL expiry, hit/miss counters and single-flight loading:
+    concurrent lookups of a missing key share one in-flight load instead of racing.
+    """
+
+    def __init__(self, max_size: int = 256, ttl_seconds: float = 3600.0, name: str = "cache"):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.name = name
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def _get_fresh(self, key: Hashable):
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            self.evictions += 1
+            return False, None
+        self._entries.move_to_end(key)
+        return True, value
+
+    def get(self, key: Hashable, default=None):
+        """Return a cached value without loading it."""
+        found, value = self._get_fresh(key)
+        if found:
+            self.hits += 1
+            return value
+        self.misses += 1
+        return default
+
+    def set(self, key: Hashable, value: Any):
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]):
+        """Return the cached value for key, loading it once if missing or expired."""
+        found, value = self._get_fresh(key)
+        if found:
+            self.hits += 1
+            return value
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(self._load(key, loader))
+            self._inflight[key] = task
+        # Shield so a cancelled waiter does not cancel the load shared by the others
+        return await asyncio.shield(task)
+
+    async def _load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]):
+        try:
+            value = await loader()
+            self.set(key, value)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "name": self.name,
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "in_flight": len(self._inflight),
+            "hit_rate": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+        }
@@ -1,6 +1,7 @@
 from collections import deque
 from typing import Deque, Tuple
 import json
+import orjson
 
 def format_chat_history(chat_history: Deque[Tuple[str, str]]) -> str:
     """Format chat history for the router prompt."""
@@ -9,6 +10,32 @@ def format_chat_history(chat_history: Deque[Tuple[str, str]]) -> str:
         for role, msg in chat_history
     ])
 
+def parse_conversation_history(conversation_history: str, maxlen: int = 5) -> Deque[Tuple[str, str]]:
+    """
+    Parse a full "user: message\nbot: message" history string sent by the client.
+    Bot messages in JSON form are reduced to their answer to drop large product data.
+    """
+    history = deque(maxlen=maxlen)
+    for line in conversation_history.strip().split('\n'):
+        if line.startswith('user: '):
+            history.append(("user", line[6:]))
+        elif line.startswith('bot: '):
+            bot_msg = line[5:]
+            try:
+                parsed_bot = orjson.loads(bot_msg)
+                # Handle list format (new agent response format)
+                if isinstance(parsed_bot, list) and len(parsed_bot) > 0:
+                    first_item = parsed_bot[0]
+                    if isinstance(first_item, dict) and "answer" in first_item:
+                        bot_msg = first_item["answer"]
+                # Handle dict format (old format)
+                elif isinstance(parsed_bot, dict) and "answer" in parsed_bot:
+                    bot_msg = parsed_bot["answer"]
+            except (orjson.JSONDecodeError, TypeError):
+                pass
+            history.append(("bot", bot_msg))
+    return history
+
 def clean_conversation_history(history: Deque[Tuple[str, str]]) -> Deque[Tuple[str, str]]:
     """
     Clean conversation history by removing large product data and keeping only essential information.
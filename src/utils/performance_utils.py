@@ -64,6 +64,13 @@ class PerformanceMonitor:
         self.metrics.clear()
         self.start_times.clear()
 
+def percentile(values, fraction: float) -> float:
+    """Return the given percentile (0-1) of a list of values (nearest rank)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
 # Global performance monitor instance
 performance_monitor = PerformanceMonitor()
 
@@ -0,0 +1,85 @@
+import re
+
+_ANSWER_KEY = re.compile(r'"answer"\s*:\s*"')
+_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+class AnswerStreamExtractor:
+    """
+    Incrementally extract the "answer" field from a streamed model reply.
+    Replies that start like JSON (object, array or code block) only have the
+    decoded "answer" string forwarded; any other reply is passed through as-is.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._state = "detect"
+
+    def feed(self, chunk: str) -> str:
+        """Consume a raw delta and return the answer text it completes (may be empty)."""
+        self._buffer += chunk
+        if self._state == "detect":
+            stripped = self._buffer.lstrip()
+            if not stripped:
+                return ""
+            self._state = "seek" if stripped[0] in "{[`" else "plain"
+        if self._state == "plain":
+            text, self._buffer = self._buffer, ""
+            return text
+        if self._state == "seek":
+            match = _ANSWER_KEY.search(self._buffer)
+            if not match:
+                return ""
+            self._buffer = self._buffer[match.end():]
+            self._state = "answer"
+        if self._state == "answer":
+            return self._decode_answer()
+        return ""
+
+    def _decode_answer(self) -> str:
+        """Decode buffered JSON string characters up to the closing quote."""
+        buf = self._buffer
+        out = []
+        i = 0
+        while i < len(buf):
+            ch = buf[i]
+            if ch == '"':
+                self._state = "done"
+                i += 1
+                break
+            if ch != '\\':
+                out.append(ch)
+                i += 1
+                continue
+            # Escape sequences may be split across deltas; wait for the rest
+            if i + 1 >= len(buf):
+                break
+            esc = buf[i + 1]
+            if esc != 'u':
+                out.append(_ESCAPES.get(esc, esc))
+                i += 2
+                continue
+            if i + 6 > len(buf):
+                break
+            try:
+                code = int(buf[i + 2:i + 6], 16)
+            except ValueError:
+                code = 0xFFFD
+            if 0xD800 <= code < 0xDC00:
+                # Surrogate pair: both halves are needed to emit a valid character
+                if i + 12 > len(buf):
+                    break
+                try:
+                    low = int(buf[i + 8:i + 12], 16) if buf[i + 6:i + 8] == '\\u' else 0
+                except ValueError:
+                    low = 0
+                if 0xDC00 <= low < 0xE000:
+                    out.append(chr(0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)))
+                    i += 12
+                    continue
+                code = 0xFFFD
+            elif 0xDC00 <= code < 0xE000:
+                code = 0xFFFD
+            out.append(chr(code))
+            i += 6
+        self._buffer = buf[i:]
+        return "".join(out)
@@ -0,0 +1,25 @@
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_configured_pid = None
+
+def configure_telemetry() -> bool:
+    """
+    Configure Azure Monitor tracing once per process. The guard is keyed by pid so a
+    forked worker configures its own exporter (the parent's export threads do not
+    survive fork) while repeated calls within one worker are no-ops.
+    """
+    global _configured_pid
+    with _lock:
+        if _configured_pid == os.getpid():
+            return False
+        # Imported lazily so importing this module stays cheap and fork-safe
+        from azure.monitor.opentelemetry import configure_azure_monitor
+        configure_azure_monitor(connection_string=os.environ["APPLICATIONINSIGHTS_CONNECTION_STRING"])
+        _configured_pid = os.getpid()
+        logger.info(f"Azure Monitor telemetry configured for worker {_configured_pid}")
+        return True